@@ -15,8 +15,10 @@
  **/
 import Nbmolviz3dModel from './nbmolviz_3d_model';
 import Nbmolviz3dView from './nbmolviz_3d_view';
+import PlaybackSyncModel from './playback_sync_model';
 
 module.exports = {
   MolWidget3DModel: Nbmolviz3dModel,
   MolWidget3DView: Nbmolviz3dView,
+  PlaybackSyncModel,
 };
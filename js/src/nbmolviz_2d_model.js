@@ -14,6 +14,7 @@
  * limitations under the License.
  */
 import widgets from 'jupyter-js-widgets';
+import handleFunctionCall from './utils/function_calls';
 
 const Nbmolviz2dModel = widgets.DOMWidgetModel.extend({
   defaults: {
@@ -40,6 +41,16 @@ const Nbmolviz2dModel = widgets.DOMWidgetModel.extend({
     width: 500.0,
     height: 500.0,
   },
+
+  initialize(...args) {
+    widgets.DOMWidgetModel.prototype.initialize.apply(this, args);
+    this.on('msg:custom', (content) => {
+      if (content.event === 'function_call') {
+        handleFunctionCall(this, content);
+      }
+    });
+    this.send({ event: 'ready' });
+  },
 });
 
 export default Nbmolviz2dModel;
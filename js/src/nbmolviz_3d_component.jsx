@@ -21,19 +21,27 @@ import assert from 'assert';
 
 class Nbmolviz3dComponent extends React.Component {
   static getStateFromModel(model) {
-    const oldModelData = model.get('model_data');
+    const topology = model.getModelData();
     const positions = model.get('positions');
-    const modelData = JSON.parse(JSON.stringify(oldModelData));
+    const modelData = Object.assign({}, topology);
 
-    if (modelData.hasOwnProperty('atoms')) {
-        assert(modelData.atoms.length == positions.length);
-        for (let i = 0; i < modelData.atoms.length; i++) {
-            modelData.atoms[i].positions = positions[i];
-        }
+    if (topology.hasOwnProperty('atoms') && positions) {
+      // positions arrive as a flat float32 buffer of shape (num_atoms, 3)
+      const xyz = positions.data;
+      assert(topology.atoms.length * 3 === xyz.length);
+      modelData.atoms = topology.atoms.map((atom, i) => Object.assign({}, atom, {
+        positions: [xyz[3 * i], xyz[(3 * i) + 1], xyz[(3 * i) + 2]],
+      }));
     }
 
     const orbital = JSON.parse(JSON.stringify(model.get('volumetric_style')));
     orbital.cube_file = model.get('cubefile');
+    const volume = model.getVolume();
+    if (volume) {
+      // Molecule3d reads cube_file; volume_data is the same grid, without text parsing
+      orbital.volume_data = volume.volumeData;
+      orbital.cube_file = volume.cubeFile;
+    }
 
     return {
       atomLabelsShown: model.get('atom_labels_shown'),
@@ -49,8 +57,8 @@ class Nbmolviz3dComponent extends React.Component {
       outlineWidth: model.get('outline_width'),
       selectedAtomIds: model.get('selected_atom_indices'),
       selectionType: model.get('selection_type'),
-      shapes: model.get('shapes'),
-      styles: model.get('styles'),
+      shapes: model.getExpandedShapes(),
+      styles: model.getAtomStyles(),
       width: model.get('width'),
     };
   }
@@ -69,7 +77,7 @@ class Nbmolviz3dComponent extends React.Component {
 
   onChangeSelection(selectedAtomIds) {
     this.props.model.set('selected_atom_indices', selectedAtomIds);
-    this.props.model.save();
+    this.props.model.save_changes();
   }
 
   componenWillReceiveProps(nextProps) {
@@ -14,6 +14,99 @@
  * limitations under the License.
  */
 import widgets from 'jupyter-js-widgets';
+import {
+  arraySerializers,
+  deserializeArray,
+  nestedArraySerializers,
+  restoreArrays,
+  typedArray,
+} from './utils/serializers';
+import handleFunctionCall from './utils/function_calls';
+import { ENCODING as FRAME_ENCODING, decodeFrame } from './utils/frame_codec';
+import { expandShapes, expandStyles } from './utils/shapes';
+import { toVolumeData, volumeToCube } from './utils/volume';
+
+/**
+ * Styles arrive as an int32 style id for each atom plus a table of the distinct styles
+ */
+const styleTableSerializers = {
+  deserialize(value) {
+    if (value === null || value === undefined) {
+      return null;
+    }
+    return { ids: deserializeArray(value.ids), table: value.table };
+  },
+};
+
+/**
+ * Turns the columnar topology from nbmolviz.base.mdt2json into the lists of
+ * atom, bond, residue and chain objects that Molecule3d expects
+ */
+function decodeModelData(encoded) {
+  if (!encoded.atoms || Array.isArray(encoded.atoms)) {
+    return encoded;
+  }
+  const strings = encoded.strings;
+
+  const chains = [];
+  for (let i = 0; i < encoded.chains.name.data.length; i++) {
+    chains.push({ name: strings[encoded.chains.name.data[i]], description: '' });
+  }
+
+  const residues = [];
+  const res = encoded.residues;
+  for (let i = 0; i < res.name.data.length; i++) {
+    const seqnum = res.sequence_number.data[i];
+    residues.push({
+      name: strings[res.name.data[i]],
+      sequence_number: Number.isNaN(seqnum) ? null : seqnum,
+      chain_index: res.chain_index.data[i],
+    });
+  }
+
+  // in level-of-detail mode, only some atoms are sent; serial is the index in the full molecule
+  const atoms = [];
+  const at = encoded.atoms;
+  for (let i = 0; i < at.name.data.length; i++) {
+    const residue = residues[at.residue_index.data[i]] || {};
+    const chain = chains[residue.chain_index] || {};
+    atoms.push({
+      serial: at.serial ? at.serial.data[i] : i,
+      name: strings[at.name.data[i]],
+      elem: strings[at.elem.data[i]],
+      mass_magnitude: at.mass_magnitude.data[i],
+      residue_index: at.residue_index.data[i],
+      residue_name: residue.name,
+      chain: chain.name,
+    });
+  }
+
+  const bonds = [];
+  for (let i = 0; i < encoded.bonds.atom1_index.data.length; i++) {
+    bonds.push({
+      atom1_index: encoded.bonds.atom1_index.data[i],
+      atom2_index: encoded.bonds.atom2_index.data[i],
+      bond_order: encoded.bonds.bond_order.data[i],
+    });
+  }
+
+  return { name: encoded.name, atoms, bonds, residues, chains };
+}
+
+/**
+ * New flat typed array containing the items at these indices (each item is `stride` elements
+ * long), followed by the items in `extra`
+ */
+function takeAndAppend(data, indices, extra, stride = 1) {
+  const result = new data.constructor((indices.length + (extra.length / stride)) * stride);
+  for (let i = 0; i < indices.length; i++) {
+    for (let j = 0; j < stride; j++) {
+      result[(i * stride) + j] = data[(indices[i] * stride) + j];
+    }
+  }
+  result.set(extra, indices.length * stride);
+  return result;
+}
 
 const Nbmolviz3dModel = widgets.DOMWidgetModel.extend({
   defaults: {
@@ -21,26 +114,294 @@ const Nbmolviz3dModel = widgets.DOMWidgetModel.extend({
     background_color: '#545c85',
     background_opacity: 1.0,
     cubefile: '',
+    current_frame: 0,
+    first_frame: 0,
+    frame_rate: 30.0,
+    frames: null,
     height: '500px',
-    model_data: { atoms: [], bonds: [] },
+    model_data: {},
+    volume: {},
     volumetric_style: {
       iso_val: null,
       opacity: null,
       negativeVolumetricColor: null,
       positiveVolumetricColor: null,
     },
-    styles: {},
+    styles: null,
     selected_atom_indices: [],
     selection_type: 'Atom',
-    shapes: [],
+    shapes: {},
     width: '100%',
     labels: [],
-    positions: [],
+    positions: null,
     near_clip: null,
     far_clip: null,
     outline_color: '#000000',
     outline_width: 0.0,
+    playing: false,
+  },
+
+  initialize(...args) {
+    widgets.DOMWidgetModel.prototype.initialize.apply(this, args);
+    this.on('msg:custom', this.onCustomMessage, this);
+    this.on('change:current_frame change:frames', this.showFrame, this);
+    this.on('change:playing', this.updatePlayback, this);
+    this.send({ event: 'ready' });
+    this.updatePlayback();
+  },
+
+  /**
+   * Start or stop animating the frames that were uploaded by GeometryViewer.load_frames
+   */
+  updatePlayback() {
+    if (this.get('playing') && !this.animationRequest) {
+      this.playbackStart = null;
+      this.animationRequest = requestAnimationFrame(time => this.animate(time));
+    }
+  },
+
+  animate(time) {
+    const frames = this.get('frames');
+    if (!this.get('playing') || !frames || !frames.shape[0]) {
+      this.animationRequest = null;
+      return;
+    }
+    if (this.playbackStart === null) {
+      this.playbackStart = time;
+      this.playbackStartFrame = this.get('current_frame') - this.get('first_frame');
+    }
+
+    // loop over the loaded frames; only the frame number is sent back to python
+    const numFrames = frames.shape[0];
+    const elapsed = Math.floor(((time - this.playbackStart) / 1000.0) * this.get('frame_rate'));
+    const offset = (((this.playbackStartFrame + elapsed) % numFrames) + numFrames) % numFrames;
+    const frame = this.get('first_frame') + offset;
+    if (frame !== this.get('current_frame')) {
+      this.set('current_frame', frame);
+      this.save_changes();
+    }
+    this.animationRequest = requestAnimationFrame(t => this.animate(t));
+  },
+
+  /**
+   * If the current frame was uploaded, copy its coordinates into the positions array (in
+   * place, so that they aren't synced back to python). Frames are either a plain float32 array
+   * or quantized and delta-encoded (see nbmolviz.base.framecodec)
+   */
+  showFrame() {
+    const frames = this.get('frames');
+    const positions = this.get('positions');
+    if (!frames || !positions) {
+      return;
+    }
+    const index = this.get('current_frame') - this.get('first_frame');
+    const size = frames.shape[1] * 3;
+    if (index < 0 || index >= frames.shape[0] || positions.data.length !== size) {
+      return;
+    }
+    if (frames.encoding === FRAME_ENCODING) {
+      decodeFrame(frames, index, positions.data);
+    } else {
+      positions.data.set(frames.data.subarray(index * size, (index + 1) * size));
+    }
+    this.trigger('change:positions', this);
+    this.trigger('change', this);
+  },
+
+  /**
+   * Show a frame that python already knows is shown (see PlaybackSyncModel). Like a state
+   * update from the kernel, this bypasses WidgetModel.set, so current_frame isn't left among
+   * the changes that the next save_changes() sends back to python.
+   */
+  setFrameFromKernel(frame) {
+    widgets.WidgetModel.__super__.set.call(this, 'current_frame', frame);
+  },
+
+  /**
+   * Indices of the selected atoms (for MessageWidget.call)
+   */
+  getSelection() {
+    return this.get('selected_atom_indices');
+  },
+
+  /**
+   * The decoded topology (decoded only once each time model_data changes)
+   */
+  getModelData() {
+    const encoded = this.get('model_data');
+    if (encoded !== this.encodedModelData) {
+      this.encodedModelData = encoded;
+      this.decodedModelData = decodeModelData(encoded);
+    }
+    return this.decodedModelData;
+  },
+
+  /**
+   * The volumetric data sent by GeometryViewer.set_volume as {volumeData, cubeFile}, or null
+   * (converted only once each time the volume changes)
+   */
+  getVolume() {
+    const volume = this.get('volume');
+    if (!volume || !volume.values) {
+      return null;
+    }
+    if (volume !== this.rawVolume) {
+      this.rawVolume = volume;
+      this.convertedVolume = { volumeData: toVolumeData(volume), cubeFile: volumeToCube(volume) };
+    }
+    return this.convertedVolume;
+  },
+
+  /**
+   * The shapes as Molecule3d draws them (expanded only once each time the shapes change)
+   */
+  getExpandedShapes() {
+    const shapes = this.get('shapes');
+    if (shapes !== this.rawShapes) {
+      this.rawShapes = shapes;
+      this.expandedShapes = expandShapes(shapes);
+    }
+    return this.expandedShapes;
+  },
+
+  /**
+   * The per-atom styles that Molecule3d expects (expanded only once each time the styles or
+   * the topology change)
+   */
+  getAtomStyles() {
+    const styleTable = this.get('styles');
+    const topology = this.getModelData();
+    if (styleTable !== this.rawStyles || topology !== this.stylesTopology) {
+      this.rawStyles = styleTable;
+      this.stylesTopology = topology;
+      this.atomStyles = expandStyles(styleTable, topology.atoms);
+    }
+    return this.atomStyles;
+  },
+
+  onCustomMessage(content, buffers) {
+    if (content.event === 'positions_patch') {
+      this.applyPositionsPatch(buffers);
+    } else if (content.event === 'shapes') {
+      this.applyShapeOps(restoreArrays(content.ops, buffers));
+    } else if (content.event === 'function_call') {
+      handleFunctionCall(this, content);
+    } else if (content.event === 'shown_atoms') {
+      this.applyShownAtomsDiff(restoreArrays(content, buffers));
+    }
+  },
+
+  /**
+   * Remove the atoms that left the region of interest, and append the ones that entered it
+   * (see GeometryViewer._show_atoms). Bonds in the diff already use the new atom order.
+   * Everything is modified in place so that these changes aren't synced back to python.
+   */
+  applyShownAtomsDiff(diff) {
+    const encoded = this.get('model_data');
+    const removed = new Set(diff.removed.data);
+    const serials = encoded.atoms.serial.data;
+
+    const kept = [];
+    const newIndex = new Int32Array(serials.length).fill(-1);
+    for (let i = 0; i < serials.length; i++) {
+      if (!removed.has(serials[i])) {
+        newIndex[i] = kept.length;
+        kept.push(i);
+      }
+    }
+
+    Object.keys(encoded.atoms).forEach((key) => {
+      const column = encoded.atoms[key];
+      column.data = takeAndAppend(column.data, kept, diff.atoms[key].data);
+      column.shape = [column.data.length];
+    });
+
+    const bonds = encoded.bonds;
+    const keptBonds = [];
+    for (let i = 0; i < bonds.atom1_index.data.length; i++) {
+      if (newIndex[bonds.atom1_index.data[i]] >= 0 && newIndex[bonds.atom2_index.data[i]] >= 0) {
+        keptBonds.push(i);
+      }
+    }
+    Object.keys(bonds).forEach((key) => {
+      const column = bonds[key];
+      let data = column.data;
+      if (key !== 'bond_order') {
+        data = data.map(index => newIndex[index]);
+      }
+      column.data = takeAndAppend(data, keptBonds, diff.bonds[key].data);
+      column.shape = [column.data.length];
+    });
+    this.encodedModelData = null;  // so that it's decoded again
+
+    const positions = this.get('positions');
+    positions.data = takeAndAppend(positions.data, kept, diff.positions.data, 3);
+    positions.shape = [positions.data.length / 3, 3];
+
+    const styles = this.get('styles');
+    styles.ids.data = takeAndAppend(styles.ids.data, kept, diff.style_ids.data);
+    styles.table = diff.style_table;
+    this.rawStyles = null;  // so that they're expanded again
+
+    this.trigger('change:model_data', this);
+    this.trigger('change', this);
+  },
+
+  /**
+   * Add, update or remove individual shapes, which are stored by id.
+   * The shapes object is modified in place so that these changes aren't synced back to python.
+   */
+  applyShapeOps(ops) {
+    const shapes = this.get('shapes');
+    ops.forEach((op) => {
+      if (op.op === 'add' || op.op === 'update') {
+        shapes[op.id] = op.shape;
+      } else if (op.op === 'remove') {
+        delete shapes[op.id];
+      } else if (op.op === 'clear') {
+        Object.keys(shapes).forEach((id) => { delete shapes[id]; });
+      }
+    });
+    this.rawShapes = null;  // so that they're expanded again
+    this.trigger('change:shapes', this);
+    this.trigger('change', this);
+  },
+
+  /**
+   * Overwrite the coordinates of every atom (in place, so they aren't synced back to python)
+   */
+  applyPositions(xyz) {
+    this.get('positions').data.set(xyz);
+    this.trigger('change:positions', this);
+    this.trigger('change', this);
+  },
+
+  /**
+   * Overwrite the coordinates of the atoms that moved (buffers: int32 indices, float32 xyz)
+   */
+  applyPositionsPatch(buffers) {
+    const indices = typedArray('int32', buffers[0]);
+    const xyz = typedArray('float32', buffers[1]);
+    const positions = this.get('positions').data;
+
+    for (let i = 0; i < indices.length; i++) {
+      const offset = 3 * indices[i];
+      positions[offset] = xyz[3 * i];
+      positions[offset + 1] = xyz[(3 * i) + 1];
+      positions[offset + 2] = xyz[(3 * i) + 2];
+    }
+    this.trigger('change:positions', this);
+    this.trigger('change', this);
   },
+}, {
+  serializers: Object.assign({}, widgets.DOMWidgetModel.serializers, {
+    positions: arraySerializers,
+    frames: nestedArraySerializers,
+    styles: styleTableSerializers,
+    shapes: nestedArraySerializers,
+    model_data: nestedArraySerializers,
+    volume: nestedArraySerializers,
+  }),
 });
 
 export default Nbmolviz3dModel;
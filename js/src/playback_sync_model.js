@@ -0,0 +1,50 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+import widgets from 'jupyter-js-widgets';
+import { typedArray } from './utils/serializers';
+
+/**
+ * Counterpart to nbmolviz.viewers.playback_group._FrameSync: applies one 'frames' message to
+ * every 3D viewer in a playback group
+ */
+const PlaybackSyncModel = widgets.WidgetModel.extend({
+  defaults: {
+    viewers: [],
+  },
+
+  initialize(...args) {
+    widgets.WidgetModel.prototype.initialize.apply(this, args);
+    this.on('msg:custom', this.onCustomMessage, this);
+  },
+
+  onCustomMessage(content, buffers) {
+    if (content.event === 'frames') {
+      this.get('viewers').forEach((viewer, i) => {
+        viewer.setFrameFromKernel(content.frames[i]);  // shows it, if it was preloaded
+        const index = content.buffer_index[i];
+        if (index !== null) {
+          viewer.applyPositions(typedArray('float32', buffers[index]));
+        }
+      });
+    }
+  },
+}, {
+  serializers: Object.assign({}, widgets.WidgetModel.serializers, {
+    viewers: { deserialize: widgets.unpack_models },
+  }),
+});
+
+export default PlaybackSyncModel;
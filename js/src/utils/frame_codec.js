@@ -0,0 +1,103 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Decoder for frames encoded by nbmolviz.base.framecodec.encode_frames
+ */
+const ENCODING = 'quantized_rice_delta';
+const ESCAPE = 32;
+
+/**
+ * Unsigned integer stored in `count` bits starting at bit `offset` (least significant first)
+ */
+function readBits(bytes, offset, count) {
+  let value = 0;
+  for (let b = 0; b < count; b++) {
+    const bit = offset + b;
+    value += ((bytes[bit >> 3] >> (bit & 7)) & 1) * (2 ** b);
+  }
+  return value;
+}
+
+/**
+ * Adds the deltas for frame `frame` (which isn't a keyframe) to `quantized`
+ */
+function applyDeltas(encoded, frame, quantized, exceptions) {
+  const size = quantized.length;
+  const k = encoded.rice_k;
+  const unary = encoded.unary.data;
+  const remainders = encoded.remainders.data;
+  const row = frame - 1 - Math.floor(frame / encoded.keyframe_interval);
+  let bit = encoded.frame_offsets.data[row];
+
+  for (let j = 0; j < size; j++) {
+    let high = 0;
+    while (!((unary[bit >> 3] >> (bit & 7)) & 1)) {
+      high++;
+      bit++;
+    }
+    bit++;
+
+    const index = (row * size) + j;
+    let delta;
+    if (high === ESCAPE) {
+      delta = exceptions.get(index);
+    } else {
+      const zigzag = (high * (2 ** k)) + readBits(remainders, index * k, k);
+      delta = (zigzag % 2) ? -(zigzag + 1) / 2 : zigzag / 2;
+    }
+    quantized[j] += delta;  // eslint-disable-line no-param-reassign
+  }
+}
+
+/**
+ * Decodes one frame into `out` (a Float32Array with 3 entries per atom). Decoding state is
+ * kept on the encoded object, so playing frames in order only applies one delta per frame.
+ */
+function decodeFrame(encoded, frame, out) {
+  const size = encoded.shape[1] * 3;
+  const interval = encoded.keyframe_interval;
+  const keyframe = Math.floor(frame / interval) * interval;
+
+  let state = encoded.decoderState;
+  if (!state) {
+    const exceptions = new Map();
+    for (let i = 0; i < encoded.exception_index.data.length; i++) {
+      exceptions.set(encoded.exception_index.data[i], encoded.exception_value.data[i]);
+    }
+    state = { exceptions, frame: -1, quantized: new Float64Array(size) };
+    encoded.decoderState = state;  // eslint-disable-line no-param-reassign
+  }
+  if (state.frame < keyframe || state.frame > frame) {
+    const bits = encoded.keyframe_bits;
+    const start = (keyframe / interval) * size;
+    for (let j = 0; j < size; j++) {
+      state.quantized[j] = encoded.keyframe_base +
+        readBits(encoded.keyframes.data, (start + j) * bits, bits);
+    }
+    state.frame = keyframe;
+  }
+  for (let f = state.frame + 1; f <= frame; f++) {
+    applyDeltas(encoded, f, state.quantized, state.exceptions);
+  }
+  state.frame = frame;
+
+  for (let j = 0; j < size; j++) {
+    out[j] = state.quantized[j] * encoded.precision; // eslint-disable-line no-param-reassign
+  }
+}
+
+export { ENCODING, decodeFrame };
@@ -0,0 +1,53 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Calls the model method named in a 'function_call' message. Methods may return promises.
+ * Returns a promise for {call_id, result, error}.
+ */
+function callFunction(model, content) {
+  return Promise.resolve()
+    .then(() => {
+      const func = model[content.function_name];
+      if (typeof func !== 'function') {
+        throw new Error(`Unknown function ${content.function_name}`);
+      }
+      return func.apply(model, content.arguments);
+    })
+    .then(
+      result => ({ call_id: content.call_id, result: result === undefined ? null : result, error: null }),
+      error => ({ call_id: content.call_id, result: null, error: error.toString() }),
+    );
+}
+
+/**
+ * Answers a 'function_call' message from nbmolviz.base.MessageWidget.viewer with a
+ * 'function_done' message containing the function's result (or error).
+ *
+ * A call to 'batchCommands' carries a list of function calls; they're started in order, and
+ * answered together with a single 'batch_done' message once they've all finished.
+ */
+function handleFunctionCall(model, content) {
+  if (content.function_name === 'batchCommands') {
+    Promise.all(content.arguments.map(call => callFunction(model, call)))
+      .then(results => model.send({ event: 'batch_done', results }));
+  } else {
+    callFunction(model, content)
+      .then(reply => model.send(Object.assign({ event: 'function_done' }, reply)));
+  }
+}
+
+export default handleFunctionCall;
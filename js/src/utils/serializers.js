@@ -0,0 +1,131 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+const TYPED_ARRAYS = {
+  int8: Int8Array,
+  int16: Int16Array,
+  int32: Int32Array,
+  uint8: Uint8Array,
+  uint16: Uint16Array,
+  uint32: Uint32Array,
+  float32: Float32Array,
+  float64: Float64Array,
+};
+
+/**
+ * Converts IEEE half-precision floats (there's no Float16Array) to a new Float32Array
+ */
+function halfToFloat(halves) {
+  const result = new Float32Array(halves.length);
+  for (let i = 0; i < halves.length; i++) {
+    const h = halves[i];
+    const sign = (h & 0x8000) ? -1 : 1;
+    const exponent = (h >> 10) & 0x1F;
+    const fraction = h & 0x03FF;
+    if (exponent === 0) {
+      result[i] = sign * (2 ** -14) * (fraction / 1024);
+    } else if (exponent === 0x1F) {
+      result[i] = fraction ? NaN : sign * Infinity;
+    } else {
+      result[i] = sign * (2 ** (exponent - 15)) * (1 + (fraction / 1024));
+    }
+  }
+  return result;
+}
+
+/**
+ * Wraps a binary buffer in the typed array for the given numpy dtype name (no copy, except
+ * for float16 data, which is converted to a Float32Array)
+ */
+function typedArray(dtype, buffer) {
+  if (dtype === 'float16') {
+    return halfToFloat(typedArray('uint16', buffer));
+  }
+  const ArrayType = TYPED_ARRAYS[dtype];
+  if (!ArrayType) {
+    throw new Error(`Unsupported array dtype ${dtype}`);
+  }
+  const view = buffer.buffer ? buffer : new DataView(buffer);
+  return new ArrayType(view.buffer, view.byteOffset,
+                       view.byteLength / ArrayType.BYTES_PER_ELEMENT);
+}
+
+/**
+ * Counterpart to nbmolviz.base.serializers.array_to_json - turns
+ * {dtype, shape, buffer} into {dtype, shape, data}, where data is a flat typed array
+ */
+function deserializeArray(value) {
+  if (value === null || value === undefined) {
+    return null;
+  }
+  return {
+    dtype: value.dtype,
+    shape: value.shape,
+    data: typedArray(value.dtype, value.buffer),
+  };
+}
+
+function serializeArray(value) {
+  if (value === null || value === undefined) {
+    return null;
+  }
+  return {
+    dtype: value.dtype,
+    shape: value.shape,
+    buffer: new DataView(value.data.buffer, value.data.byteOffset, value.data.byteLength),
+  };
+}
+
+/**
+ * Deserializes any arrays nested inside a JSON structure. In custom messages, an array's
+ * "buffer" field is an index into the message's list of buffers
+ * (see nbmolviz.base.serializers.extract_buffers)
+ */
+function restoreArrays(obj, buffers) {
+  if (obj === null || typeof obj !== 'object') {
+    return obj;
+  }
+  if (obj.dtype !== undefined && obj.shape !== undefined && obj.buffer !== undefined) {
+    const buffer = typeof obj.buffer === 'number' ? buffers[obj.buffer] : obj.buffer;
+    return deserializeArray({ dtype: obj.dtype, shape: obj.shape, buffer });
+  }
+  if (Array.isArray(obj)) {
+    return obj.map(item => restoreArrays(item, buffers));
+  }
+  const restored = {};
+  Object.keys(obj).forEach((key) => {
+    restored[key] = restoreArrays(obj[key], buffers);
+  });
+  return restored;
+}
+
+const arraySerializers = {
+  deserialize: deserializeArray,
+  serialize: serializeArray,
+};
+
+const nestedArraySerializers = {
+  deserialize: value => restoreArrays(value, []),
+};
+
+export {
+  typedArray,
+  deserializeArray,
+  serializeArray,
+  restoreArrays,
+  arraySerializers,
+  nestedArraySerializers,
+};
@@ -0,0 +1,99 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Expands an ArrowField shape (float32 buffers of arrow origins and vectors) into the
+ * individual arrows that Molecule3d draws
+ */
+function expandArrowField(field) {
+  const origins = field.origins.data;
+  const vectors = field.vectors.data;
+  const arrows = [];
+  for (let i = 0; i < origins.length; i += 3) {
+    arrows.push({
+      type: 'Arrow',
+      start: { x: origins[i], y: origins[i + 1], z: origins[i + 2] },
+      end: {
+        x: origins[i] + vectors[i],
+        y: origins[i + 1] + vectors[i + 1],
+        z: origins[i + 2] + vectors[i + 2],
+      },
+      color: field.color,
+      radius: field.radius,
+      opacity: field.opacity,
+    });
+  }
+  return arrows;
+}
+
+/**
+ * Converts a Mesh shape (float32 vertex and normal buffers, int32 face buffer) into the
+ * custom shape spec that Molecule3d passes to 3Dmol
+ */
+function expandMesh(mesh) {
+  const toVectors = (data) => {
+    const vectors = [];
+    for (let i = 0; i < data.length; i += 3) {
+      vectors.push({ x: data[i], y: data[i + 1], z: data[i + 2] });
+    }
+    return vectors;
+  };
+  const custom = {
+    type: 'Custom',
+    vertexArr: toVectors(mesh.vertices.data),
+    faceArr: Array.from(mesh.faces.data),
+    color: mesh.color,
+    opacity: mesh.opacity,
+  };
+  if (mesh.normals) {
+    custom.normalArr = toVectors(mesh.normals.data);
+  }
+  return custom;
+}
+
+/**
+ * The shapes (stored by id) as the list of shape specs that Molecule3d draws
+ */
+function expandShapes(shapes) {
+  let expanded = [];
+  Object.keys(shapes).forEach((id) => {
+    const shape = shapes[id];
+    if (shape.type === 'ArrowField') {
+      expanded = expanded.concat(expandArrowField(shape));
+    } else if (shape.type === 'Mesh') {
+      expanded.push(expandMesh(shape));
+    } else {
+      expanded.push(shape);
+    }
+  });
+  return expanded;
+}
+
+/**
+ * Expands the style table into the per-atom styles (keyed by serial) that Molecule3d expects
+ */
+function expandStyles(styleTable, atoms) {
+  const styles = {};
+  if (styleTable && atoms) {
+    const ids = styleTable.ids.data;
+    for (let i = 0; i < ids.length && i < atoms.length; i++) {
+      styles[atoms[i].serial] = styleTable.table[ids[i]];
+    }
+  }
+  return styles;
+}
+
+export { expandShapes, expandStyles };
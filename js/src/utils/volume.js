@@ -0,0 +1,73 @@
+/**
+ * Copyright 2017 Autodesk Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Volumetric data from nbmolviz.viewers.GeometryViewer.set_volume:
+ * {origin: [x, y, z], spacing: [dx, dy, dz], shape: [nx, ny, nz], values: {data}},
+ * where values are ordered with x varying slowest and z fastest (as in cube files).
+ */
+
+/**
+ * Volume data in the layout used by 3Dmol's VolumeData (origin, unit, size, and a flat
+ * Float32Array of values), built directly from the binary buffer
+ */
+function toVolumeData(volume) {
+  const [x, y, z] = volume.origin;
+  const [dx, dy, dz] = volume.spacing;
+  const [nx, ny, nz] = volume.shape;
+  const data = volume.values.data instanceof Float32Array ?
+    volume.values.data : Float32Array.from(volume.values.data);
+  return {
+    origin: { x, y, z },
+    unit: { x: dx, y: dy, z: dz },
+    size: { x: nx, y: ny, z: nz },
+    data,
+  };
+}
+
+/**
+ * The same data as the text of a Gaussian cube file (distances in angstroms), for renderers
+ * that only accept cube files
+ */
+function volumeToCube(volume) {
+  const [x, y, z] = volume.origin;
+  const [dx, dy, dz] = volume.spacing;
+  const [nx, ny, nz] = volume.shape;
+  const lines = [
+    'CUBE File',
+    'Generated by nbmolviz',
+    `-1 ${x} ${y} ${z}`,
+    `${-nx} ${dx} 0.0 0.0`,
+    `${-ny} 0.0 ${dy} 0.0`,
+    `${-nz} 0.0 0.0 ${dz}`,
+    '6 0.000 0.0 0.0 0.0',
+    '1 1',
+  ];
+
+  const values = volume.values.data;
+  for (let row = 0; row < nx * ny; row++) {
+    for (let start = 0; start < nz; start += 6) {
+      const items = [];
+      for (let k = start; k < Math.min(start + 6, nz); k++) {
+        items.push(values[(row * nz) + k].toExponential(5));
+      }
+      lines.push(items.join(' '));
+    }
+  }
+  return lines.join('\n');
+}
+
+export { toVolumeData, volumeToCube };
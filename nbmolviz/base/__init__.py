@@ -1,2 +1,5 @@
 from .base_widget import *
 from .mdt2json import *
+from .serializers import *
+from .topology import *
+from .lod import *
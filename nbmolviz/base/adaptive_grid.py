@@ -0,0 +1,174 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Adaptive sampling of a function on a regular grid.
+
+The function is first evaluated on every ``coarse_stride``-th grid point. Each coarse cell is
+then either refined - split in two along each axis (an octree), with the function evaluated at
+the new corners - or its remaining grid points are filled in by trilinear interpolation from its
+corners. Refinement continues until the cells are single grid cells, so the result has exactly
+the values of the function wherever the function was refined all the way down.
+
+A cell is refined if the values at its corners:
+  - overlap a band of values of interest (e.g., the range of isovalues that may be drawn),
+    in either sign
+  - or differ by more than ``tolerance``
+  - or it contains one of ``refine_points`` (e.g., nuclei, where orbitals change sharply)
+"""
+import itertools
+
+import numpy as np
+
+_CORNERS = np.array(list(itertools.product((0, 1), repeat=3)))
+
+
+def adaptive_sample(func, shape, origin, spacing, band, tolerance=None, coarse_stride=8,
+                    refine_points=None):
+    """ Sample a function on a grid, evaluating it only where it's needed
+
+    Args:
+        func (callable): takes an array of points of shape ``(*,3)`` and returns an array of
+           the function's values at those points
+        shape (Tuple[int]): number of grid points along x, y and z
+        origin (Vector[len=3]): position of the first grid point
+        spacing (Vector[len=3]): distance between grid points along x, y and z
+        band (Tuple[float]): lower and upper bound of the absolute values of interest
+        tolerance (float): refine cells whose corner values differ by more than this
+           (default: the upper bound of ``band``)
+        coarse_stride (int): spacing of the initial evaluations, in grid points (a power of 2)
+        refine_points (Matrix[shape=(*,3)]): always refine the cells containing these points
+
+    Returns:
+        Tuple[np.ndarray, int]: values at every grid point (shape ``shape``, x varies slowest),
+           and the number of points where ``func`` was evaluated
+    """
+    shape = tuple(int(n) for n in shape)
+    origin = np.asarray(origin, dtype='float64')
+    spacing = np.asarray(spacing, dtype='float64')
+    if coarse_stride < 1 or coarse_stride & (coarse_stride - 1):
+        raise ValueError('coarse_stride must be a power of 2')
+    lo_band, hi_band = band
+    if tolerance is None:
+        tolerance = hi_band
+
+    values = np.zeros(shape, dtype='float64')
+    evaluated = np.zeros(shape, dtype='bool')
+    stats = {'evaluations': 0}
+
+    def evaluate(points):  # points: (*,3) grid indices
+        requested = np.zeros(shape, dtype='bool')
+        requested[tuple(points.T)] = True
+        flat = np.flatnonzero(requested & ~evaluated)
+        if len(flat):
+            indices = np.column_stack(np.unravel_index(flat, shape))
+            values.flat[flat] = func(origin + spacing * indices)
+            evaluated.flat[flat] = True
+            stats['evaluations'] += len(flat)
+
+    if refine_points is not None and len(refine_points):
+        targets = np.floor((np.asarray(refine_points, dtype='float64') - origin) / spacing)
+        targets = targets[((targets >= 0) & (targets < np.array(shape) - 1)).all(axis=1)]
+    else:
+        targets = np.zeros((0, 3))
+
+    stride = coarse_stride
+    lattices = [_lattice(n, stride) for n in shape]
+    evaluate(_product(lattices))
+    cells = _product([np.arange(len(lattice) - 1) for lattice in lattices])
+
+    while len(cells):
+        lower = np.column_stack([lattice[c] for lattice, c in zip(lattices, cells.T)])
+        upper = np.column_stack([lattice[c + 1] for lattice, c in zip(lattices, cells.T)])
+        corners = np.where(_CORNERS[None].astype('bool'), upper[:, None], lower[:, None])
+        cornervalues = values[tuple(corners.transpose(2, 0, 1))]  # (num_cells, 8)
+
+        vmin, vmax = cornervalues.min(axis=1), cornervalues.max(axis=1)
+        refine = (vmax >= lo_band) & (vmin <= hi_band)  # overlaps the band
+        refine |= (vmin <= -lo_band) & (vmax >= -hi_band)  # overlaps the negative band
+        refine |= vmax - vmin > tolerance
+        if len(targets):
+            refine |= _contains(lower, upper, targets)
+        refine &= (upper - lower > 1).any(axis=1)  # single grid cells are done
+
+        _interpolate(values, evaluated, lower[~refine], upper[~refine],
+                     cornervalues[~refine])
+        if stride == 1 or not refine.any():
+            break
+
+        # split the refined cells, and evaluate the function at their new corners
+        stride //= 2
+        sublattices = [_lattice(n, stride) for n in shape]
+        children = []
+        for axis in range(3):
+            first = np.searchsorted(sublattices[axis], lattices[axis][cells[refine, axis]])
+            last = np.searchsorted(sublattices[axis], lattices[axis][cells[refine, axis] + 1])
+            children.append((first, last))
+        cells = np.concatenate([
+            np.column_stack([first + bit for (first, last), bit in zip(children, bits)])
+            [np.all([first + bit < last for (first, last), bit in zip(children, bits)], axis=0)]
+            for bits in _CORNERS])
+        lattices = sublattices
+
+        lower = np.column_stack([lattice[c] for lattice, c in zip(lattices, cells.T)])
+        upper = np.column_stack([lattice[c + 1] for lattice, c in zip(lattices, cells.T)])
+        evaluate(np.where(_CORNERS[None].astype('bool'), upper[:, None], lower[:, None])
+                 .reshape(-1, 3))
+
+    return values, stats['evaluations']
+
+
+def _lattice(n, stride):
+    """ Grid indices of the points at this stride along an axis (always including the last)
+    """
+    return np.union1d(np.arange(0, n, stride), [n - 1])
+
+
+def _product(arrays):
+    return np.stack(np.meshgrid(*arrays, indexing='ij'), axis=-1).reshape(-1, len(arrays))
+
+
+def _contains(lower, upper, points):
+    """ For each cell, whether any of the points are inside it
+    """
+    inside = np.zeros(len(lower), dtype='bool')
+    for point in points:
+        inside |= ((lower <= point) & (point < upper)).all(axis=1)
+    return inside
+
+
+def _interpolate(values, evaluated, lower, upper, cornervalues):
+    """ Fill in the points in each cell that weren't evaluated, by trilinear interpolation from
+    the cell's corners
+    """
+    if len(lower) == 0:
+        return
+    sizes = upper - lower
+    base = max(values.shape) + 1
+    keys = (sizes * [base * base, base, 1]).sum(axis=1)
+    for key in np.unique(keys):  # cells with the same size are done together
+        same = keys == key
+        size = sizes[same][0]
+        offsets = _product([np.arange(n + 1) for n in size])
+        points = lower[same][:, None, :] + offsets[None]  # (num_cells, num_offsets, 3)
+        t = offsets / size  # (num_offsets, 3)
+        weights = np.prod(np.where(_CORNERS[:, None, :].astype('bool'), t[None], 1 - t[None]),
+                          axis=2)  # (8, num_offsets)
+        interpolated = cornervalues[same].dot(weights)
+
+        index = tuple(points.reshape(-1, 3).T)
+        keep = ~evaluated[index]
+        values[tuple(i[keep] for i in index)] = interpolated.ravel()[keep]
@@ -16,24 +16,76 @@ standard_library.install_aliases()
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from builtins import str
-import threading
+from past.builtins import basestring
+import collections
+import concurrent.futures
+import contextlib
+import json
+import time
 from uuid import uuid4
 
 import ipywidgets as widgets
 import traitlets
+from tornado.ioloop import IOLoop
 from ..utils import Measure, make_layout
 
 
 def _identity(x): return x
 
 
+def _copy_result(source, target):
+    """ Resolve future ``target`` the same way that (finished) future ``source`` was resolved
+    """
+    if source.cancelled():
+        target.cancel()
+    elif target.set_running_or_notify_cancel():
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+
+class JavascriptError(Exception):
+    """ Raised for errors in javascript functions called with :meth:`MessageWidget.call`
+    """
+
+
+class JSCallFuture(concurrent.futures.Future):
+    """ The result of a javascript function call (see :meth:`MessageWidget.call`).
+
+    The kernel handles the reply from javascript only once the current cell has finished, so
+    a cell can't wait for it - ``await``-ing the call at the top level of a cell never returns
+    (or times out, if the call has a timeout). Instead, attach a callback with ``add_done_callback``, check the result in a later cell, or
+    ``await`` it in a task that keeps running after the cell finishes.
+    """
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self).__await__()
+
+
 class MessageWidget(widgets.DOMWidget):
     """A widget to send messages back and forth between the
     javascript and python interpreters"""
     viewerId = traitlets.Unicode(sync=True)
+    max_update_rate = traitlets.Float(None, allow_none=True)  # max state updates per second
+    count_json_bytes = traitlets.Bool(False)  # include JSON in comm_stats' bytes_sent (slower)
     #_width = traitlets.Unicode(sync=True)
     #_height = traitlets.Unicode(sync=True)
     _convert_units = _identity
+    _batch_depth = 0  # class attrs, because traits may be synced before __init__ finishes
+    _batched_keys = None
+    _unsynced_values = None
+    dropped_updates = 0  # number of updates superseded by newer ones before they were sent
+    _last_update_time = 0.0
+    _pending_update_keys = None
+    _update_timer = None
+    _comm_counter_values = None
+    MESSAGE_HISTORY = 100  # number of sent and received messages to keep, for debugging
+    MAX_PENDING_CALLS = 1000  # results are forgotten for older sent calls that never returned
+
+    # Javascript functions where a later call replaces an earlier one that hasn't been sent yet.
+    # Maps function name -> function(args) that returns a hashable key identifying its target
+    IDEMPOTENT_FUNCTIONS = {}
 
     def __init__(self, **kwargs):
         layoutargs = {}
@@ -47,68 +99,318 @@ class MessageWidget(widgets.DOMWidget):
 
         super().__init__(**kwargs)
         self.viewer_ready = False
-        self.js_events = {}
-        self.message_queue = []
+        self.pending_calls = collections.OrderedDict()
+        self._queued_calls = collections.OrderedDict()
+        self._calls_flush_scheduled = False
         self.js_event_handlers = {'ready':self._handle_viewer_ready,
-                                  'function_done':self._handle_function_done}
-        self.messages_received = []
+                                  'function_done':self._handle_function_done,
+                                  'batch_done':self._handle_batch_done}
+        self.messages_received = collections.deque(maxlen=self.MESSAGE_HISTORY)
         #self._width = str(Measure(kwargs.get('width', 'null')))
         #self._height = str(Measure(kwargs.get('height', 'null')))
-        self.sent_messages = []
+        self.sent_messages = collections.deque(maxlen=self.MESSAGE_HISTORY)
         self.num_calls = 0
         self.viewerId = 'molviz'+str(uuid4())
-        self.js_results = {}
         self.on_msg(self._handle_js_message)
-        self._batched = []
 
-    def viewer(self, function_name, args, block=False):
-        """
-        TODO: make blocking/synchronous comms work
-        :param function_name:
-        :param args:
-        :param block:
-        :return:
+    def viewer(self, function_name, args, block=False, timeout=None):
+        """ Call a function of this widget's javascript model.
+
+        Calls aren't sent right away: all calls made during one kernel execution (or before the
+        view is ready) are sent together in a single ``batchCommands`` message. A queued call to
+        one of the ``IDEMPOTENT_FUNCTIONS`` is dropped if the same function is called again on
+        the same target.
+
+        Args:
+            function_name (str): name of the function
+            args (list): arguments for the function (must be JSON-serializable)
+            block (bool): not supported - the reply can't arrive while the kernel is blocked
+            timeout (float): seconds to wait for the reply before failing with a
+               ``concurrent.futures.TimeoutError`` (default: wait forever)
+
+        Returns:
+            JSCallFuture: future for the function's return value
         """
+        if block:
+            raise NotImplementedError("Can't block while waiting for javascript - "
+                                      "use the future returned by `widget.call(...)` instead")
+
         call_id = self.num_calls + 1
+        self.num_calls = call_id
         message = {'event': 'function_call',
                    'function_name': function_name,
                    'arguments': args,
                    'call_id': call_id}
 
-        #Set up an event to wait for this to return
-        event = threading.Event()
-        self.js_events[call_id] = event
-        my_result = {'Warning':'The javascript call to %s has not yet returned. ' % function_name +
-                               'This dictionary will be updated when it does.'}
-        self.js_results[call_id] = my_result
+        future = JSCallFuture()
+        future.add_done_callback(lambda f: self.pending_calls.pop(call_id, None))
+        if timeout is not None:
+            loop = IOLoop.current()
+            timer = loop.call_later(timeout, self._time_out_call, future, function_name, timeout)
+            future.add_done_callback(lambda f: loop.remove_timeout(timer))
 
-        #Send the message to javascript
-        if self.viewer_ready:
-            self.sent_messages.append(message)
-            self.send(message)
+        if function_name in self.IDEMPOTENT_FUNCTIONS:
+            key = (function_name, self.IDEMPOTENT_FUNCTIONS[function_name](args))
+            replaced = self._queued_calls.pop(key, None)
+            if replaced is not None:  # the earlier call resolves with this one's result
+                self.dropped_updates += 1
+                future.add_done_callback(lambda f: _copy_result(f, replaced[1]))
         else:
-            self.message_queue.append(message)
-        self.num_calls = call_id
+            key = call_id
+        self._queued_calls[key] = (message, future)
 
-        if block: raise NotImplementedError("blocking doesn't work yet!")
-        return my_result
+        if self.viewer_ready and not self._calls_flush_scheduled:
+            self._calls_flush_scheduled = True
+            IOLoop.current().add_callback(self._flush_calls)
+        return future
+
+    def call(self, function_name, *args, **kwargs):
+        """ Call a function of this widget's javascript model.
+
+        The result arrives only after the calling cell has finished (see :class:`JSCallFuture`).
+
+        Examples:
+            >>> viewer.call('getSelection').add_done_callback(lambda f: print(f.result()))
+
+            >>> async def print_selection():  # awaits the reply in the background
+            ...     print(await viewer.call('getSelection'))
+            >>> task = asyncio.ensure_future(print_selection())
+
+            >>> selection = viewer.call('getSelection')
+            >>> selection.result()  # in a later cell
+
+        Args:
+            function_name (str): name of the function
+            *args: arguments for the function (must be JSON-serializable)
+            timeout (float): seconds to wait for the reply (keyword only; default: forever)
+
+        Returns:
+            JSCallFuture: future for the function's return value
+        """
+        timeout = kwargs.pop('timeout', None)
+        if kwargs:  # javascript functions only take positional arguments
+            raise TypeError('call() got unexpected keyword arguments: %s'
+                            % ', '.join(sorted(kwargs)))
+        return self.viewer(function_name, list(args), timeout=timeout)
+
+    @staticmethod
+    def _time_out_call(future, function_name, timeout):
+        if future.set_running_or_notify_cancel():
+            future.set_exception(concurrent.futures.TimeoutError(
+                    'Javascript function %s did not return within %s seconds'
+                    % (function_name, timeout)))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Context manager that collects all state updates made inside it, and sends them as a
+        single message when the outermost ``batch`` block exits.
+
+        Examples:
+            >>> with viewer.batch():
+            ...     for chain, color in zip(mol.chains, colors):
+            ...         viewer.set_color(color, atoms=chain.atoms)
+        """
+        self._batch_depth += 1
+        try:
+            with self.hold_trait_notifications():
+                yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush_batch()
+
+    def _flush_batch(self):
+        """ Send everything that was collected inside ``self.batch()``. Subclasses that
+        collect other kinds of updates should extend this.
+        """
+        if self._batched_keys:
+            keys, self._batched_keys = self._batched_keys, None
+            self._send_rate_limited(sorted(keys))
+
+    def _updates_deferred(self):
+        """ bool: whether an update sent right now would be held back by ``max_update_rate``
+        """
+        if self.max_update_rate is None:
+            return False
+        return (self._update_timer is not None or
+                time.time() < self._last_update_time + 1.0 / self.max_update_rate)
+
+    def _defer_update(self):
+        """ Make sure that held-back updates get sent once the current update window expires
+        """
+        if self._update_timer is None:
+            delay = self._last_update_time + 1.0 / self.max_update_rate - time.time()
+            self._update_timer = IOLoop.current().call_later(max(delay, 0.0),
+                                                             self._flush_pending_updates)
+
+    def _flush_pending_updates(self):
+        """ Send the latest state of everything that changed while updates were held back.
+        Subclasses that hold back other kinds of updates should extend this.
+        """
+        self._update_timer = None
+        self._last_update_time = time.time()
+        if self._pending_update_keys:
+            keys, self._pending_update_keys = self._pending_update_keys, None
+            super().send_state(key=sorted(keys))
+
+    def _send_rate_limited(self, key):
+        """ Sync state now, or, if that would exceed ``max_update_rate``, once the current
+        update window expires. Until then, further changes to the same traits are coalesced,
+        so only their latest values get sent.
+        """
+        if not self._updates_deferred():
+            self._last_update_time = time.time()
+            super().send_state(key=key)
+            return
+
+        if key is None:
+            key = self.keys
+        elif isinstance(key, basestring):
+            key = [key]
+        if self._pending_update_keys is None:
+            self._pending_update_keys = set()
+        self.dropped_updates += len(self._pending_update_keys.intersection(key))
+        self._pending_update_keys.update(key)
+        self._defer_update()
+
+    def _set_unsynced(self, **values):
+        """ Set traits without syncing them to the browser - for changes that were already sent
+        to it some other way (e.g., as a custom message). The traits will be synced normally
+        again once they're set to new values.
+        """
+        if self._unsynced_values is None:
+            self._unsynced_values = {}
+        self._unsynced_values.update(values)
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def notify_change(self, change):
+        """ Forget a value set with ``_set_unsynced`` once it's replaced """
+        if (self._unsynced_values and change['name'] in self._unsynced_values
+                and change['new'] is not self._unsynced_values[change['name']]):
+            del self._unsynced_values[change['name']]  # the new value is synced normally
+        super().notify_change(change)
+
+    def send_state(self, key=None):
+        """ Sync state to the browser - deferred until exiting, if called inside ``self.batch()``
+        """
+        if key is not None and self._unsynced_values:
+            if isinstance(key, basestring):
+                key = [key]
+            key = [k for k in key
+                   if k not in self._unsynced_values
+                   or getattr(self, k) is not self._unsynced_values[k]]
+            if not key:
+                return
+
+        if self._batch_depth > 0:
+            if key is None:
+                key = self.keys
+            elif isinstance(key, basestring):
+                key = [key]
+            if self._batched_keys is None:
+                self._batched_keys = set()
+            self._batched_keys.update(key)
+        else:
+            self._send_rate_limited(key)
 
     def batch_message(self, function_name, args):
-        self._batched.append((function_name, args))
+        """ Deprecated - all calls to :meth:`viewer` are batched now """
+        return self.viewer(function_name, args)
 
     def send_batch(self):
-        self.viewer('batchCommands', [self._batched])
-        self._batched = []
+        """ Send all queued javascript function calls now, instead of when the kernel is idle
+        """
+        if self.viewer_ready:
+            self._flush_calls()
+
+    def _flush_calls(self):
+        """ Send all queued function calls in a single message (javascript replies to them
+        with a single ``batch_done`` message)
+        """
+        self._calls_flush_scheduled = False
+        if not self._queued_calls:
+            return
+        sent = collections.OrderedDict(
+                (message['call_id'], (message, future))
+                for message, future in self._queued_calls.values()
+                if not future.done())  # skip calls that were cancelled or timed out
+        self._queued_calls = collections.OrderedDict()
+
+        # only calls from earlier messages are forgotten - never the ones being sent now
+        while (self.pending_calls and
+               len(self.pending_calls) + len(sent) > self.MAX_PENDING_CALLS):
+            _, oldest = self.pending_calls.popitem(last=False)
+            oldest.cancel()
+        messages = []
+        for call_id, (message, future) in sent.items():
+            self.pending_calls[call_id] = future
+            messages.append(message)
+
+        if len(messages) == 1:
+            message = messages[0]
+        elif messages:
+            message = {'event': 'function_call',
+                       'function_name': 'batchCommands',
+                       'arguments': messages}
+        else:
+            return
+        self.sent_messages.append(message)
+        self.send(message)
 
     def _handle_viewer_ready(self,message):
         self.viewer_ready = True
-        for message in self.message_queue:
-            self.sent_messages.append(message)
-            self.send(message)
+        self._flush_calls()
+
+    def _send(self, msg, buffers=None):
+        self._comm_counters['messages_sent'] += 1
+        self._comm_counters['bytes_sent'] += sum(memoryview(b).nbytes for b in buffers or ())
+        if self.count_json_bytes:  # serializes the message a second time
+            self._comm_counters['bytes_sent'] += len(json.dumps(msg, separators=(',', ':'),
+                                                                default=repr))
+        super()._send(msg, buffers=buffers)
+
+    def get_state(self, key=None, **kwargs):
+        start = time.time()
+        state = super().get_state(key=key, **kwargs)
+        self._comm_counters['serialization_time'] += time.time() - start
+        return state
+
+    @property
+    def _comm_counters(self):
+        if self._comm_counter_values is None:  # traits may be synced before __init__ finishes
+            self._comm_counter_values = collections.Counter()
+        return self._comm_counter_values
+
+    def comm_stats(self):
+        """ Statistics about this widget's communication with the browser.
+
+        Returns:
+            dict: with keys
+               - ``messages_sent``: number of messages sent to the browser (state updates and
+                 custom messages)
+               - ``bytes_sent``: total size of those messages' binary buffers, plus their JSON
+                 if ``count_json_bytes`` is True
+               - ``serialization_time``: total seconds spent serializing widget state
+               - ``messages_received``: number of custom messages received from the browser
+               - ``bytes_received``: total size of the binary buffers in those messages
+               - ``pending_calls``: number of javascript function calls that haven't returned
+               - ``dropped_updates``: number of updates that were coalesced with newer ones
+                 (see ``max_update_rate`` and ``IDEMPOTENT_FUNCTIONS``)
+        """
+        stats = dict.fromkeys(('messages_sent', 'bytes_sent', 'messages_received',
+                               'bytes_received'), 0)
+        stats['serialization_time'] = 0.0
+        stats.update(self._comm_counters)
+        stats['pending_calls'] = len(self.pending_calls) + len(self._queued_calls)
+        stats['dropped_updates'] = self.dropped_updates
+        return stats
 
     def _handle_js_message(self, self_again, content, buffers):
         event = content['event']
         self.messages_received.append(content)
+        self._comm_counters['messages_received'] += 1
+        self._comm_counters['bytes_received'] += sum(memoryview(b).nbytes for b in buffers or ())
         try:
             handler = self.js_event_handlers[event]
         except KeyError:
@@ -119,21 +421,15 @@ class MessageWidget(widgets.DOMWidget):
         else:
             handler(content)
 
-    def _handle_function_done(self,message):
-        #Update the user's result dictionary
-        call_id = message['call_id']
-        if call_id in self.js_results:
-            result_dict = self.js_results[call_id]
-            result_dict.pop('Warning', None)
-            if 'result' in message:
-                try:
-                    result_dict.update(message['result'])
-                except ValueError:
-                    result_dict['result'] = message['result']
-
-        #Wake up anyone waiting for the function to return
-        if call_id in self.js_events:
-            self.js_events[call_id].set()
-
-
+    def _handle_batch_done(self, message):
+        for result in message['results']:
+            self._handle_function_done(result)
 
+    def _handle_function_done(self, message):
+        future = self.pending_calls.pop(message['call_id'], None)
+        if future is None or not future.set_running_or_notify_cancel():
+            return  # cancelled, timed out, or forgotten
+        if message.get('error', None) is not None:
+            future.set_exception(JavascriptError(message['error']))
+        else:
+            future.set_result(message.get('result', None))
@@ -0,0 +1,186 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Compact encoding for trajectory frames.
+
+Coordinates are quantized to integer multiples of a fixed ``precision``, so every decoded
+coordinate is within ``precision / 2`` of the original. Every ``keyframe_interval``-th frame is
+a keyframe, stored as absolute values (relative to the smallest one, packed into as few bits as
+they need); every other frame is stored as its difference from the previous frame, so that a
+frame is decoded from its keyframe plus at most ``keyframe_interval - 1`` deltas.
+
+Deltas are Rice-coded: each one is mapped to a non-negative integer ``z`` (0, -1, 1, -2, ... map
+to 0, 1, 2, 3, ...), whose low ``k`` bits are stored in a fixed-width "remainders" stream, and
+whose high bits ``q = z >> k`` are stored in a "unary" stream as ``q`` zero bits followed by a
+one bit. ``k`` is chosen to make the payload smallest, so small deltas take about
+``log2(typical delta) + 2`` bits. The unary stream's bit offset for each frame is stored too,
+for random access. Deltas with ``q >= ESCAPE`` are stored as ``ESCAPE`` in the unary stream, and
+their actual values are listed separately as "exceptions".
+
+With ``precision = 0.001`` angstrom and the default keyframe interval, the payload is about 4.3
+times smaller than float32 coordinates for atoms moving ~0.03 angstrom per frame, 5-6 times
+for ~0.01 angstrom, but only ~3.5 times for 0.1 angstrom, where the deltas need ~9 bits each.
+
+See ``js/src/utils/frame_codec.js`` for the javascript decoder.
+"""
+import numpy as np
+
+ENCODING = 'quantized_rice_delta'
+ESCAPE = 32  # deltas whose unary part would be at least this long are stored as exceptions
+MAX_QUANTIZED = 2 ** 30  # keeps deltas within int32
+_CHUNK = 2 ** 20  # values packed at a time (a multiple of 8, so chunks are whole bytes)
+
+
+def encode_frames(frames, precision=0.001, keyframe_interval=30):
+    """ Encode a series of frames
+
+    Args:
+        frames (np.ndarray[shape=(*,*,3)]): atomic positions for each frame
+        precision (float): quantization step, in the same units as ``frames``
+        keyframe_interval (int): number of frames between keyframes
+
+    Returns:
+        dict: the encoded frames (its arrays are sent as binary buffers)
+    """
+    frames = np.asarray(frames, dtype='float64')
+    if frames.ndim != 3 or frames.shape[2] != 3:
+        raise ValueError('Expected frames with shape (*, *, 3), got %s' % (frames.shape,))
+    if keyframe_interval < 1:
+        raise ValueError('keyframe_interval must be at least 1')
+
+    quantized = np.round(frames / precision)
+    if quantized.size and np.abs(quantized).max() > MAX_QUANTIZED:
+        raise ValueError('Coordinates too large to quantize with precision %s' % precision)
+    quantized = quantized.astype('int64')
+
+    keyframes = quantized[::keyframe_interval].reshape(-1)
+    keyframe_base = int(keyframes.min()) if keyframes.size else 0
+    keyframe_bits = int(keyframes.max() - keyframe_base).bit_length() if keyframes.size else 0
+
+    # deltas for every frame that isn't a keyframe, one row per frame
+    is_delta = np.arange(len(quantized)) % keyframe_interval != 0
+    deltas = (quantized - np.roll(quantized, 1, axis=0))[is_delta].reshape(
+            int(is_delta.sum()), frames.shape[1] * 3)
+    zigzag = np.where(deltas < 0, -2 * deltas - 1, 2 * deltas).astype('uint32')
+    k = _rice_parameter(zigzag.reshape(-1))
+    high = np.minimum(zigzag >> k, ESCAPE)
+    exceptions = np.flatnonzero(high == ESCAPE)
+    frame_bits = (high + 1).sum(axis=1)
+    if frame_bits.sum() >= 2 ** 32:
+        raise ValueError('Too many frames to encode at once')
+
+    return {'encoding': ENCODING,
+            'precision': precision,
+            'keyframe_interval': keyframe_interval,
+            'shape': list(frames.shape),
+            'keyframe_base': keyframe_base,
+            'keyframe_bits': keyframe_bits,
+            'keyframes': _pack_bits(keyframes - keyframe_base, keyframe_bits),
+            'rice_k': k,
+            'frame_offsets': (np.cumsum(frame_bits) - frame_bits).astype('uint32'),
+            'unary': _pack_unary(high.reshape(-1)),
+            'remainders': _pack_bits(zigzag.reshape(-1) & ((1 << k) - 1), k),
+            'exception_index': exceptions.astype('int32'),
+            'exception_value': deltas.reshape(-1)[exceptions].astype('int32')}
+
+
+def _rice_parameter(zigzag):
+    """ The number of low bits to store directly that makes the Rice-coded payload smallest
+    """
+    if len(zigzag) == 0:
+        return 0
+    guess = int(np.log2(zigzag.mean() + 1))
+    candidates = range(max(guess - 2, 0), guess + 3)
+    sizes = []
+    for k in candidates:
+        high = zigzag >> np.uint32(k)
+        sizes.append(len(zigzag) * (k + 1) + np.minimum(high, ESCAPE).sum(dtype='int64')
+                     + 64 * np.count_nonzero(high >= ESCAPE))
+    return candidates[int(np.argmin(sizes))]
+
+
+def _pack_bits(values, bits):
+    """ Pack non-negative integers into ``bits`` bits each, least significant bit first
+    """
+    if bits == 0:
+        return np.zeros(0, dtype='uint8')
+    values = values.astype('uint32')
+    shifts = np.arange(bits, dtype='uint32')
+    return np.concatenate(
+            [np.packbits(((values[start:start + _CHUNK, None] >> shifts) & 1).astype('bool'),
+                         bitorder='little')
+             for start in range(0, len(values), _CHUNK)] or [np.zeros(0, dtype='uint8')])
+
+
+def _unpack_bits(packed, bits, count):
+    if bits == 0:
+        return np.zeros(count, dtype='int64')
+    unpacked = np.unpackbits(packed, bitorder='little')[:count * bits].reshape(count, bits)
+    return (unpacked.astype('int64') << np.arange(bits)).sum(axis=1)
+
+
+def _pack_unary(values):
+    """ Each value ``q`` as ``q`` zero bits followed by a one bit
+    """
+    bits = np.zeros(int(values.sum()) + len(values), dtype='uint8')
+    bits[np.cumsum(values + 1) - 1] = 1
+    return np.packbits(bits, bitorder='little')
+
+
+def _unpack_unary(packed, count):
+    ones = np.flatnonzero(np.unpackbits(packed, bitorder='little'))[:count]
+    return np.diff(ones, prepend=-1) - 1
+
+
+def decode_frames(encoded):
+    """ Decode all frames
+
+    Args:
+        encoded (dict): output of :func:`encode_frames`
+
+    Returns:
+        np.ndarray[float32, shape=(*,*,3)]: positions for every frame
+    """
+    shape = encoded['shape']
+    interval = encoded['keyframe_interval']
+    k = encoded['rice_k']
+    is_delta = np.arange(shape[0]) % interval != 0
+    count = int(is_delta.sum()) * shape[1] * 3
+
+    zigzag = (_unpack_unary(encoded['unary'], count) << k) | _unpack_bits(
+            encoded['remainders'], k, count)
+    deltas = np.where(zigzag % 2, -(zigzag + 1) // 2, zigzag // 2)
+    deltas[encoded['exception_index']] = encoded['exception_value']
+
+    quantized = np.empty(shape, dtype='int64')
+    quantized[is_delta] = deltas.reshape(quantized[is_delta].shape)
+    keyframes = quantized[::interval]
+    keyframes[...] = (encoded['keyframe_base'] + _unpack_bits(
+            encoded['keyframes'], encoded['keyframe_bits'], keyframes.size)).reshape(
+                    keyframes.shape)
+    for start in range(0, len(quantized), interval):
+        group = quantized[start:start + interval]
+        np.cumsum(group, axis=0, out=group)
+    return (quantized * encoded['precision']).astype('float32')
+
+
+def encoded_size(encoded):
+    """ int: number of bytes in the encoded frames' binary buffers
+    """
+    return sum(encoded[key].nbytes for key in ('keyframes', 'frame_offsets', 'unary',
+                                               'remainders', 'exception_index',
+                                               'exception_value'))
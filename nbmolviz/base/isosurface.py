@@ -0,0 +1,127 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Isosurface extraction from values on a regular grid.
+
+Uses marching tetrahedra: each grid cell is split into 6 tetrahedra around its main diagonal
+(the same split in every cell, so that neighboring cells share their faces' diagonals), and
+each tetrahedron that the surface crosses contributes one or two triangles. All tetrahedra are
+processed at once with numpy. Vertices lie on grid edges, and are shared by every triangle that
+touches the same edge, so the mesh is closed wherever it doesn't leave the grid.
+"""
+import itertools
+
+import numpy as np
+
+# corners of the 6 tetrahedra, as offsets from the cell's first corner: each one walks from
+# (0,0,0) to (1,1,1) one axis at a time
+_TETRAHEDRA = np.array([[[0, 0, 0],
+                         np.eye(3, dtype='int64')[p[0]],
+                         np.eye(3, dtype='int64')[p[0]] + np.eye(3, dtype='int64')[p[1]],
+                         [1, 1, 1]]
+                        for p in itertools.permutations(range(3))], dtype='int64')
+
+
+def _make_triangle_table():
+    """ For each of the 16 ways that a tetrahedron's corners can be inside the surface, the
+    triangles to draw, as 3 edges each (an edge is a pair of corners). Unused slots are -1.
+    """
+    table = -np.ones((16, 2, 3, 2), dtype='int64')
+    for case in range(1, 15):
+        inside = [c for c in range(4) if case & (1 << c)]
+        outside = [c for c in range(4) if not case & (1 << c)]
+        if len(inside) == 1 or len(outside) == 1:
+            lone, others = (inside[0], outside) if len(inside) == 1 else (outside[0], inside)
+            table[case, 0] = [(lone, c) for c in others]
+        else:
+            (a, b), (c, d) = inside, outside
+            table[case, 0] = [(a, c), (a, d), (b, d)]
+            table[case, 1] = [(a, c), (b, d), (b, c)]
+    return table
+
+_TRIANGLES = _make_triangle_table()
+
+
+def isosurface(values, level, origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    """ Triangulate the surface where ``values`` crosses ``level``
+
+    Args:
+        values (np.ndarray[shape=(nx,ny,nz)]): values at each grid point
+        level (float): the isovalue
+        origin (Vector[len=3]): position of the first grid point
+        spacing (Vector[len=3]): distance between grid points along x, y and z
+
+    Returns:
+        Tuple[np.ndarray]: vertices (float32, shape ``(*,3)``), vertex normals (float32, shape
+           ``(*,3)``, pointing towards lower values) and triangles (int32, shape ``(*,3)``,
+           indices of their vertices, wound counterclockwise when seen from the side the
+           normals point to)
+    """
+    values = np.asarray(values, dtype='float64')
+    if values.ndim != 3 or min(values.shape) < 2:
+        raise ValueError('Expected values on a grid with at least 2 points per axis, got %s'
+                         % (values.shape,))
+    origin = np.asarray(origin, dtype='float64')
+    spacing = np.asarray(spacing, dtype='float64')
+    shape = np.array(values.shape)
+
+    # only look at cells that have corners on both sides of the surface
+    inside = values > level
+    cells = np.zeros(shape - 1, dtype='int8')
+    for offset in itertools.product((0, 1), repeat=3):
+        cells += inside[tuple(slice(o, n - 1 + o) for o, n in zip(offset, shape))]
+    cells = np.argwhere((cells > 0) & (cells < 8))
+    if len(cells) == 0:
+        return (np.zeros((0, 3), dtype='float32'), np.zeros((0, 3), dtype='float32'),
+                np.zeros((0, 3), dtype='int32'))
+
+    # flat point indices of each tetrahedron's corners, shape (num_tetrahedra, 4)
+    corners = (cells[:, None, None, :] + _TETRAHEDRA[None]).reshape(-1, 4, 3)
+    corners = np.ravel_multi_index(corners.transpose(2, 0, 1), values.shape)
+    flat = values.ravel()
+    cases = (inside.ravel()[corners] << np.arange(4)).sum(axis=1)
+    drawn = (cases > 0) & (cases < 15)
+    corners, cases = corners[drawn], cases[drawn]
+
+    # every triangle, as 3 edges between two grid points
+    triangles = _TRIANGLES[cases]  # (num_tetrahedra, 2, 3, 2) corner numbers
+    used = triangles[:, :, 0, 0] >= 0
+    edges = corners[np.arange(len(cases))[:, None, None, None], np.maximum(triangles, 0)]
+    edges = edges[used]  # (num_triangles, 3, 2) point indices
+
+    # one vertex per distinct edge
+    lo, hi = np.minimum(edges[..., 0], edges[..., 1]), np.maximum(edges[..., 0], edges[..., 1])
+    keys, faces = np.unique((lo * flat.size + hi).ravel(), return_inverse=True)
+    faces = faces.reshape(-1, 3)
+    lo, hi = keys // flat.size, keys % flat.size
+    t = ((level - flat[lo]) / (flat[hi] - flat[lo]))[:, None]
+
+    points = [np.column_stack(np.unravel_index(p, values.shape)) for p in (lo, hi)]
+    vertices = origin + spacing * (points[0] + t * (points[1] - points[0]))
+
+    gradient = np.stack(np.gradient(values, *spacing), axis=-1).reshape(-1, 3)
+    normals = -(gradient[lo] + t * (gradient[hi] - gradient[lo]))
+    lengths = np.sqrt((normals ** 2).sum(axis=1))[:, None]
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+    # wind each triangle so that its face normal agrees with its vertex normals
+    v0, v1, v2 = (vertices[faces[:, i]] for i in range(3))
+    facenormals = np.cross(v1 - v0, v2 - v0)
+    flip = (facenormals * normals[faces].sum(axis=1)).sum(axis=1) < 0
+    faces[flip] = faces[flip][:, ::-1]
+
+    return vertices.astype('float32'), normals.astype('float32'), faces.astype('int32')
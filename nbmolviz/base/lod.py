@@ -0,0 +1,129 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Coarse-grained (level-of-detail) representations of large molecules.
+
+A coarse representation is just a subset of the molecule's atoms - for instance, the alpha
+carbons - plus "trace" bonds that connect consecutive residues of each polymer chain.
+"""
+import numpy as np
+
+from .mdt2json import convert
+from .topology import get_topology
+
+LOD_SCHEMES = ('trace', 'residue')
+TRACE_ATOM_NAMES = ('CA', 'P')
+POLYMER_TYPES = ('protein', 'dna', 'rna')
+SOLVENT_TYPES = ('water', 'solvent', 'ion')
+
+
+def coarse_atoms(mol, scheme):
+    """ Indices of the atoms in a coarse-grained representation of a molecule
+
+    Schemes:
+      - ``'trace'``: alpha carbons and nucleic acid phosphorus atoms, plus the heavy atoms of
+        any ligands (i.e., residues that aren't polymer or solvent)
+      - ``'residue'``: one bead per residue - its trace atom if it has one, otherwise its first
+        atom
+
+    Args:
+        mol (moldesign.Molecule): the molecule
+        scheme (str): coarse-graining scheme (see above)
+
+    Returns:
+        np.ndarray[int32]: sorted atom indices (shared between callers - do not modify them)
+    """
+    if scheme not in LOD_SCHEMES:
+        raise ValueError('Unknown coarse-graining scheme "%s" (should be one of %s)'
+                         % (scheme, ', '.join(LOD_SCHEMES)))
+    topology = get_topology(mol)
+    return topology.cached(('lod', scheme), lambda: _select(mol, topology, scheme))
+
+
+def encode_atoms(mol, indices, detail_residues=None, trace_bonds=True):
+    """ Encode only some of a molecule's atoms for the 3D viewer (see :func:`.mdt2json.convert`)
+
+    Each atom's ``serial`` is its index in the full molecule. Bonds to atoms that aren't shown
+    are dropped; trace bonds are added between the trace atoms of consecutive residues in a
+    chain, unless both residues are shown in full detail.
+
+    Args:
+        mol (moldesign.Molecule): the molecule
+        indices (np.ndarray[int32]): indices of the atoms to encode, in the order to send them
+        detail_residues (np.ndarray[bool]): mask of residues shown in full atomic detail
+        trace_bonds (bool): whether to add trace bonds at all
+
+    Returns:
+        dict: the encoded subset
+    """
+    topology = get_topology(mol)
+    js = convert(mol)
+    lookup = np.full(topology.num_atoms, -1, dtype='int32')
+    lookup[indices] = np.arange(len(indices), dtype='int32')
+
+    atoms = {key: column[indices] for key, column in js['atoms'].items()}
+    atoms['serial'] = np.asarray(indices, dtype='int32')
+
+    atom1 = lookup[js['bonds']['atom1_index']]
+    atom2 = lookup[js['bonds']['atom2_index']]
+    keep = (atom1 >= 0) & (atom2 >= 0)
+    if trace_bonds:
+        trace = lookup[_trace_bonds(mol, topology, detail_residues)]
+        trace = trace[(trace >= 0).all(axis=1)]
+    else:
+        trace = np.zeros((0, 2), dtype='int32')
+
+    bonds = {'atom1_index': np.concatenate((atom1[keep], trace[:, 0])),
+             'atom2_index': np.concatenate((atom2[keep], trace[:, 1])),
+             'bond_order': np.concatenate((js['bonds']['bond_order'][keep],
+                                           np.ones(len(trace), dtype='int8')))}
+    return dict(js, atoms=atoms, bonds=bonds)
+
+
+def _trace_atoms(mol, topology):
+    js = convert(mol)
+    codes = [i for i, name in enumerate(js['strings']) if name in TRACE_ATOM_NAMES]
+    return (np.isin(js['atoms']['name'], codes)
+            & topology.residue_type_mask(*POLYMER_TYPES))
+
+
+def _select(mol, topology, scheme):
+    trace = _trace_atoms(mol, topology)
+    if scheme == 'trace':
+        js = convert(mol)
+        hydrogen = [i for i, elem in enumerate(js['strings']) if elem == 'H']
+        ligand = (~topology.residue_type_mask(*(POLYMER_TYPES + SOLVENT_TYPES))
+                  & ~np.isin(js['atoms']['elem'], hydrogen))
+        return np.flatnonzero(trace | ligand).astype('int32')
+    else:
+        beads = topology.residue_first_atom.copy()
+        traceatoms = np.flatnonzero(trace)
+        beads[topology.residue_index[traceatoms]] = traceatoms
+        return np.sort(beads)
+
+
+def _trace_bonds(mol, topology, detail_residues):
+    """ Pairs of trace atoms in consecutive residues of the same chain, shape (*, 2)
+    """
+    traceatoms = topology.cached(('lod', 'trace_atoms'),
+                                 lambda: np.flatnonzero(_trace_atoms(mol, topology)))
+    residues = topology.residue_index[traceatoms]
+    chains = topology.chain_index[residues]
+    linked = (residues[1:] == residues[:-1] + 1) & (chains[1:] == chains[:-1])
+    if detail_residues is not None:
+        linked &= ~(detail_residues[residues[1:]] & detail_residues[residues[:-1]])
+    return np.column_stack((traceatoms[:-1][linked], traceatoms[1:][linked]))
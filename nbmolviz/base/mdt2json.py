@@ -11,33 +11,75 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import numpy as np
+
+from .topology import get_topology
 
 
 def convert(mol):
+    """ Encode a molecule's topology for the 3D viewer.
+
+    The encoding is columnar: atoms, bonds, residues and chains are each a dict of typed
+    arrays (sent to the browser as binary buffers), and names are indices into a single string
+    table. It's stored with the molecule's shared :class:`.topology.Topology`, so it's only
+    recomputed when the topology changes.
+
+    Args:
+        mol (moldesign.Molecule): molecule to encode
+
+    Returns:
+        dict: the encoded topology (its arrays are shared between callers - do not modify them)
+    """
+    topology = get_topology(mol)
+    js = topology.cached('json', lambda: _encode(mol, topology))
+    return dict(js, name=mol.name)
+
+
+class _StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self._lookup = {}
+
+    def index(self, s):
+        idx = self._lookup.get(s, None)
+        if idx is None:
+            idx = self._lookup[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+
+def _encode(mol, topology):
     from moldesign import units as u
 
-    js = dict(name=mol.name)
-
-    js['atoms'] = [{'serial': i,
-                    'name': atom.name,
-                    'elem': atom.elem,
-                    'mass_magnitude': float(atom.mass.value_in(u.amu)),
-                    'residue_index': atom.residue.index,
-                    'residue_name': atom.residue.name,
-                    'chain': atom.chain.name}
-                   for i, atom in enumerate(mol.atoms)]
-
-    js['bonds'] = [{'atom1_index': bond.a1.index,
-                    'atom2_index': bond.a2.index,
-                    'bond_order': bond.order}
-                   for i, bond in enumerate(mol.bonds)]
-
-    js['residues'] = [{'name': residue.name,
-                       'sequence_number': residue.pdbindex,
-                       'chain_index': residue.chain.index}
-                      for i, residue in enumerate(mol.residues)]
-
-    js['chains'] = [{'name': chain.name,
-                     'description': ''}
-                    for i, chain in enumerate(mol.chains)]
+    strings = _StringTable()
+    atoms = mol.atoms
+    residues = [atoms[i].residue for i in topology.residue_first_atom]
+    chains = [atoms[i].chain for i in topology.chain_first_atom]
+
+    js = dict(strings=strings.strings)
+
+    js['atoms'] = {
+        'name': np.fromiter((strings.index(atom.name) for atom in atoms),
+                            dtype='int32', count=len(atoms)),
+        'elem': np.fromiter((strings.index(atom.elem) for atom in atoms),
+                            dtype='int32', count=len(atoms)),
+        'mass_magnitude': np.fromiter((atom.mass.value_in(u.amu) for atom in atoms),
+                                      dtype='float32', count=len(atoms)),
+        'residue_index': topology.residue_index}
+
+    js['bonds'] = {'atom1_index': topology.bonds[:, 0].copy(),
+                   'atom2_index': topology.bonds[:, 1].copy(),
+                   'bond_order': topology.bond_orders}
+
+    js['residues'] = {
+        'name': np.fromiter((strings.index(residue.name) for residue in residues),
+                            dtype='int32', count=len(residues)),
+        'sequence_number': np.array([residue.pdbindex for residue in residues],
+                                    dtype='float64'),  # may be None
+        'chain_index': topology.chain_index}
+
+    js['chains'] = {
+        'name': np.fromiter((strings.index(chain.name) for chain in chains),
+                            dtype='int32', count=len(chains))}
+
     return js
@@ -0,0 +1,98 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+
+def array_to_json(value, widget=None):
+    """ Serialize a numpy array for the widget comm.
+
+    The array's data is sent as a raw binary buffer (no JSON encoding); only its dtype and
+    shape go into the JSON part of the message. See ``js/src/utils/serializers.js`` for the
+    javascript counterpart.
+
+    Args:
+        value (np.ndarray): array to serialize (or None)
+        widget (ipywidgets.Widget): the widget being serialized (unused)
+
+    Returns:
+        dict: ``{'dtype': str, 'shape': list, 'buffer': memoryview}``
+    """
+    if value is None:
+        return None
+    arr = np.ascontiguousarray(value)
+    return {'dtype': str(arr.dtype),
+            'shape': list(arr.shape),
+            'buffer': memoryview(arr.reshape(-1))}
+
+
+def array_from_json(value, widget=None):
+    """ Deserialize an array sent from javascript by :func:`array_to_json`'s counterpart
+
+    Args:
+        value (dict): ``{'dtype': str, 'shape': list, 'buffer': bytes or memoryview}``
+        widget (ipywidgets.Widget): the widget being deserialized (unused)
+
+    Returns:
+        np.ndarray: the array (a read-only view over the received buffer)
+    """
+    if value is None:
+        return None
+    arr = np.frombuffer(value['buffer'], dtype=value['dtype'])
+    return arr.reshape(value['shape'])
+
+
+def nested_arrays_to_json(obj, widget=None):
+    """ Serialize a JSON-like structure (dicts, lists) that may contain numpy arrays.
+
+    Arrays are serialized with :func:`array_to_json`; ipywidgets moves their buffers into the
+    binary part of the state message.
+    """
+    if isinstance(obj, np.ndarray):
+        return array_to_json(obj)
+    elif isinstance(obj, dict):
+        return {key: nested_arrays_to_json(val) for key, val in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [nested_arrays_to_json(val) for val in obj]
+    else:
+        return obj
+
+
+def extract_buffers(obj, buffers=None):
+    """ Prepare a custom message that may contain numpy arrays.
+
+    Like :func:`nested_arrays_to_json`, except that each array's ``'buffer'`` field is an index
+    into the returned list of buffers, which should be passed as the ``buffers`` argument of
+    :meth:`ipywidgets.Widget.send`.
+
+    Returns:
+        Tuple[object, List[memoryview]]: message content and list of binary buffers
+    """
+    if buffers is None:
+        buffers = []
+    if isinstance(obj, np.ndarray):
+        obj = array_to_json(obj)
+        buffers.append(obj['buffer'])
+        obj['buffer'] = len(buffers) - 1
+    elif isinstance(obj, dict):
+        obj = {key: extract_buffers(val, buffers)[0] for key, val in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        obj = [extract_buffers(val, buffers)[0] for val in obj]
+    return obj, buffers
+
+
+array_serialization = dict(to_json=array_to_json, from_json=array_from_json)
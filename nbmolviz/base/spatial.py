@@ -0,0 +1,81 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import itertools
+
+import numpy as np
+
+
+class CellList(object):
+    """ A spatial index that bins points into a regular grid of cubic cells.
+
+    Building it costs one sort of the points; a query only looks at the points in cells that
+    overlap the query sphere.
+
+    Args:
+        positions (np.ndarray[shape=(*,3)]): point coordinates (kept by reference)
+        cell_size (float): edge length of each cell, in the same units as ``positions``
+    """
+    def __init__(self, positions, cell_size):
+        self.positions = positions
+        self.cell_size = float(cell_size)
+        points = np.asarray(positions, dtype='float64').reshape(-1, 3)
+
+        if len(points) == 0:
+            self.origin = np.zeros(3)
+            self.shape = np.ones(3, dtype='int64')
+        else:
+            self.origin = points.min(axis=0)
+            self.shape = np.floor((points.max(axis=0) - self.origin)
+                                  / self.cell_size).astype('int64') + 1
+
+        cells = np.floor((points - self.origin) / self.cell_size).astype('int64')
+        keys = np.ravel_multi_index(cells.T, self.shape)
+        self.order = np.argsort(keys, kind='mergesort')
+        self.cell_keys, self.cell_starts = np.unique(keys[self.order], return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(points))
+        self._points = points
+
+    def query_sphere(self, center, radius):
+        """ Indices of all points within a sphere
+
+        Args:
+            center (np.ndarray[shape=(3,)]): center of the sphere
+            radius (float): radius of the sphere
+
+        Returns:
+            np.ndarray[int64]: sorted indices of the points within ``radius`` of ``center``
+        """
+        center = np.asarray(center, dtype='float64')
+        lo = np.floor((center - radius - self.origin) / self.cell_size).astype('int64')
+        hi = np.floor((center + radius - self.origin) / self.cell_size).astype('int64')
+        if (hi < 0).any() or (lo >= self.shape).any():
+            return np.zeros(0, dtype='int64')
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, self.shape - 1)
+
+        ranges = [np.arange(lo[i], hi[i] + 1) for i in range(3)]
+        keys = np.ravel_multi_index(np.array(list(itertools.product(*ranges))).T, self.shape)
+        found = np.searchsorted(self.cell_keys, keys[np.isin(keys, self.cell_keys)])
+        if len(found) == 0:
+            return np.zeros(0, dtype='int64')
+
+        candidates = self.order[np.concatenate([np.arange(self.cell_starts[i], self.cell_ends[i])
+                                                for i in found])]
+        deltas = self._points[candidates] - center
+        inside = (deltas * deltas).sum(axis=1) <= radius * radius
+        return np.sort(candidates[inside])
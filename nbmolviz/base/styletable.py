@@ -0,0 +1,147 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+from .serializers import array_to_json
+
+
+class StyleTable(object):
+    """ Per-atom rendering styles, stored as a small table of distinct style records plus an
+    integer style id for each atom.
+
+    Restyling cost scales with the number of distinct styles, not the number of atoms. The
+    id array and the record list are always modified in place.
+
+    Args:
+        num_atoms (int): number of atoms to store styles for
+    """
+    COMPACT_THRESHOLD = 64  # only look for unused records once there are this many
+
+    def __init__(self, num_atoms):
+        self.ids = np.zeros(num_atoms, dtype='int32')
+        self.records = []
+        self._lookup = {}
+        self.intern({})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, atomindex):
+        """ dict: the style record for the atom at this index (do not modify it)
+        """
+        return self.records[self.ids[atomindex]]
+
+    @staticmethod
+    def _key(style):
+        return tuple(sorted(style.items()))
+
+    def intern(self, style):
+        """ Get the id for a style record, adding it to the table if necessary
+
+        Args:
+            style (dict): style record (values must be hashable)
+
+        Returns:
+            int: id of this style in the table
+        """
+        key = self._key(style)
+        styleid = self._lookup.get(key, None)
+        if styleid is None:
+            styleid = self._lookup[key] = len(self.records)
+            self.records.append(dict(style))
+        return styleid
+
+    def assign(self, indices, style):
+        """ Give these atoms exactly this style
+
+        Args:
+            indices (slice or np.ndarray): indices (or boolean mask) of the atoms to style
+            style (dict): style record
+        """
+        self.ids[indices] = self.intern(style)
+        self.compact()
+
+    def set_field(self, indices, key, values):
+        """ Set a single field (e.g. ``'color'``) in these atoms' styles, keeping the rest
+
+        Args:
+            indices (slice or np.ndarray): indices (or boolean mask) of the atoms to change
+            key (str): name of the field
+            values (object or List[object]): a single value for all atoms, or one per atom
+        """
+        if isinstance(values, (list, tuple, np.ndarray)):
+            choices, valueids = np.unique(np.asarray(values), return_inverse=True)
+            choices = [choice.item() for choice in choices]
+        else:
+            choices, valueids = [values], 0
+
+        combined = self.ids[indices].astype('int64') * len(choices) + valueids
+        pairs, inverse = np.unique(combined, return_inverse=True)
+        newids = np.empty(len(pairs), dtype='int32')
+        for i, pair in enumerate(pairs):
+            record = dict(self.records[pair // len(choices)])
+            record[key] = choices[pair % len(choices)]
+            newids[i] = self.intern(record)
+        self.ids[indices] = newids[inverse]
+        self.compact()
+
+    def remove_field(self, indices, key):
+        """ Remove a field (e.g. ``'color'``) from these atoms' styles
+
+        Args:
+            indices (slice or np.ndarray): indices (or boolean mask) of the atoms to change
+            key (str): name of the field
+        """
+        oldids, inverse = np.unique(self.ids[indices], return_inverse=True)
+        newids = np.empty(len(oldids), dtype='int32')
+        for i, oldid in enumerate(oldids):
+            record = dict(self.records[oldid])
+            record.pop(key, None)
+            newids[i] = self.intern(record)
+        self.ids[indices] = newids[inverse]
+        self.compact()
+
+    def compact(self):
+        """ Drop style records that are no longer used by any atom
+        """
+        if len(self.records) < self.COMPACT_THRESHOLD:
+            return
+        used = np.unique(self.ids)
+        if len(used) * 2 > len(self.records):
+            return
+
+        renumber = np.zeros(len(self.records), dtype='int32')
+        renumber[used] = np.arange(len(used), dtype='int32')
+        self.ids[:] = renumber[self.ids]
+        self.records[:] = [self.records[i] for i in used]
+        self._lookup = {self._key(record): i for i, record in enumerate(self.records)}
+
+
+def styletable_to_json(table, widget=None):
+    """ Serialize a :class:`StyleTable` as a binary int32 array of style ids plus the list of
+    distinct style records
+
+    If the widget only shows some of its atoms (its ``shown_atoms`` attribute isn't None), only
+    those atoms' style ids are sent.
+    """
+    if table is None:
+        return None
+    shown = getattr(widget, 'shown_atoms', None)
+    ids = table.ids if shown is None else table.ids[shown]
+    return {'ids': array_to_json(ids),
+            'table': table.records}
@@ -0,0 +1,234 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import weakref
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
+import numpy as np
+
+_topologies = weakref.WeakKeyDictionary()
+
+
+def get_topology(obj):
+    """ Get the (shared) :class:`Topology` for a molecule or group of atoms.
+
+    Topologies are cached per object, so that every viewer and widget showing the same
+    molecule shares one copy. A cached topology is rebuilt automatically once the object's
+    :func:`topology_fingerprint` changes - i.e., when atoms, residues, chains or bonds are
+    added or removed, or bond orders change.
+
+    Args:
+        obj (moldesign.Molecule or moldesign.AtomContainer or List[moldesign.Atom]): molecule or
+           atoms (plain lists of atoms can't be cached; they get a new topology every time)
+
+    Returns:
+        Topology: the topology (shared between callers - do not modify it)
+    """
+    fingerprint = topology_fingerprint(obj)
+    try:
+        topology = _topologies.get(obj, None)
+    except TypeError:  # this object can't be weakly referenced, so it can't be cached
+        topology = None
+
+    if topology is None or topology.fingerprint != fingerprint:
+        topology = Topology(obj, fingerprint)
+        try:
+            _topologies[obj] = topology
+        except TypeError:
+            pass
+
+    return topology
+
+
+def invalidate_topology(obj):
+    """ Discard the cached :class:`Topology` for a molecule, so that it's rebuilt the next time
+    it's needed. This is only needed for changes that :func:`topology_fingerprint` doesn't
+    see, such as replacing atoms in the middle of a molecule with the same number of others.
+
+    Args:
+        obj (moldesign.Molecule or moldesign.AtomContainer): molecule or atoms
+    """
+    try:
+        _topologies.pop(obj, None)
+    except TypeError:  # never cached
+        pass
+
+
+def topology_fingerprint(obj):
+    """ A cheap summary of a molecule's topology, which changes if atoms, residues, chains or
+    bonds are added or removed, or bond orders change. Atoms, residues and chains are only
+    counted; bonds are summarized by :func:`_bond_signature`.
+
+    Args:
+        obj (moldesign.Molecule or List[moldesign.Atom]): molecule or atoms to fingerprint
+
+    Returns:
+        tuple: the fingerprint
+    """
+    atoms = getattr(obj, 'atoms', obj)
+    return (len(atoms),
+            len(getattr(obj, 'residues', ())),
+            len(getattr(obj, 'chains', ())),
+            id(atoms[0]) if len(atoms) else None,
+            id(atoms[-1]) if len(atoms) else None,
+            _bond_signature(obj, atoms))
+
+
+def _bond_signature(obj, atoms):
+    """ Hash of the orders of each atom's bonds. It changes when a bond is added, removed or
+    moved to another atom (which changes the atoms' numbers of bonds), or changes order.
+
+    For molecules, this reads moldesign's bond dictionaries directly (at roughly 0.5 us per
+    atom), instead of going through each atom's ``bond_graph`` property.
+    """
+    graph = getattr(obj, 'bond_graph', None)
+    if graph is None:
+        bonds = (atom.bond_graph for atom in atoms)
+    else:
+        bonds = getattr(graph, 'data', graph).values()  # moldesign keeps plain dicts in .data
+    return hash(tuple(tuple(getattr(b, 'data', b).values()) for b in bonds))
+
+
+class Topology(object):
+    """ Index arrays describing the topology of a set of atoms.
+
+    All indices are local to this set of atoms (for a molecule, they're the same as
+    ``atom.index``). To avoid keeping molecules alive, this only stores arrays - never
+    references to atoms, residues or chains.
+
+    Attributes:
+        fingerprint (tuple): the :func:`topology_fingerprint` this was built for
+        num_atoms (int): number of atoms
+        residue_index (np.ndarray[int32]): index of each atom's residue
+        residue_first_atom (np.ndarray[int32]): index of the first atom in each residue
+        residue_types (np.ndarray[str]): each residue's type (``'protein'``, ``'water'``, ...)
+        residue_type_names (np.ndarray[str]): the distinct residue types
+        atom_residue_types (np.ndarray[int16]): for each atom, the index of its residue's type
+           in ``residue_type_names`` (see :meth:`residue_type_mask`)
+        chain_index (np.ndarray[int32]): index of each residue's chain
+        chain_first_atom (np.ndarray[int32]): index of the first atom in each chain
+        bonds (np.ndarray[int32]): shape (num_bonds, 2) - atom indices for each bond between
+           two atoms in this set (first index always smaller)
+        bond_orders (np.ndarray[int8]): order of each bond
+        num_bonds (np.ndarray[int32]): number of bonds for each atom, including any to atoms
+           outside this set
+        unbonded (np.ndarray[bool]): mask of atoms with no bonds
+        derived (dict): other data computed from this topology, which should be discarded with
+           it (see :meth:`cached`)
+    """
+    def __init__(self, obj, fingerprint):
+        atoms = getattr(obj, 'atoms', obj)
+        self.fingerprint = fingerprint
+        self.num_atoms = len(atoms)
+        self._atom_ids = {id(atom): i for i, atom in enumerate(atoms)}
+
+        self.residue_index, self.residue_first_atom = self._group(
+                atom.residue for atom in atoms)
+        self.residue_types = np.array([atoms[i].residue.type for i in self.residue_first_atom],
+                                      dtype='str')
+        self.residue_type_names, residue_type_codes = np.unique(self.residue_types,
+                                                                return_inverse=True)
+        self.atom_residue_types = residue_type_codes.astype('int16')[self.residue_index]
+        atom_chains, self.chain_first_atom = self._group(
+                atom.chain for atom in atoms)
+        self.chain_index = atom_chains[self.residue_first_atom]
+
+        bonds = []
+        self.num_bonds = np.zeros(self.num_atoms, dtype='int32')
+        for i, atom in enumerate(atoms):
+            self.num_bonds[i] = len(atom.bond_graph)
+            for nbr, order in atom.bond_graph.items():
+                j = self._atom_ids.get(id(nbr), -1)
+                if j > i:
+                    bonds.append((i, j, order or 1))
+        bonds = np.array(bonds, dtype='int32').reshape(-1, 3)
+        self.bonds = bonds[:, :2].copy()
+        self.bond_orders = bonds[:, 2].astype('int8')
+        self.unbonded = self.num_bonds == 0
+
+        self.derived = {}
+
+    def _group(self, parents):
+        """ Index arrays for the groups (residues or chains) that contain each atom
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: group index for each atom, index of each group's
+               first atom
+        """
+        groupids = {}
+        atom_groups = np.empty(self.num_atoms, dtype='int32')
+        first_atoms = []
+        for i, parent in enumerate(parents):
+            idx = groupids.get(id(parent), None)
+            if idx is None:
+                idx = groupids[id(parent)] = len(first_atoms)
+                first_atoms.append(i)
+            atom_groups[i] = idx
+        return atom_groups, np.array(first_atoms, dtype='int32')
+
+    def residue_type_mask(self, *types):
+        """ Mask of the atoms in residues of any of these types
+
+        Args:
+            *types (str): residue types (e.g. ``'protein'``, ``'dna'``)
+
+        Returns:
+            np.ndarray[bool]: mask over all atoms
+        """
+        codes = np.flatnonzero(np.isin(self.residue_type_names, types))
+        return np.isin(self.atom_residue_types, codes)
+
+    def index_map(self, atoms):
+        """ A read-only mapping from each atom to its index in this topology
+
+        Args:
+            atoms (List[moldesign.Atom]): the atoms this topology was built from
+
+        Returns:
+            AtomIndexMap: the map
+        """
+        return AtomIndexMap(atoms, self._atom_ids)
+
+    def cached(self, key, func):
+        """ Return ``self.derived[key]``, computing it with ``func()`` if it's not there yet
+        """
+        if key not in self.derived:
+            self.derived[key] = func()
+        return self.derived[key]
+
+
+class AtomIndexMap(Mapping):
+    """ Maps atoms to their indices in a :class:`Topology`, without copying its lookup table
+    """
+    def __init__(self, atoms, atom_ids):
+        self._atoms = atoms
+        self._atom_ids = atom_ids
+
+    def __getitem__(self, atom):
+        idx = self._atom_ids.get(id(atom), None)
+        if idx is None or self._atoms[idx] is not atom:
+            raise KeyError(atom)
+        return idx
+
+    def __iter__(self):
+        return iter(self._atoms)
+
+    def __len__(self):
+        return len(self._atoms)
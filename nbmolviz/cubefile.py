@@ -0,0 +1,370 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Reading and writing Gaussian cube files.
+
+Values are formatted and parsed a block of rows at a time with numpy, instead of one number at
+a time - writing a 100x100x100 grid to a ``StringIO`` takes about 40 ms, against about 2.8 s for
+printing the values one at a time. Optionally, values read from disk can be stored in a ``.npy``
+file next to the cube file (the "sidecar") and memory-mapped from there, so even very large
+grids don't need to fit in memory, and reading the same file again skips the parsing.
+
+All distances here are in angstroms.
+"""
+import codecs
+import io
+import os
+
+import numpy as np
+from past.builtins import basestring
+
+BOHR = 0.52917721067  # angstroms
+VALUES_PER_LINE = 6
+ROWS_PER_BLOCK = 2048  # number of (x, y) rows to format or parse at once
+
+
+class CubeData(object):
+    """ The contents of a cube file.
+
+    Attributes:
+        origin (np.ndarray[shape=(3,)]): position of the first grid point (angstroms)
+        axes (np.ndarray[shape=(3,3)]): step along each grid axis (one per row; angstroms)
+        values (np.ndarray): grid values, with shape ``(nx, ny, nz)``, or
+           ``(nx, ny, nz, num_orbitals)`` for files with several orbitals (memory-mapped
+           read-only if the file was read with ``mmap=True``)
+        atoms (np.ndarray[shape=(*,5)]): atomic number, charge, and x, y, z for each atom
+        orbital_ids (List[int]): orbital numbers (None if the file doesn't list them)
+        comments (List[str]): the two comment lines
+    """
+    def __init__(self, origin, axes, values, atoms=None, orbital_ids=None, comments=None):
+        self.origin = np.asarray(origin, dtype='float64')
+        self.axes = np.asarray(axes, dtype='float64')
+        self.values = values
+        self.atoms = np.zeros((0, 5)) if atoms is None else np.asarray(atoms, dtype='float64')
+        self.orbital_ids = orbital_ids
+        self.comments = comments if comments is not None else ['', '']
+
+    @property
+    def shape(self):
+        """ Tuple[int]: number of grid points along each axis
+        """
+        return self.values.shape[:3]
+
+    @property
+    def spacing(self):
+        """ np.ndarray[shape=(3,)]: grid spacing along each axis (angstroms)
+        """
+        return np.sqrt((self.axes ** 2).sum(axis=1))
+
+    def orbital(self, i):
+        """ np.ndarray[shape=(nx,ny,nz)]: values for the i-th orbital in the file
+        """
+        if self.values.ndim == 3:
+            if i != 0:
+                raise IndexError('This file only contains one set of values')
+            return self.values
+        return self.values[..., i]
+
+    def to_grid(self):
+        """ The grid as a :class:`moldesign.mathutils.VolumetricGrid` (axes must be aligned
+        with x, y and z)
+
+        Returns:
+            moldesign.mathutils.VolumetricGrid: the grid
+        """
+        from moldesign import units as u
+        from moldesign.mathutils import VolumetricGrid
+
+        if np.count_nonzero(self.axes - np.diag(np.diag(self.axes))):
+            raise ValueError("Can't convert a cube file with skewed axes to a VolumetricGrid")
+        ends = self.origin + np.diag(self.axes) * (np.array(self.shape) - 1)
+        return VolumetricGrid(*[(lo * u.angstrom, hi * u.angstrom)
+                                for lo, hi in zip(self.origin, ends)],
+                              xpoints=self.shape[0], ypoints=self.shape[1],
+                              zpoints=self.shape[2])
+
+
+def write_cube(dest, origin, spacing, values, atoms=None, orbital_ids=None,
+               comments=('CUBE File', 'Generated by nbmolviz')):
+    """ Write a cube file
+
+    Args:
+        dest (str or file): path, or text file object, to write to
+        origin (Vector[len=3]): position of the first grid point (angstroms)
+        spacing (Vector[len=3] or Matrix[shape=(3,3)]): grid spacing along x, y and z, or the
+           step vector for each grid axis (angstroms)
+        values (np.ndarray): grid values with shape ``(nx, ny, nz)``, or
+           ``(nx, ny, nz, num_orbitals)``
+        atoms (np.ndarray[shape=(*,5)]): atomic number, charge, x, y, z for each atom (by
+           default, a single dummy atom is written, which shouldn't be rendered)
+        orbital_ids (List[int]): orbital numbers to list in the header (required if
+           ``values`` has more than one orbital)
+        comments (Tuple[str]): the two comment lines
+    """
+    values = np.asarray(getattr(values, 'magnitude', values))
+    if values.ndim not in (3, 4):
+        raise ValueError('Expected values with shape (nx, ny, nz[, num_orbitals]), got %s'
+                         % (values.shape,))
+    if values.ndim == 4 and orbital_ids is None:
+        orbital_ids = list(range(1, values.shape[3] + 1))
+    if orbital_ids is None and atoms is None:
+        orbital_ids = [1]  # the original nbmolviz header for a single orbital
+    if atoms is None:
+        atoms = [(6, 0.0, 0.0, 0.0, 0.0)]
+    atoms = np.asarray(atoms, dtype='float64').reshape(-1, 5)
+    axes = np.asarray(spacing, dtype='float64')
+    if axes.ndim == 1:
+        axes = np.diag(axes)
+
+    if isinstance(dest, basestring):
+        with io.open(dest, 'w') as fobj:
+            _write(fobj, origin, axes, values, atoms, orbital_ids, comments)
+    else:
+        _write(dest, origin, axes, values, atoms, orbital_ids, comments)
+
+
+def _write(fobj, origin, axes, values, atoms, orbital_ids, comments):
+    natoms = -len(atoms) if orbital_ids is not None else len(atoms)
+    header = list(comments)
+    header.append('%d %f %f %f' % ((natoms,) + tuple(origin)))
+    for npoints, axis in zip(values.shape[:3], axes):  # negative counts: angstroms
+        header.append('%d %f %f %f' % ((-npoints,) + tuple(axis)))
+    for atom in atoms:
+        header.append('%d %f %f %f %f' % ((int(atom[0]),) + tuple(atom[1:])))
+    if orbital_ids is not None:
+        header.append(' '.join(str(i) for i in [len(orbital_ids)] + list(orbital_ids)))
+    fobj.write(u'\n'.join(header) + u'\n')
+
+    rows = values.reshape(values.shape[0] * values.shape[1], -1)
+    rowlength = rows.shape[1]
+    fullines, remainder = divmod(rowlength, VALUES_PER_LINE)
+    rowformat = (' %12.5E' * VALUES_PER_LINE + '\n') * fullines
+    if remainder:
+        rowformat += ' %12.5E' * remainder + '\n'
+
+    for start in range(0, len(rows), ROWS_PER_BLOCK):
+        block = rows[start:start + ROWS_PER_BLOCK]
+        text = _format_rows(block)
+        if text is None:  # exponents that need 3 digits, or nan/inf
+            text = str((rowformat * len(block)) % tuple(block.ravel().tolist()))
+        fobj.write(text)
+
+
+# Fields are formatted as ' %12.5E' by copying packed characters from small lookup tables
+# straight into the output buffer: a space and the sign (bytes 0-1), the first three digits of
+# the mantissa (2-5, "d.dd"), then its last three digits and the "E" (6-9, "dddE"), and the
+# exponent, again with the "E" (9-12, "E+dd" - the two fields overlap on the "E")
+_FIELD = np.dtype({'names': ['sign', 'head', 'tail', 'exponent'],
+                   'formats': ['u2', 'u4', 'u4', 'u4'],
+                   'offsets': [0, 2, 6, 9], 'itemsize': 13})
+
+
+def _packed(strings, dtype):
+    """ Lookup table of equal-length ascii strings, each packed into one integer """
+    return np.frombuffer(b''.join(s.encode('ascii') for s in strings), dtype=dtype)
+
+
+_SIGNS = _packed(['  ', ' -'], 'u2')
+_HEADS = _packed(['%.2f' % (i / 100) for i in range(100, 1000)] + ['0.00'], 'u4')
+_TAILS = _packed(['%03dE' % i for i in range(1000)], 'u4')
+_EXPONENTS = _packed(['E%+03d' % e for e in range(-99, 100)], 'u4')
+_SCALES = 10.0 ** np.arange(104, -95, -1)  # 10**(5-e) for e in -99..99
+
+
+def _format_rows(rows):
+    """ Format a block of rows, six values per line, each row starting on a new line.
+
+    Values smaller than 1E-99 in magnitude are written as 0. Values exactly halfway between two
+    6-digit mantissas may round the other way from ``'%12.5E' % value``.
+
+    Returns:
+        str: the formatted values, or None if they contain values that need a 3-digit
+           exponent, nan or inf
+    """
+    x = np.asarray(rows, dtype='float64')
+    if not np.isfinite(x).all():
+        return None
+    magnitude = np.abs(x)
+    zero = magnitude < 1E-99
+    magnitude[zero] = 1.0
+    exponent = np.floor(np.log10(magnitude)).astype('int32')
+    if exponent.max() > 99:
+        return None
+    scaled = _SCALES.take(exponent + 99)
+    scaled *= magnitude
+    mantissa = np.rint(scaled, out=scaled).astype('int32')
+
+    # log10 can be off by one near powers of 10, and rounding can carry into a new digit
+    wrong = (mantissa >= 1000000) | (mantissa < 100000)
+    if wrong.any():
+        exponent[wrong] += np.where(mantissa[wrong] >= 1000000, 1, -1)
+        if np.abs(exponent).max() > 99:
+            return None
+        mantissa[wrong] = np.rint(magnitude[wrong] * _SCALES.take(exponent[wrong] + 99))
+    head = mantissa // 1000
+    tail = mantissa - head * 1000
+    head -= 100
+    if zero.any():
+        head[zero] = 900  # "0.00"
+        tail[zero] = 0
+        exponent[zero] = 0
+    exponent += 99
+    indices = [('sign', _SIGNS, (np.signbit(x) & ~zero).view('int8')),
+               ('head', _HEADS, head),
+               ('tail', _TAILS, tail),
+               ('exponent', _EXPONENTS, exponent)]
+
+    # each row is its full lines, then its last partial line (if any), each ending in a newline
+    nrows, rowlength = x.shape
+    fullines, remainder = divmod(rowlength, VALUES_PER_LINE)
+    linelength = VALUES_PER_LINE * _FIELD.itemsize + 1
+    rowbytes = fullines * linelength + (remainder * _FIELD.itemsize + 1 if remainder else 0)
+    out = np.empty((nrows, rowbytes), dtype='uint8')
+    out[:, linelength - 1:fullines * linelength:linelength] = ord('\n')
+    out[:, -1] = ord('\n')
+    lines = np.ndarray((nrows, fullines, VALUES_PER_LINE), dtype=_FIELD, buffer=out,
+                       strides=(rowbytes, linelength, _FIELD.itemsize))
+    lastline = np.ndarray((nrows, remainder), dtype=_FIELD, buffer=out,
+                          offset=fullines * linelength, strides=(rowbytes, _FIELD.itemsize))
+    split = fullines * VALUES_PER_LINE
+    for name, table, index in indices:
+        column = table.take(index)
+        lines[name] = column[:, :split].reshape(lines.shape)
+        lastline[name] = column[:, split:]
+    return codecs.decode(out, 'ascii')  # (without copying the array to bytes first)
+
+
+def read_cube(source, mmap=False):
+    """ Read a cube file (including files with several orbitals). Files in bohr are converted
+    to angstroms.
+
+    Args:
+        source (str or file): path, or text file object, to read from
+        mmap (bool): for paths, store the values in a ``.npy`` file next to the cube file
+           (``source + '.npy'``) and memory-map them from there, instead of reading them into
+           memory (the ``.npy`` file is reused as long as it's newer than the cube file)
+
+    Returns:
+        CubeData: the file's contents
+    """
+    if not isinstance(source, basestring):
+        header = _read_header(source)
+        return CubeData(values=_read_values(source, header.pop('shape')), **header)
+
+    sidecar = source + '.npy' if mmap else None
+    with io.open(source, 'r') as fobj:
+        header = _read_header(fobj)
+        shape = header.pop('shape')
+        if sidecar is None:
+            return CubeData(values=_read_values(fobj, shape), **header)
+
+        if (os.path.exists(sidecar)
+                and os.path.getmtime(sidecar) >= os.path.getmtime(source)):
+            values = np.load(sidecar, mmap_mode='r')
+            if values.shape == shape:
+                return CubeData(values=values, **header)
+
+        try:
+            out = np.lib.format.open_memmap(sidecar, mode='w+', dtype='float32', shape=shape)
+        except (IOError, OSError):  # e.g., a read-only directory
+            return CubeData(values=_read_values(fobj, shape), **header)
+        _read_values(fobj, shape, out)
+        out.flush()
+        del out
+        return CubeData(values=np.load(sidecar, mmap_mode='r'), **header)
+
+
+def _tokens(fobj, count):
+    """ Read lines until at least ``count`` whitespace-separated tokens were read
+    """
+    tokens = []
+    while len(tokens) < count:
+        line = fobj.readline()
+        if not line:
+            raise ValueError('Unexpected end of cube file')
+        tokens.extend(line.split())
+    return tokens
+
+
+def _read_header(fobj):
+    """ Read everything up to the grid values
+
+    Returns:
+        dict: ``CubeData`` arguments, plus the ``shape`` of the values
+    """
+    comments = [fobj.readline().rstrip('\n') for i in range(2)]
+    fields = fobj.readline().split()
+    natoms = int(fields[0])
+    origin = np.array(fields[1:4], dtype='float64')
+
+    shape = []
+    axes = np.zeros((3, 3))
+    for i in range(3):
+        fields = fobj.readline().split()
+        shape.append(int(fields[0]))
+        axes[i] = np.array(fields[1:4], dtype='float64')
+
+    atoms = np.array([fobj.readline().split()[:5] for i in range(abs(natoms))],
+                     dtype='float64').reshape(-1, 5)
+
+    if shape[0] > 0:  # a positive count along the first axis means the file is in bohr
+        origin *= BOHR
+        axes *= BOHR
+        atoms[:, 2:5] *= BOHR
+    shape = [abs(npoints) for npoints in shape]
+
+    orbital_ids = None
+    if natoms < 0:
+        tokens = _tokens(fobj, 1)
+        norbitals = int(tokens[0])
+        if len(tokens) - 1 < norbitals:
+            tokens += _tokens(fobj, norbitals - len(tokens) + 1)
+        orbital_ids = [int(i) for i in tokens[1:norbitals + 1]]
+        if norbitals > 1:
+            shape.append(norbitals)
+
+    return dict(origin=origin, axes=axes, atoms=atoms, orbital_ids=orbital_ids,
+                comments=comments, shape=tuple(shape))
+
+
+def _read_values(fobj, shape, out=None):
+    """ Parse the grid values, a block of rows at a time
+
+    Args:
+        fobj (file): file object, positioned after the header
+        shape (Tuple[int]): shape of the values
+        out (np.ndarray): array to store the values in (default: a new float32 array)
+
+    Returns:
+        np.ndarray: the values
+    """
+    if out is None:
+        out = np.empty(shape, dtype='float32')
+    flat = out.reshape(-1)
+    rowlength = int(np.prod(shape[2:]))
+    linesperrow = -(-rowlength // VALUES_PER_LINE)
+
+    filled = 0
+    while filled < len(flat):
+        lines = [fobj.readline() for i in range(linesperrow * ROWS_PER_BLOCK)]
+        block = np.array(''.join(lines).split(), dtype='float32')
+        if len(block) == 0:
+            raise ValueError('Cube file ended after %d of %d values' % (filled, len(flat)))
+        block = block[:len(flat) - filled]
+        flat[filled:filled + len(block)] = block
+        filled += len(block)
+    return out
@@ -0,0 +1,317 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Frame providers let :class:`.trajectory_viewer.TrajectoryViewer` show trajectories that
+don't fit in memory, by reading each frame only when it's needed.
+
+A frame provider is any object with:
+  - ``num_frames`` (int): number of frames
+  - ``num_atoms`` (int): number of atoms in each frame
+  - ``get_positions(framenum)``: returns a frame's atomic positions, as a float32 array of
+    shape ``(num_atoms, 3)`` in angstroms
+  - ``get_annotation(framenum)``: returns a frame's annotation string (may be empty)
+"""
+import collections
+import concurrent.futures
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+from past.builtins import basestring
+
+
+class FrameProvider(object):
+    """ Base class for frame providers (subclasses implement ``get_positions``)
+    """
+    num_frames = 0
+    num_atoms = 0
+
+    def get_positions(self, framenum):
+        raise NotImplementedError()
+
+    def get_annotation(self, framenum):
+        return ''
+
+    def __len__(self):
+        return self.num_frames
+
+
+class TrajectoryFrames(FrameProvider):
+    """ Frames of an in-memory :class:`moldesign.Trajectory`
+    """
+    def __init__(self, traj):
+        from moldesign import units as u
+        self.traj = traj
+        self.num_frames = traj.num_frames
+        self.num_atoms = traj.mol.num_atoms
+        self._units = u.angstrom
+
+    def get_positions(self, framenum):
+        return np.asarray(self.traj.positions[framenum].value_in(self._units), dtype='float32')
+
+    def get_annotation(self, framenum):
+        return self.traj.frames[framenum].get('annotation', '')
+
+
+class ArrayFrames(FrameProvider):
+    """ Frames stored in an array of shape ``(num_frames, num_atoms, 3)``, in angstroms.
+
+    Pass a memory-mapped array (or the path of a ``.npy`` file, which is memory-mapped
+    read-only) so that frames are only read from disk when they're shown.
+
+    Args:
+        positions (np.ndarray or str): the array, or the path of a ``.npy`` file
+        annotations (List[str]): annotation for each frame (optional)
+    """
+    def __init__(self, positions, annotations=None):
+        if isinstance(positions, basestring):
+            positions = np.load(positions, mmap_mode='r')
+        if positions.ndim != 3 or positions.shape[2] != 3:
+            raise ValueError('Expected positions with shape (num_frames, num_atoms, 3), got %s'
+                             % (positions.shape,))
+        self.positions = positions
+        self.annotations = annotations
+        self.num_frames, self.num_atoms = positions.shape[:2]
+
+    def get_positions(self, framenum):
+        return np.array(self.positions[framenum], dtype='float32')
+
+    def get_annotation(self, framenum):
+        if self.annotations is None:
+            return ''
+        return self.annotations[framenum]
+
+
+class ChunkedFrames(FrameProvider):
+    """ Frames stored on disk as a series of ``.npy`` files (chunks), each of shape
+    ``(frames_in_chunk, num_atoms, 3)``, in angstroms. Chunks are used in sorted filename
+    order, and are memory-mapped only when one of their frames is read.
+
+    Args:
+        path (str): directory containing the chunks, or a glob pattern matching them
+        annotations (List[str]): annotation for each frame (optional)
+    """
+    def __init__(self, path, annotations=None):
+        if os.path.isdir(path):
+            path = os.path.join(path, '*.npy')
+        self.paths = sorted(glob.glob(path))
+        if not self.paths:
+            raise ValueError('No chunks found at %s' % path)
+        self.annotations = annotations
+
+        lengths = []
+        for chunkpath in self.paths:  # only reads the headers
+            shape = np.load(chunkpath, mmap_mode='r').shape
+            if len(shape) != 3 or shape[2] != 3:
+                raise ValueError('Expected chunk %s to have shape (*, num_atoms, 3), got %s'
+                                 % (chunkpath, shape))
+            lengths.append(shape[0])
+            self.num_atoms = shape[1]
+        self.chunk_starts = np.cumsum([0] + lengths)
+        self.num_frames = int(self.chunk_starts[-1])
+
+    def get_positions(self, framenum):
+        if not 0 <= framenum < self.num_frames:
+            raise IndexError('Frame %d out of range' % framenum)
+        chunk = np.searchsorted(self.chunk_starts, framenum, side='right') - 1
+        positions = np.load(self.paths[chunk], mmap_mode='r')
+        return np.array(positions[framenum - self.chunk_starts[chunk]], dtype='float32')
+
+    def get_annotation(self, framenum):
+        if self.annotations is None:
+            return ''
+        return self.annotations[framenum]
+
+
+def as_frame_provider(obj):
+    """ Wrap a trajectory or array of frames in a frame provider (frame providers are returned
+    unchanged)
+
+    Args:
+        obj (moldesign.Trajectory or np.ndarray or str or FrameProvider): the frames (strings
+           are paths to a ``.npy`` file or a directory of chunks)
+
+    Returns:
+        FrameProvider: the frame provider
+    """
+    if hasattr(obj, 'get_positions'):
+        return obj
+    elif isinstance(obj, basestring):
+        if os.path.isdir(obj):
+            return ChunkedFrames(obj)
+        else:
+            return ArrayFrames(obj)
+    elif isinstance(obj, np.ndarray):
+        return ArrayFrames(obj)
+    else:
+        return TrajectoryFrames(obj)
+
+
+class FrameCache(object):
+    """ Keeps the most recently used frames from a frame provider in memory (thread-safe).
+
+    Args:
+        provider (FrameProvider): where to read frames from
+        size (int): maximum number of frames to keep
+    """
+    def __init__(self, provider, size=64):
+        self.provider = provider
+        self.size = size
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_positions(self, framenum):
+        """ A frame's positions (shared - do not modify them)
+        """
+        positions = self.get_cached(framenum)
+        if positions is None:
+            positions = self.read(framenum)
+            self.put(framenum, positions)
+        return positions
+
+    def get_cached(self, framenum):
+        """ A frame's positions, or None if they aren't in the cache
+        """
+        with self._lock:
+            positions = self._frames.pop(framenum, None)
+            if positions is not None:
+                self._frames[framenum] = positions
+            return positions
+
+    def read(self, framenum):
+        """ Read a frame from the provider, as a C-contiguous float32 array that's ready to
+        send to the browser
+        """
+        return np.ascontiguousarray(self.provider.get_positions(framenum), dtype='float32')
+
+    def put(self, framenum, positions):
+        with self._lock:
+            self._frames.pop(framenum, None)
+            self._frames[framenum] = positions
+            while len(self._frames) > self.size:
+                self._frames.popitem(last=False)
+
+    def __contains__(self, framenum):
+        with self._lock:
+            return framenum in self._frames
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+
+class FramePrefetcher(FrameCache):
+    """ A frame cache that reads ahead on background threads.
+
+    Each request predicts the next ones from the last two: frames in the same direction, spaced
+    by the same step (so fast scrubbing with the slider prefetches frames further apart). The
+    ``window`` predicted frames that aren't cached yet are read on a thread pool; predictions
+    that are no longer needed are cancelled if they haven't started.
+
+    Attributes:
+        hits (int): requests for frames that were already cached or being prefetched
+        misses (int): requests that had to read the frame synchronously
+
+    Args:
+        provider (FrameProvider): where to read frames from
+        size (int): maximum number of frames to keep (should be well above ``window``)
+        window (int): number of frames to prefetch (0 to disable prefetching)
+        max_workers (int): number of threads reading frames
+    """
+    def __init__(self, provider, size=64, window=8, max_workers=2):
+        super().__init__(provider, size)
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self._executor = None
+        if window:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._loading = {}
+        self._last_request = None
+
+    def get_positions(self, framenum):
+        positions = self.get_cached(framenum)
+        if positions is None:
+            future = self._loading.get(framenum, None)
+            if future is not None and not future.cancelled():
+                positions = future.result()
+        if positions is None:
+            self.misses += 1
+            positions = self.read(framenum)
+            self.put(framenum, positions)
+        else:
+            self.hits += 1
+
+        self._prefetch(framenum)
+        return positions
+
+    def predict(self, framenum):
+        """ Frame numbers that are likely to be requested after this one
+
+        Returns:
+            List[int]: up to ``window`` frame numbers, most likely first
+        """
+        step = 1
+        if self._last_request is not None:
+            lastframe, lasttime = self._last_request
+            if framenum != lastframe:
+                step = framenum - lastframe
+                if time.time() - lasttime > 1.0:  # not scrubbing - user will probably step
+                    step = 1 if step > 0 else -1
+        predicted = (framenum + step * i for i in range(1, self.window + 1))
+        return [f for f in predicted if 0 <= f < self.provider.num_frames]
+
+    def _prefetch(self, framenum):
+        if self._executor is None:
+            return
+        predicted = self.predict(framenum)
+        self._last_request = (framenum, time.time())
+
+        for f, future in list(self._loading.items()):
+            if future.done() or (f not in predicted and future.cancel()):
+                del self._loading[f]
+        for f in predicted:
+            if f not in self._loading and f not in self:
+                self._loading[f] = self._executor.submit(self._load, f)
+
+    def _load(self, framenum):
+        positions = self.read(framenum)
+        self.put(framenum, positions)
+        return positions
+
+    def stats(self):
+        """ Prefetch statistics, for tuning ``window`` and ``size``
+
+        Returns:
+            dict: with keys ``hits``, ``misses``, ``hit_rate``, ``cached`` (frames in memory)
+               and ``loading`` (frames being prefetched)
+        """
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'cached': len(self),
+                'loading': sum(not f.done() for f in self._loading.values())}
+
+    def close(self):
+        """ Stop the background threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
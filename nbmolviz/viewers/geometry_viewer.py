@@ -17,6 +17,8 @@ standard_library.install_aliases()
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from io import StringIO
+import itertools
+import time
 
 import IPython.display as dsp
 import traitlets
@@ -26,10 +28,15 @@ import numpy as np
 import moldesign as mdt
 from moldesign import units as u
 from moldesign import utils
-from moldesign import mathutils
 
 from ..utils import translate_color, in_pixels
 from ..base.mdt2json import convert as convert_to_json
+from ..base.topology import get_topology
+from ..base.lod import LOD_SCHEMES, coarse_atoms, encode_atoms
+from ..base.framecodec import encode_frames
+from ..base.spatial import CellList
+from ..base.serializers import array_serialization, nested_arrays_to_json, extract_buffers
+from ..base.styletable import StyleTable, styletable_to_json
 from ..colormaps import colormap
 from .common import BaseViewer
 
@@ -49,12 +56,24 @@ class GeometryViewer(BaseViewer):
         width (str or int): css width spec (if str) or width in pixels (if int)
         height (str or int): css height spec (if str) or height in pixels (if int)
         **kwargs (dict): ipywidgets keyword arguments
+
+    Molecules with more than ``lod_threshold`` atoms are drawn in level-of-detail mode: only a
+    coarse representation (chosen by ``lod_scheme``, see :func:`nbmolviz.base.lod.coarse_atoms`)
+    is sent to the browser at first, and :meth:`show_detail` adds full atomic detail for
+    specific residues. Similarly, :meth:`set_region` limits the display to the atoms near a
+    point of interest.
+
+    Trajectories can be played back entirely in the browser: :meth:`load_frames` uploads the
+    positions for many frames at once, the browser animates them while ``playing`` is True, and
+    only the index of the frame being shown (``current_frame``) is sent back to the kernel.
     """
     AXISCOLORS = {'x':'red', 'y':'green', 'z':'blue'}
     DEFAULT_COLOR_MAP = colormap
     DEF_PADDING = 2.25 * u.angstrom
     DISTANCE_UNITS = u.angstrom
     HIGHLIGHT_COLOR = '#1FF3FE'
+    POSITION_PATCH_FRACTION = 0.5  # send only moved atoms if less than this fraction moved
+    REGION_CELL_SIZE = 6.0  # angstroms - cell size of the spatial index used by set_region
 
     _view_name = traitlets.Unicode('MolWidget3DView').tag(sync=True)
     _model_name = traitlets.Unicode('MolWidget3DModel').tag(sync=True)
@@ -65,18 +84,28 @@ class GeometryViewer(BaseViewer):
     background_color = traitlets.Unicode('#545c85').tag(sync=True)
     background_opacity = traitlets.Float(1.0).tag(sync=True)
     cubefile = traitlets.Unicode().tag(sync=True)
+    current_frame = traitlets.Integer(0).tag(sync=True)
     far_clip = traitlets.Float().tag(sync=True)
+    first_frame = traitlets.Integer(0).tag(sync=True)
+    frame_rate = traitlets.Float(30.0).tag(sync=True)
+    frames = traitlets.Any(None, allow_none=True).tag(sync=True, to_json=nested_arrays_to_json)
     height = traitlets.Unicode(sync=True)
     labels = traitlets.List([]).tag(sync=True)
-    model_data = traitlets.Dict({}).tag(sync=True)
+    lod_scheme = traitlets.Enum(LOD_SCHEMES, 'trace')
+    lod_threshold = traitlets.Int(100000, allow_none=True)
+    model_data = traitlets.Dict({}).tag(sync=True, to_json=nested_arrays_to_json)
     near_clip = traitlets.Float().tag(sync=True)
     outline_color = traitlets.Unicode('#000000').tag(sync=True)
     outline_width = traitlets.Float(0.0).tag(sync=True)
-    positions = traitlets.List([]).tag(sync=True)
+    playing = traitlets.Bool(False).tag(sync=True)
+    positions = traitlets.Any(np.zeros((0, 3), dtype='float32')).tag(sync=True,
+                                                                     **array_serialization)
     selected_atom_indices = traitlets.List().tag(sync=True)
     selection_type = traitlets.Unicode('Atom', choices=['Atom', 'Residue', 'Chain']).tag(sync=True)
-    shapes = traitlets.List([]).tag(sync=True)
-    styles = traitlets.Dict({}).tag(sync=True)
+    shapes = traitlets.Dict({}).tag(sync=True, to_json=nested_arrays_to_json)
+    styles = traitlets.Instance(StyleTable, allow_none=True).tag(sync=True,
+                                                                 to_json=styletable_to_json)
+    volume = traitlets.Dict({}).tag(sync=True, to_json=nested_arrays_to_json)
     volumetric_style = traitlets.Dict({}).tag(sync=True)
     width = traitlets.Unicode(sync=True)
 
@@ -84,6 +113,8 @@ class GeometryViewer(BaseViewer):
         'SPHERE': 'Sphere',
         'ARROW': 'Arrow',
         'CYLINDER': 'Cylinder',
+        'ARROW_FIELD': 'ArrowField',
+        'MESH': 'Mesh',
     }
 
     STYLE_NAMES = {'vdw': 'sphere',
@@ -111,6 +142,10 @@ class GeometryViewer(BaseViewer):
         self.atom_highlights = []
         self._axis_objects = None
         self._colored_as = {}
+        self._shape_ids = itertools.count()
+        self._pending_shape_ops = []
+        self.shown_atoms = None  # indices of the atoms sent to the browser (None for all)
+        self._cell_list = None
 
         self.add_molecule(mol)
         if style is None:
@@ -146,42 +181,53 @@ class GeometryViewer(BaseViewer):
     def autostyle(self):
         """ Attempts to create a reasonably informative default rendering style
         """
-        if self.mol.mass <= 500.0 * u.dalton:
-            self.stick()
-        else:
-            cartoon_atoms = []
-            line_atoms = []
-            stick_atoms = []
-            biochains = set()
-            for residue in self.mol.residues:
-                if residue.type in ('protein', 'dna', 'rna'):
-                    biochains.add(residue.chain)
-
-                if residue.type == 'protein':
-                    cartoon_atoms.extend(residue.atoms)
-                elif residue.type in ('water', 'solvent'):
-                    line_atoms.extend(residue.atoms)
-                elif residue.type in ('dna', 'rna') and self.mol.num_atoms > 1000:
-                    cartoon_atoms.extend(residue.atoms)
-                else:  # includes DNA, RNA if molecule is small enough
-                    stick_atoms.extend(residue.atoms)
-
-            if cartoon_atoms:
-                self.cartoon(atoms=cartoon_atoms)
-                if len(biochains) > 1:
-                    self.color_by('chain', atoms=cartoon_atoms, save=False)
-                else:
-                    self.color_by('residue.resname', atoms=cartoon_atoms, save=False)
-            if line_atoms:
-                self.line(atoms=line_atoms)
-            if stick_atoms:
-                self.stick(atoms=stick_atoms)
-
-        # Deal with unbonded atoms (they only show up in VDW rep)
-        if self.mol.num_atoms < 1000:
-            lone = [atom for atom in self.mol.atoms if atom.num_bonds == 0]
-            if lone:
-                self.vdw(atoms=lone, radius=0.5)
+        topology = get_topology(self.mol)
+        with self.batch():
+            if self.mol.mass <= 500.0 * u.dalton:
+                self.stick()
+            else:
+                nucleic = topology.residue_type_mask('dna', 'rna')
+                cartoon_atoms = topology.residue_type_mask('protein')
+                if self.mol.num_atoms > 1000:
+                    cartoon_atoms |= nucleic
+                line_atoms = topology.residue_type_mask('water', 'solvent')
+                stick_atoms = ~(cartoon_atoms | line_atoms)  # includes DNA, RNA if mol is small
+
+                if cartoon_atoms.any():
+                    self.cartoon(atoms=cartoon_atoms)
+                    atom_chains = topology.chain_index[topology.residue_index]
+                    biochains = np.unique(atom_chains[cartoon_atoms | nucleic])
+                    if len(biochains) > 1:
+                        self._colormap_categories(cartoon_atoms, atom_chains[cartoon_atoms])
+                    else:
+                        resnames = np.array([self.mol.atoms[i].residue.resname
+                                             for i in topology.residue_first_atom])
+                        self._colormap_categories(
+                                cartoon_atoms, resnames[topology.residue_index[cartoon_atoms]])
+                if line_atoms.any():
+                    self.line(atoms=line_atoms)
+                if stick_atoms.any():
+                    self.stick(atoms=stick_atoms)
+
+            # Deal with unbonded atoms (they only show up in VDW rep)
+            if self.mol.num_atoms < 1000 and topology.unbonded.any():
+                self.vdw(atoms=topology.unbonded, radius=0.5)
+
+    def _colormap_categories(self, atoms, categories):
+        """ Color atoms by category, like ``color_by(..., save=False)``, but with only one
+        colormap lookup per distinct category
+
+        Args:
+            atoms (np.ndarray): index array or mask of the atoms to color
+            categories (np.ndarray): category of each of these atoms
+        """
+        if len(categories) == 0:
+            return
+        distinct, first, inverse = np.unique(categories, return_index=True, return_inverse=True)
+        order = np.argsort(first)  # colors are assigned in order of first appearance
+        colors = np.array(colormap(list(distinct[order]), categorical=True))
+        self.styles.set_field(atoms, 'color', colors[np.argsort(order)][inverse])
+        self.send_state('styles')
 
     def show_unbonded(self, radius=0.5):
         """ Highlights all unbonded atoms as spheres.
@@ -191,8 +237,21 @@ class GeometryViewer(BaseViewer):
         Args:
             radius (Scalar[length]): radius of the spheres (default 0.5 angstrom)
         """
-        lone = [atom for atom in self.mol.atoms if atom.num_bonds == 0]
-        if lone: self.vdw(atoms=lone, radius=radius)
+        lone = get_topology(self.mol).unbonded
+        if lone.any():
+            self.vdw(atoms=lone, radius=radius)
+
+    def _atom_indices(self, atoms):
+        """ Index array for a list of atoms (or a slice over all atoms if ``atoms`` is None).
+        Index arrays and boolean masks are returned as is.
+        """
+        if atoms is None:
+            return slice(None)
+        if isinstance(atoms, np.ndarray):
+            return atoms
+        if hasattr(atoms, 'iteratoms'):
+            atoms = atoms.iteratoms()
+        return np.fromiter((atom.index for atom in atoms), dtype='int32')
 
     @staticmethod
     def _atoms_to_json(atomlist):
@@ -226,9 +285,158 @@ class GeometryViewer(BaseViewer):
     # Standard view actions
     def add_molecule(self, mol):
         self.mol = mol
-        self.model_data = convert_to_json(self.mol)
+        self._detail_residues = None
+        self._lod = self.lod_threshold is not None and self.mol.num_atoms > self.lod_threshold
+        self._region = False
+        self._cell_list = None
+        self._frame_buffer = None
+        self._frame_encoding = None
+        self.frames = None
+        if self._lod:
+            self.shown_atoms = coarse_atoms(self.mol, self.lod_scheme)
+            self.model_data = encode_atoms(self.mol, self.shown_atoms)
+        else:
+            self.shown_atoms = None
+            self.model_data = convert_to_json(self.mol)
+        self.styles = StyleTable(len(self.mol.atoms))
         self.set_positions()
 
+    @property
+    def lod_active(self):
+        """ bool: whether this viewer is in level-of-detail mode (see :meth:`show_detail`)
+        """
+        return self._lod
+
+    def set_region(self, center=None, radius=10.0, atoms=None):
+        """ Only send the atoms within a region of interest to the browser.
+
+        The region is either a sphere around ``center``, or all points within ``radius`` of any
+        of ``atoms``. When the region is moved by calling this again, only the atoms that
+        entered or left it are sent.
+
+        Args:
+            center (Vector[length, len=3]): center of the region
+            radius (Scalar[length]): radius of the region (default: 10 angstrom)
+            atoms (List[moldesign.Atom]): atoms to center the region on (instead of ``center``)
+        """
+        radius = self._convert_length(radius)
+        if atoms is not None:
+            centers = self._all_positions[self._atom_indices(atoms)]
+        elif center is not None:
+            centers = [self._convert_length(center)]
+        else:
+            raise ValueError('Either a center or a list of atoms is required')
+
+        if self._cell_list is None or self._cell_list.positions is not self._all_positions:
+            self._cell_list = CellList(self._all_positions, self.REGION_CELL_SIZE)
+        inside = [self._cell_list.query_sphere(c, radius) for c in centers]
+        self._region = True
+        self._show_atoms(np.unique(np.concatenate(inside)).astype('int32'))
+
+    def clear_region(self):
+        """ Go back to sending the whole molecule (or its coarse representation, in
+        level-of-detail mode)
+        """
+        self._region = False
+        self._refresh_shown_atoms()
+
+    def _show_atoms(self, indices):
+        """ Send a diff containing only the atoms that were added to or removed from the
+        display (instead of the entire display state).
+
+        The ``model_data`` and ``positions`` traits are updated without syncing them, so they
+        always reflect what the browser has.
+
+        Args:
+            indices (np.ndarray[int32]): indices of all atoms that should now be shown
+        """
+        oldshown = self.shown_atoms
+        if oldshown is None:  # everything's shown, so a diff would be bigger than the new state
+            self.shown_atoms = indices
+            with self.batch():
+                self.model_data = encode_atoms(self.mol, indices, trace_bonds=False)
+                self._send_positions()
+                self._send_frames()
+                self.send_state('styles')
+            return
+
+        leaving = np.isin(oldshown, indices, invert=True)
+        kept = oldshown[~leaving]
+        added = np.setdiff1d(indices, kept).astype('int32')
+        self.shown_atoms = np.concatenate((kept, added))
+        js = encode_atoms(self.mol, self.shown_atoms, trace_bonds=False)
+
+        bonds = js['bonds']
+        newbonds = np.maximum(bonds['atom1_index'], bonds['atom2_index']) >= len(kept)
+        self.send(*extract_buffers({
+            'event': 'shown_atoms',
+            'removed': oldshown[leaving],
+            'atoms': {key: column[len(kept):] for key, column in js['atoms'].items()},
+            'bonds': {key: column[newbonds] for key, column in bonds.items()},
+            'positions': self._all_positions[added],
+            'style_ids': self.styles.ids[added],
+            'style_table': self.styles.records}))
+        self._set_unsynced(model_data=js, positions=self._all_positions[self.shown_atoms])
+        self._send_frames()
+
+    def show_detail(self, atoms=None):
+        """ In level-of-detail mode, show every atom in the residues containing these atoms
+
+        Args:
+            atoms (List[moldesign.Atom]): atoms (or a residue or chain) to show in full detail
+               (default: the currently selected atoms)
+        """
+        self._set_detail(atoms, True)
+
+    def hide_detail(self, atoms=None):
+        """ In level-of-detail mode, go back to the coarse representation for these atoms'
+        residues
+
+        Args:
+            atoms (List[moldesign.Atom]): atoms (or a residue or chain) to show coarsely
+               (default: all atoms)
+        """
+        self._set_detail(atoms, False)
+
+    def _set_detail(self, atoms, detailed):
+        if not self._lod:
+            return
+        topology = get_topology(self.mol)
+        if self._detail_residues is None:
+            self._detail_residues = np.zeros(len(topology.residue_first_atom), dtype='bool')
+
+        if atoms is None and detailed:
+            atoms = self.selected_atoms
+        if atoms is None:
+            self._detail_residues[:] = detailed
+        else:
+            indices = self._atom_indices(atoms)
+            self._detail_residues[topology.residue_index[indices]] = detailed
+
+        if not self._region:  # otherwise, this takes effect once the region is cleared
+            self._refresh_shown_atoms()
+
+    def _refresh_shown_atoms(self):
+        """ Resend everything for the atoms that are shown outside of region mode
+        """
+        if self._lod:
+            topology = get_topology(self.mol)
+            shown = np.zeros(topology.num_atoms, dtype='bool')
+            shown[coarse_atoms(self.mol, self.lod_scheme)] = True
+            if self._detail_residues is not None:
+                shown |= self._detail_residues[topology.residue_index]
+            self.shown_atoms = np.flatnonzero(shown).astype('int32')
+            model_data = encode_atoms(self.mol, self.shown_atoms, self._detail_residues)
+        else:
+            self.shown_atoms = None
+            model_data = convert_to_json(self.mol)
+
+        with self.batch():
+            self.model_data = model_data
+            self._send_positions()
+            self._send_frames()
+            self.send_state('styles')
+
     def set_background_color(self, color, opacity=1.0):
         color = translate_color(color)
         self.background_color = color
@@ -264,15 +472,23 @@ class GeometryViewer(BaseViewer):
             atoms = self.mol.atoms
 
         if callable(colors):
-            colors = map(colors, atoms)
-        elif isinstance(colors, basestring) or not hasattr(colors, '__iter__'):
-            colors = [colors for atom in atoms]
+            colors = list(map(colors, atoms))
 
-        for atom,color in zip(atoms, colors):
-            c = translate_color(color, '#')
+        if isinstance(colors, basestring) or not hasattr(colors, '__iter__'):
+            c = translate_color(colors, '#')
             if save:
-                self.atom_colors[atom] = c
-            self.styles[str(atom.index)]['color'] = c
+                self.atom_colors.update((atom, c) for atom in atoms)
+            self.styles.set_field(self._atom_indices(atoms), 'color', c)
+        else:
+            translated = {}
+            hexcolors = []
+            for atom, color in zip(atoms, colors):
+                if color not in translated:
+                    translated[color] = translate_color(color, '#')
+                hexcolors.append(translated[color])
+                if save:
+                    self.atom_colors[atom] = translated[color]
+            self.styles.set_field(self._atom_indices(atoms), 'color', hexcolors)
         self.send_state('styles')
 
     set_colors = set_color  # synonym
@@ -285,11 +501,11 @@ class GeometryViewer(BaseViewer):
                all atoms)
         """
         if atoms is None:
-            atoms = self.mol.atoms
-
-        for atom in atoms:
-            self.atom_colors.pop(atom, None)
-            self.styles[str(atom.index)].pop('color', None)
+            self.atom_colors.clear()
+        else:
+            for atom in atoms:
+                self.atom_colors.pop(atom, None)
+        self.styles.remove_field(self._atom_indices(atoms), 'color')
         self.send_state('styles')
 
     @staticmethod
@@ -383,57 +599,239 @@ class GeometryViewer(BaseViewer):
 
     def _change_style(self, style_string, atoms, replace, options):
         style = self.convert_style_name(style_string)
-
-        # No atoms passed means all atoms
-        if atoms is None:
-            atoms = self.mol.atoms
-
-        newstyles = self.styles.copy()
-        for atom in atoms:
-            new_style = {'visualization_type': style}
-            for key in ('radius', 'opacity'):
-                if options.get(key, None) is not None:
-                    new_style[key] = options[key]
-
-            if 'color' in options and options['color'] is not None:
-                new_style['color'] = translate_color(options['color'], '#')
-                if atom in self.atom_colors and new_style['color'] != self.atom_colors[atom]:
+        indices = self._atom_indices(atoms)  # No atoms passed means all atoms
+        affected = np.zeros(len(self.styles), dtype='bool')
+        affected[indices] = True
+
+        new_style = {'visualization_type': style}
+        for key in ('radius', 'opacity'):
+            if options.get(key, None) is not None:
+                new_style[key] = options[key]
+
+        if 'color' in options and options['color'] is not None:
+            new_style['color'] = translate_color(options['color'], '#')
+            for atom, color in list(self.atom_colors.items()):
+                if affected[atom.index] and color != new_style['color']:
                     self.atom_colors.pop(atom)  # if color is overriden, get rid of it now
-            elif atom in self.atom_colors:
-                new_style['color'] = self.atom_colors[atom]
-            newstyles[str(atom.index)] = new_style
+            self.styles.assign(indices, new_style)
+        else:
+            self.styles.assign(indices, new_style)
+            saved = [(atom.index, color) for atom, color in self.atom_colors.items()
+                     if affected[atom.index]]
+            if saved:
+                saved_indices, saved_colors = zip(*saved)
+                self.styles.set_field(np.array(saved_indices, dtype='int32'), 'color',
+                                      list(saved_colors))
 
-        self.styles = newstyles
+        self.send_state('styles')
 
     def set_positions(self, positions=None):
         """ Set positions of atoms in the 3D display
 
+        Positions are sent to the browser as a single float32 binary buffer. If only a few
+        atoms moved since the last update, only their indices and coordinates are sent
+        (see ``POSITION_PATCH_FRACTION``) - except inside :meth:`batch`, where the positions
+        are sent in the same message as the rest of the batch.
+
         Args:
             positions (Matrix[length, shape=(*,3)]): positions to set atoms to - optional.
                If not provided, positions are taken from current positions of the molecule.
-
-        Returns:
-
+               Arrays without units are taken to be in angstroms.
         """
         if positions is None:
             pos = self.mol.positions
         else:
             pos = positions
 
-        self.positions = pos.value_in(u.angstrom).tolist()
-        self._update_clipping(np.abs(pos.value_in(self.DISTANCE_UNITS)).max())
+        pos = self._convert_length(pos)
+        self._all_positions = np.array(pos, dtype='float32')
+        self._send_positions()
+        self._update_clipping(np.abs(pos).max())
+
+    def _send_positions(self):
+        """ Send the current positions of the atoms that are shown
+        """
+        if self.shown_atoms is None:
+            newpositions = self._all_positions
+        else:
+            newpositions = self._all_positions[self.shown_atoms]
+        if (self._batch_depth > 0 or self._updates_deferred()
+                or not self._patch_positions(newpositions)):
+            self.positions = newpositions  # batched and held-back updates go in a full sync
+
+    def _patch_positions(self, newpositions):
+        """ Send a patch containing only the atoms that moved since the last update.
+
+        The ``positions`` trait is updated in place, so that it always reflects what the
+        browser has.
+
+        Args:
+            newpositions (np.ndarray[float32, shape=(*,3)]): new coordinates, in angstroms
+
+        Returns:
+            bool: True if the update was handled here; False if the full array needs to be sent
+        """
+        oldpositions = self.positions
+        if (oldpositions.shape != newpositions.shape or len(newpositions) == 0
+                or not oldpositions.flags.writeable):
+            return False
+
+        moved = np.flatnonzero((oldpositions != newpositions).any(axis=1))
+        if len(moved) > self.POSITION_PATCH_FRACTION * len(newpositions):
+            return False
+
+        if len(moved) > 0:
+            oldpositions[moved] = newpositions[moved]
+            self.send({'event': 'positions_patch', 'num_atoms': len(moved)},
+                      buffers=[memoryview(moved.astype('int32')),
+                               memoryview(oldpositions[moved])])
+            self._last_update_time = time.time()
+        return True
+
+    def set_volume(self, grid, values, dtype='float32'):
+        """ Send volumetric data (such as an orbital's amplitude on a grid) to draw as
+        isosurfaces (see ``volumetric_style``).
+
+        The values are sent as a single binary buffer; the grid's origin, spacing and shape are
+        sent alongside them as metadata.
+
+        Args:
+            grid (moldesign.mathutils.VolumetricGrid): the grid
+            values (np.ndarray): the value at each grid point, in the same order as
+               ``grid.allpoints()`` (x varies slowest, z fastest)
+            dtype (str): ``'float32'``, or ``'float16'`` to halve the size of the data (at about
+               3 significant digits)
+        """
+        if dtype not in ('float32', 'float16'):
+            raise ValueError('dtype should be float32 or float16, not %s' % dtype)
+        values = np.asarray(getattr(values, 'magnitude', values)).astype(dtype)
+        shape = [int(n) for n in grid.points]
+        self.volume = {'origin': [float(x) for x in self._convert_length(grid.origin)],
+                       'spacing': [float(x) for x in self._convert_length(grid.deltas)],
+                       'shape': shape,
+                       'values': values.reshape(shape)}
+
+    def clear_volume(self):
+        """ Remove the volumetric data sent with :meth:`set_volume`
+        """
+        self.volume = {}
+
+    def load_frames(self, frames, first_frame=0, precision=None, keyframe_interval=30):
+        """ Upload a series of frames to the browser, so that it can play them back without
+        a round trip to the kernel for each frame.
+
+        While ``playing`` is True, the browser loops over the loaded frames at ``frame_rate``
+        frames per second, reporting each frame it shows as ``current_frame``. Setting
+        ``current_frame`` to one of the loaded frames shows it without resending any positions.
+
+        If a ``precision`` is given, coordinates are quantized and delta-encoded (see
+        :mod:`nbmolviz.base.framecodec`). At a precision of 0.001 angstrom, that makes the upload
+        about 4 times smaller when atoms move ~0.03 angstrom per frame, and about 3.5 times
+        smaller when they move ~0.1 angstrom per frame; coarser precisions save more.
+
+        Args:
+            frames (Array[length, shape=(*,*,3)]): the positions of every atom in each frame
+            first_frame (int): number of the first of these frames (to load a window of a
+               longer trajectory)
+            precision (Scalar[length]): maximum coordinate error is half of this
+               (e.g., ``0.001 * u.angstrom``; default: send exact float32 coordinates)
+            keyframe_interval (int): with ``precision``, store every n-th frame in full
+        """
+        if isinstance(frames, (list, tuple)):
+            frames = u.array(frames)
+        frames = np.asarray(self._convert_length(frames), dtype='float32')
+        if frames.ndim != 3 or frames.shape[1:] != (self.mol.num_atoms, 3):
+            raise ValueError('Expected frames with shape (*, %d, 3), got %s'
+                             % (self.mol.num_atoms, frames.shape))
+
+        self._frame_buffer = frames
+        if precision is None:
+            self._frame_encoding = None
+        else:
+            self._frame_encoding = dict(precision=float(self._convert_length(precision)),
+                                        keyframe_interval=keyframe_interval)
+        with self.batch():
+            self.first_frame = first_frame
+            self._send_frames()
+
+    def clear_frames(self):
+        """ Stop playback and discard the frames uploaded by :meth:`load_frames`
+        """
+        self._frame_buffer = None
+        with self.batch():
+            self.playing = False
+            self._send_frames()
+
+    def has_frame(self, framenum):
+        """ bool: whether this frame was uploaded with :meth:`load_frames`
+        """
+        return (self._frame_buffer is not None and
+                0 <= framenum - self.first_frame < len(self._frame_buffer))
+
+    def _send_frames(self):
+        """ Send the loaded frames for the atoms that are shown
+        """
+        if self._frame_buffer is None or self.shown_atoms is None:
+            frames = self._frame_buffer
+        else:
+            frames = self._frame_buffer[:, self.shown_atoms]
+        if frames is not None and self._frame_encoding is not None:
+            frames = encode_frames(frames, **self._frame_encoding)
+        self.frames = frames
+
+    def _frame_sent_elsewhere(self, framenum, positions=None):
+        """ Record that the browser was told to show a frame by some other widget (see
+        :class:`nbmolviz.viewers.playback_group.PlaybackGroup`), without sending anything.
+
+        Args:
+            framenum (int): the frame number
+            positions (np.ndarray[float32, shape=(*,3)]): positions of all atoms in this frame
+               (only needed if it wasn't loaded with :meth:`load_frames`)
+
+        Returns:
+            np.ndarray[float32, shape=(*,3)]: positions of the shown atoms, which the other
+               widget needs to send (None if the browser already has this frame)
+        """
+        if self.has_frame(framenum):
+            self._set_unsynced(current_frame=framenum)
+            return None
+        self._all_positions = positions
+        if self.shown_atoms is None:
+            shown = np.array(positions, dtype='float32')
+        else:
+            shown = positions[self.shown_atoms]
+        self._set_unsynced(current_frame=framenum, positions=shown)
+        return shown
+
+    @traitlets.observe('current_frame')
+    def _current_frame_changed(self, change):
+        """ The browser shows loaded frames by itself; keep track of the positions it shows
+        """
+        if not self.has_frame(change['new']):
+            return
+        self._all_positions = self._frame_buffer[change['new'] - self.first_frame]
+        if self.shown_atoms is None:
+            self._set_unsynced(positions=self._all_positions.copy())
+        else:
+            self._set_unsynced(positions=self._all_positions[self.shown_atoms])
 
     def draw_atom_vectors(self, vecs, rescale_to=1.75,
                           scale_factor=None, opacity=0.85,
                           radius=0.11, **kwargs):
         """ Draw a 3D vector on each atom
 
+        All of the arrows are drawn as a single arrow field shape (see
+        :meth:`GeometryViewer.draw_arrow_field`).
+
         Args:
             vecs (Matrix[shape=(*,3)]): list of vectors for each atom
             rescale_to (Scalar[length]): vectors so the largest is this long
             scale_factor (Scalar[length/units]): factor for conversion between input units and
                length
-            kwargs (dict): keyword arguments for self.draw_arrow
+            kwargs (dict): keyword arguments for self.draw_arrow_field
+
+        Returns:
+            dict: arrow field spec
         """
         kwargs['radius'] = radius
         kwargs['opacity'] = opacity
@@ -468,29 +866,26 @@ class GeometryViewer(BaseViewer):
             arrowvecs = vecarray/scale
             print('Arrow scale: {q:.3f} {unit} per {native}'.format(q=scale, unit=unit,
                                                                     native=self.DISTANCE_UNITS))
-        shapes = []
-        for atom, vecarray in zip(self.mol.atoms, arrowvecs):
-            if mathutils.norm(vecarray) < 0.2:
-                continue
-            shapes.append(self.draw_arrow(atom.position, vector=vecarray, **kwargs))
-        return shapes
+        visible = np.sqrt((arrowvecs*arrowvecs).sum(axis=1)) >= 0.2
+        return self.draw_arrow_field(self.mol.positions[visible], arrowvecs[visible], **kwargs)
 
     def draw_axis(self, on=True):
         label_kwargs = dict(color='white', opacity=0.4, fontsize=14)
-        if on and self._axis_objects is None:
-            xarrow = self.draw_arrow([0, 0, 0], [1, 0, 0], color=self.AXISCOLORS['x'])
-            xlabel = self.draw_label([1.0, 0.0, 0.0], text='x', **label_kwargs)
-            yarrow = self.draw_arrow([0, 0, 0], [0, 1, 0], color=self.AXISCOLORS['y'])
-            ylabel = self.draw_label([-0.2, 1, -0.2], text='y', **label_kwargs)
-            zarrow = self.draw_arrow([0, 0, 0], [0, 0, 1], color=self.AXISCOLORS['z'])
-            zlabel = self.draw_label([0, 0, 1], text='z', **label_kwargs)
-            self._axis_objects = [xarrow, yarrow, zarrow,
-                                  xlabel, ylabel, zlabel]
-
-        elif not on and self._axis_objects is not None:
-            for arrow in self._axis_objects:
-                self.remove(arrow)
-            self._axis_objects = None
+        with self.batch():
+            if on and self._axis_objects is None:
+                xarrow = self.draw_arrow([0, 0, 0], [1, 0, 0], color=self.AXISCOLORS['x'])
+                xlabel = self.draw_label([1.0, 0.0, 0.0], text='x', **label_kwargs)
+                yarrow = self.draw_arrow([0, 0, 0], [0, 1, 0], color=self.AXISCOLORS['y'])
+                ylabel = self.draw_label([-0.2, 1, -0.2], text='y', **label_kwargs)
+                zarrow = self.draw_arrow([0, 0, 0], [0, 0, 1], color=self.AXISCOLORS['z'])
+                zlabel = self.draw_label([0, 0, 1], text='z', **label_kwargs)
+                self._axis_objects = [xarrow, yarrow, zarrow,
+                                      xlabel, ylabel, zlabel]
+
+            elif not on and self._axis_objects is not None:
+                for arrow in self._axis_objects:
+                    self.remove(arrow)
+                self._axis_objects = None
 
     draw_axes = draw_axis  # If I can never keep this straight, I doubt anyone else can either ...
 
@@ -577,9 +972,7 @@ class GeometryViewer(BaseViewer):
             'color': color,
             'opacity': opacity,
         }
-        shapes = list(self.shapes)
-        shapes.append(shape)
-        self.shapes = shapes
+        self._add_shape(shape)
         self._update_clipping(center.max() + radius)
         return shape
 
@@ -664,9 +1057,7 @@ class GeometryViewer(BaseViewer):
             'fromCap': 1 if draw_start_face else 0,
             'toCap': 1 if draw_end_face else 0
         }
-        shapes = list(self.shapes)
-        shapes.append(shape)
-        self.shapes = shapes
+        self._add_shape(shape)
         self._update_clipping(max(facestart.max() + radius, faceend.max()+radius))
         return shape
 
@@ -705,19 +1096,139 @@ class GeometryViewer(BaseViewer):
             'radius': radius,
             'opacity': opacity,
         }
-        shapes = list(self.shapes)
-        shapes.append(shape)
-        self.shapes = shapes
+        self._add_shape(shape)
         self._update_clipping(max(start.max() + radius, end.max()+radius))
         return shape
 
-    def remove_all_shapes(self):
-        """ Delete all non-molecular shapes from the scene
+    def _add_shape(self, shape):
+        """ Register a new shape spec and send it to the browser.
+
+        The spec gets an ``'id'`` field, which acts as its handle for later updates and removal.
+        """
+        shape['id'] = 'shape%d' % next(self._shape_ids)
+        self.shapes[shape['id']] = shape
+        self._send_shape_ops({'op': 'add', 'id': shape['id'], 'shape': shape})
+
+    def _send_shape_ops(self, *ops):
+        """ Send shape add/update/remove operations, or hold them back until the end of the
+        batch (or of the current ``max_update_rate`` window)
+        """
+        if self._batch_depth > 0 or self._updates_deferred():
+            pending_ids = {op['id'] for op in self._pending_shape_ops
+                           if op['op'] in ('add', 'update')}
+            for op in ops:
+                if op['op'] == 'update' and op['id'] in pending_ids:
+                    self.dropped_updates += 1  # the pending op already has the latest spec
+                else:
+                    self._pending_shape_ops.append(op)
+            if self._batch_depth == 0:
+                self._defer_update()
+        else:
+            self._last_update_time = time.time()
+            self.send(*extract_buffers({'event': 'shapes', 'ops': list(ops)}))
+
+    def _flush_batch(self):
+        super()._flush_batch()
+        if self._pending_shape_ops:
+            ops, self._pending_shape_ops = self._pending_shape_ops, []
+            self._send_shape_ops(*ops)
+
+    def _flush_pending_updates(self):
+        super()._flush_pending_updates()
+        if self._pending_shape_ops:
+            ops, self._pending_shape_ops = self._pending_shape_ops, []
+            self.send(*extract_buffers({'event': 'shapes', 'ops': ops}))
+
+    def update_shape(self, shape, **changes):
+        """ Redraw a shape after changing its spec.
+
+        Examples:
+            >>> arrow = viewer.draw_arrow([0, 0, 0], [1, 0, 0])
+            >>> viewer.update_shape(arrow, color=translate_color('blue'))
+
+        Args:
+            shape (dict): shape spec, as returned by one of the ``draw_[shape]`` methods (it may
+               also have been modified in place)
+            **changes (dict): fields to change in the spec
+        """
+        shape.update(changes)
+        if shape.get('id', None) not in self.shapes:
+            raise ValueError('Shape is not part of this scene: %s' % shape)
+        self._send_shape_ops({'op': 'update', 'id': shape['id'], 'shape': shape})
+
+    def draw_arrow_field(self, origins, vectors, radius=0.15, color='red', opacity=1.0):
+        """ Draw many 3D arrows as a single shape.
+
+        The arrows are sent to the browser as two float32 binary buffers, which is much faster
+        than calling ``draw_arrow`` for each of them.
+
+        Args:
+            origins (Matrix[length, shape=(*,3)]): start point of each arrow
+            vectors (Matrix[length, shape=(*,3)]): vector from each arrow's start to its end
+            radius (Scalar[length]): radius of the arrows' bases
+            color (str or int): color name or hexadecimal RGB
+            opacity (float): opacity of the arrows (between 0 and 1)
 
         Returns:
-            dict: cylinder spec object
+            dict: Shape specification
+        """
+        origins = np.array(self._convert_length(origins), dtype='float32').reshape(-1, 3)
+        vectors = np.array(self._convert_length(vectors), dtype='float32').reshape(-1, 3)
+        if origins.shape != vectors.shape:
+            raise ValueError('Need exactly one vector for each arrow origin')
+        radius = self._convert_length(radius)
+
+        shape = {
+            'type': self.SHAPE_NAMES['ARROW_FIELD'],
+            'origins': origins,
+            'vectors': vectors,
+            'color': translate_color(color),
+            'radius': radius,
+            'opacity': opacity,
+        }
+        self._add_shape(shape)
+        if len(origins) > 0:
+            self._update_clipping(max(np.abs(origins).max(),
+                                      np.abs(origins + vectors).max()) + radius)
+        return shape
+
+    def draw_mesh(self, vertices, faces, normals=None, color='red', opacity=1.0):
+        """ Draw a triangle mesh (such as an isosurface from :mod:`nbmolviz.base.isosurface`)
+
+        The vertices, normals and faces are sent to the browser as binary buffers.
+
+        Args:
+            vertices (Matrix[length, shape=(*,3)]): position of each vertex
+            faces (Matrix[int, shape=(*,3)]): indices of each triangle's vertices
+            normals (Matrix[shape=(*,3)]): normal vector at each vertex (optional)
+            color (str or int): color name or hexadecimal RGB
+            opacity (float): opacity of the mesh (between 0 and 1)
+
+        Returns:
+            dict: Shape specification
+        """
+        vertices = np.array(self._convert_length(vertices), dtype='float32').reshape(-1, 3)
+        faces = np.array(faces, dtype='int32').reshape(-1, 3)
+        shape = {
+            'type': self.SHAPE_NAMES['MESH'],
+            'vertices': vertices,
+            'faces': faces,
+            'color': translate_color(color),
+            'opacity': opacity,
+        }
+        if normals is not None:
+            shape['normals'] = np.array(normals, dtype='float32').reshape(vertices.shape)
+        self._add_shape(shape)
+        if len(vertices) > 0:
+            self._update_clipping(np.abs(vertices).max())
+        return shape
+
+    def remove_all_shapes(self):
+        """ Delete all non-molecular shapes from the scene
         """
-        self.shapes = list()
+        self.shapes.clear()
+        self._pending_shape_ops = []
+        self._send_shape_ops({'op': 'clear'})
 
     def remove(self, obj):
         """ Removes a shape or label
@@ -725,9 +1236,10 @@ class GeometryViewer(BaseViewer):
         Args:
             obj (dict): shape or label spec
         """
-        if obj in self.shapes:
-            self.shapes.remove(obj)
-            self.send_state('shapes')
+        shapeid = obj.get('id', None)
+        if shapeid is not None and shapeid in self.shapes:
+            del self.shapes[shapeid]
+            self._send_shape_ops({'op': 'remove', 'id': shapeid})
         elif obj in self.labels:
             self.labels.remove(obj)
             self.send_state('labels')
@@ -28,6 +28,7 @@ from moldesign import utils
 from moldesign import units as u
 
 from . import BaseViewer
+from ..base.topology import get_topology
 from ..utils import translate_color
 
 
@@ -37,6 +38,12 @@ class ChemicalGraphViewer(BaseViewer):
     """
     MAXATOMS = 200
 
+    # a style call only replaces an earlier one that set the same properties of the same objects
+    IDEMPOTENT_FUNCTIONS = {
+        'setAtomStyle': lambda args: (tuple(args[0]), tuple(sorted(args[1]))),
+        'setBondStyle': lambda args: (tuple(map(tuple, args[0])), tuple(sorted(args[1]))),
+        'updateHighlightAtoms': lambda args: ()}
+
     _view_name = traitlets.Unicode('MolWidget2DView').tag(sync=True)
     _model_name = traitlets.Unicode('MolWidget2DModel').tag(sync=True)
     _view_module = traitlets.Unicode('nbmolviz-js').tag(sync=True)
@@ -75,7 +82,8 @@ class ChemicalGraphViewer(BaseViewer):
 
         self.names = names
 
-        self.atom_indices = {atom: i for i, atom in enumerate(self.atoms)}
+        self.topology = get_topology(atoms)
+        self.atom_indices = self.topology.index_map(self.atoms)
         self.selection_group = None
         self.selection_id = None
         self.width = width
@@ -95,20 +103,15 @@ class ChemicalGraphViewer(BaseViewer):
         return utils.make_none, tuple()
 
     def to_graph(self, atoms):
-        nodes, links = [], []
+        nodes = []
         for i1, atom1 in enumerate(atoms):
             nodes.append(dict(atom=self.names[i1], index=i1))
             if atom1.atnum == 6 and not self.carbon_labels:
                 nodes[-1].update({'atom': '',
                                   'size': 0.5,
                                   'color': 'darkgray'})
-            for neighbor, order in atom1.bond_graph.items():
-                if neighbor not in self.atom_indices: continue
-                nbr_idx = self.atom_indices[neighbor]
-                if nbr_idx < i1:
-                    links.append({'source': i1,
-                                  'target': nbr_idx,
-                                  'bond': order})
+        links = [{'source': int(i2), 'target': int(i1), 'bond': int(order)}
+                 for (i1, i2), order in zip(self.topology.bonds, self.topology.bond_orders)]
         graph = dict(nodes=nodes, links=links)
         return graph
 
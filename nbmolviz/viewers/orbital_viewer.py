@@ -25,8 +25,11 @@ import traitlets
 import io
 
 from moldesign import units as u
-from moldesign.mathutils import padded_grid
+from moldesign.mathutils import VolumetricGrid
 
+from .. import cubefile
+from ..base.adaptive_grid import adaptive_sample
+from ..base.isosurface import isosurface
 from ..viewers import GeometryViewer, translate_color
 from ..widget_utils import process_widget_kwargs
 from ..uielements.components import HBox, VBox
@@ -49,6 +52,22 @@ class OrbitalViewer(ViewerContainer):
     negative_color = traitlets.Union([traitlets.Integer(), traitlets.Unicode()], default='red')
     positive_color = traitlets.Union([traitlets.Integer(), traitlets.Unicode()], default='blue')
     numpoints = traitlets.Integer(40, default=50, max=120, min=10)
+    # grid spacing in angstroms (if None, the grid has ``numpoints`` points along each axis)
+    grid_resolution = traitlets.Float(None, allow_none=True, min=0.01)
+    # the grid covers everywhere a basis function's contribution can exceed this amplitude
+    #    (if None, it pads the whole molecule by 3 angstroms)
+    grid_threshold = traitlets.Float(0.0005, allow_none=True, min=0.0)
+    # evaluate the orbital on a coarse grid first, and refine only where it's near the range of
+    #    isovalues or changes sharply (see nbmolviz.base.adaptive_grid)
+    adaptive_evaluation = traitlets.Bool(False)
+    MAX_AXIS_POINTS = 250  # limits the grid size when using grid_resolution
+    ISOVALUE_RANGE = (0.00075, 0.075)  # nonzero values on the isovalue slider
+    MESH_CACHE_SIZE = 8  # number of recently drawn isosurfaces to keep
+
+    volume_dtype = traitlets.Enum(['float32', 'float16'], 'float32')  # precision of sent grids
+    # 'browser': send the grid and let the browser draw isosurfaces; 'python': compute the
+    #   isosurfaces here and only send the meshes (smaller for large grids)
+    isosurface_engine = traitlets.Enum(['browser', 'python'], 'browser')
 
     def __init__(self, mol, display=False, **kwargs):
         self.type_dropdown = None
@@ -58,8 +77,11 @@ class OrbitalViewer(ViewerContainer):
         self.viewer = GeometryViewer(mol=mol, **process_widget_kwargs(kwargs))
         self.mol = mol
         self.wfn = mol.wfn   # cache this directly because the molecule's state may change
+        self._cached_grids = {}
+        self._cached_meshes = collections.OrderedDict()
+        self._orbital_shapes = []
+        self.num_evaluations = None  # points where the last adaptive grid was evaluated
         self._restyle_orbital()  # sets defaults for orbital spec
-        self._cached_cubefiles = {}
 
         self.uipane = self._make_ui_pane(self.viewer.layout.height)
         hb = HBox([self.viewer, self.uipane])
@@ -76,24 +98,23 @@ class OrbitalViewer(ViewerContainer):
         # This triggers self._redraw_orbital
         self.current_orbital = orbital
 
-    @traitlets.observe('current_orbital', 'numpoints')
+    @traitlets.observe('current_orbital', 'numpoints', 'volume_dtype', 'isosurface_engine',
+                       'grid_resolution', 'grid_threshold', 'adaptive_evaluation')
     def _redraw_orbital(self, *args):
         self.status_element.value = '<div class="nbv-loader"/>'
         try:
             if self.current_orbital is None:
-                self.viewer.cubefile = ''
+                self.viewer.clear_volume()
+                self._remove_orbital_meshes()
                 return
 
-            orbkey = (id(self.current_orbital), self.numpoints)
-
-            if orbkey not in self._cached_cubefiles:
-                grid, values = self._calc_orb_grid(self.current_orbital)
-                cubefile = self._grid_to_cube(grid, values)
-                self._cached_cubefiles[orbkey] = cubefile
+            if self.isosurface_engine == 'python':
+                self.viewer.clear_volume()
+                self._draw_orbital_meshes()
             else:
-                cubefile = self._cached_cubefiles[orbkey]
-
-            self.viewer.cubefile = cubefile
+                self._remove_orbital_meshes()
+                grid, values = self._orbital_grid(self.current_orbital)
+                self.viewer.set_volume(grid, values, dtype=self.volume_dtype)
         except Exception as e:
             self.status_element.value = u'⚠ %s' % e
         else:
@@ -111,6 +132,56 @@ class OrbitalViewer(ViewerContainer):
             'opacity': self.orb_opacity,
             'negativeVolumetricColor': self.negative_color,
             'positiveVolumetricColor': self.positive_color}
+        if self.isosurface_engine == 'python' and self.current_orbital is not None:
+            self._redraw_orbital()
+
+    def _grid_key(self, orbital):
+        band = self._isovalue_band() if self.adaptive_evaluation else None
+        return id(orbital), self.numpoints, self.grid_resolution, self.grid_threshold, band
+
+    def _isovalue_band(self):
+        """ Tuple[float]: smallest and largest isovalues that can be chosen
+        """
+        lower, upper = self.ISOVALUE_RANGE
+        return min(lower, self.isoval), max(upper, self.isoval)
+
+    def _orbital_grid(self, orbital):
+        orbkey = self._grid_key(orbital)
+        if orbkey not in self._cached_grids:
+            self._cached_grids[orbkey] = self._calc_orb_grid(orbital)
+        return self._cached_grids[orbkey]
+
+    def _draw_orbital_meshes(self):
+        """ Draw the positive and negative lobes of the current orbital as meshes
+        """
+        meshkey = self._grid_key(self.current_orbital) + (self.isoval,)
+        if meshkey in self._cached_meshes:
+            self._cached_meshes[meshkey] = self._cached_meshes.pop(meshkey)  # most recent
+        else:
+            grid, values = self._orbital_grid(self.current_orbital)
+            values = np.asarray(getattr(values, 'magnitude', values)).reshape(tuple(grid.points))
+            origin = grid.origin.value_in(u.angstrom)
+            spacing = grid.deltas.value_in(u.angstrom)
+            self._cached_meshes[meshkey] = (
+                isosurface(values, self.isoval, origin, spacing),
+                isosurface(-values, self.isoval, origin, spacing))
+            while len(self._cached_meshes) > self.MESH_CACHE_SIZE:
+                self._cached_meshes.popitem(last=False)
+        positive, negative = self._cached_meshes[meshkey]
+
+        with self.viewer.batch():
+            self._remove_orbital_meshes()
+            for (vertices, normals, faces), color in ((positive, self.positive_color),
+                                                      (negative, self.negative_color)):
+                if len(faces) > 0:
+                    self._orbital_shapes.append(
+                            self.viewer.draw_mesh(vertices, faces, normals,
+                                                  color=color, opacity=self.orb_opacity))
+
+    def _remove_orbital_meshes(self):
+        for shape in self._orbital_shapes:
+            self.viewer.remove(shape)
+        self._orbital_shapes = []
 
     def _calc_orb_grid(self, orbital):
         """ Calculate grid of values for this orbital
@@ -122,60 +193,59 @@ class OrbitalViewer(ViewerContainer):
             VolumetricGrid: grid that amplitudes where computed on
             Vector[1/length**1.5]: list of orbital amplitudes at each point on grid
         """
-        # NEWFEATURE: limit grid size based on the non-zero atomic centers. Useful for localized
-        #    orbitals, which otherwise require high resolution
-        grid = padded_grid(self.wfn.positions,
-                           padding=3.0 * u.angstrom,
-                           npoints=self.numpoints)
+        bounds = None
+        if self.grid_threshold is not None:
+            bounds = orbital_bounds(orbital, self.grid_threshold)
+
+        if bounds is None:
+            lower = self.wfn.positions.min(axis=0) - 3.0 * u.angstrom
+            upper = self.wfn.positions.max(axis=0) + 3.0 * u.angstrom
+            bounds = (lower.value_in(u.angstrom), upper.value_in(u.angstrom))
+
+        if self.grid_resolution is None:
+            points = [self.numpoints] * 3
+        else:
+            extent = bounds[1] - bounds[0]
+            points = np.minimum(np.ceil(extent / self.grid_resolution).astype('int') + 1,
+                                self.MAX_AXIS_POINTS)
+        grid = VolumetricGrid(*[(lo * u.angstrom, hi * u.angstrom) for lo, hi in zip(*bounds)],
+                              xpoints=points[0], ypoints=points[1], zpoints=points[2])
         with np.errstate(under='ignore'):
-            values = orbital(grid.allpoints())
+            if self.adaptive_evaluation:
+                values = self._adaptive_orb_values(orbital, grid)
+            else:
+                values = orbital(grid.allpoints())
         return grid, values
 
+    def _adaptive_orb_values(self, orbital, grid):
+        units = []
+
+        def evaluate(points):
+            values = orbital(points * u.angstrom)
+            units.append(getattr(values, 'units', 1.0))
+            return getattr(values, 'magnitude', values)
+
+        values, self.num_evaluations = adaptive_sample(
+                evaluate, grid.points, grid.origin.value_in(u.angstrom),
+                grid.deltas.value_in(u.angstrom), band=self._isovalue_band(),
+                refine_points=self.wfn.positions.value_in(u.angstrom))
+        return values.ravel() * units[0]
+
     @staticmethod
     def _grid_to_cube(grid, values):
         """ Given a grid of values, create a gaussian cube file
 
         Args:
             grid (utils.VolumetricGrid): grid of points
-            values (Iterable): iterator over grid values, in the same order as grid points
+            values (np.ndarray): grid values, in the same order as grid points
 
         Returns:
             str: contents of the cube file
         """
         fobj = io.StringIO()
-
-        # First two header lines
-        print('CUBE File\nGenerated by nbmolviz', file=fobj)
-
-        # third line: number of atoms (0, here) + origin of grid
-        print('-1 %f %f %f' % tuple(grid.origin.value_in(u.angstrom)), file=fobj)
-
-        # lines 4-7: number of points in each direction and basis vector for each
-        # basis vectors are negative to indicate angstroms
-        print('%d %f 0.0 0.0' % (-grid.xpoints, grid.dx.value_in(u.angstrom)), file=fobj)
-        print('%d 0.0 %f 0.0' % (-grid.ypoints, grid.dy.value_in(u.angstrom)), file=fobj)
-        print('%d 0.0 0.0 %f' % (-grid.zpoints, grid.dz.value_in(u.angstrom)), file=fobj)
-
-        # Next is a line per atom
-        # We put just one atom here - it shouldn't be rendered
-        print('6 0.000 0.0 0.0 0.0', file=fobj)
-
-        # Next, indicate that there's just one orbital
-        print('1 1', file=fobj)
-
-        # finally, write out all the grid values
-        # ival = 0
-        valueiter = iter(values)
-        for ix in range(grid.xpoints):
-            for iy in range(grid.ypoints):
-                for iz in range(grid.zpoints):
-                    print(str(next(valueiter)), end=' ', file=fobj)
-                    # ival += 1
-                    # if ival%6 == 0: print >> fobj #newline
-                    if iz % 6 == 5:
-                        fobj.write('\n')
-                fobj.write('\n')
-
+        deltas = [d.value_in(u.angstrom) for d in (grid.dx, grid.dy, grid.dz)]
+        values = np.asarray(getattr(values, 'magnitude', values)).reshape(tuple(grid.points))
+        cubefile.write_cube(fobj, grid.origin.value_in(u.angstrom), deltas, values)
         v = fobj.getvalue()
         fobj.close()
         return v
@@ -207,8 +277,8 @@ class OrbitalViewer(ViewerContainer):
 
         # Isovalue selector
         isoval_label = ipy.Label('Isovalue:')
-        self.isoval_selector = ipy.FloatSlider(min=0.0, max=0.075,
-                                               value=0.01, step=0.00075,
+        self.isoval_selector = ipy.FloatSlider(min=0.0, max=self.ISOVALUE_RANGE[1],
+                                               value=0.01, step=self.ISOVALUE_RANGE[0],
                                                readout_format='.4f',
                                                layout=ipy.Layout(width=layout.width))
         traitlets.link((self.isoval_selector, 'value'), (self, 'isoval'))
@@ -272,3 +342,71 @@ class OrbitalViewer(ViewerContainer):
 
     def change_resolution(self, *args):
         self.numpoints = int(self.orb_resolution.value)
+
+
+def support_radii(weights, alphas, angular, threshold):
+    r""" How far from its center each gaussian primitive can exceed an amplitude threshold.
+
+    Primitive ``i`` is bounded (up to the normalization of its angular part) by
+    :math:`|w_i| r^{l_i} e^{-\alpha_i r^2}`, so its radius is the largest root of
+    :math:`\ln|w_i| + l_i \ln r - \alpha_i r^2 = \ln t` (found with Newton's method, starting
+    beyond the root, where the function is concave and decreasing).
+
+    Args:
+        weights (np.ndarray): coefficient of each primitive (including its atomic orbital's
+           coefficient in the orbital), in units of amplitude * angstrom**(-l)
+        alphas (np.ndarray): exponent of each primitive (angstrom**-2)
+        angular (np.ndarray): angular momentum ``l`` of each primitive
+        threshold (float): amplitude threshold
+
+    Returns:
+        np.ndarray: radius for each primitive (angstroms; 0 if it never exceeds the threshold)
+    """
+    weights = np.abs(np.asarray(weights, dtype='float64'))
+    alphas = np.asarray(alphas, dtype='float64')
+    angular = np.asarray(angular, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        excess = np.log(weights) - np.log(threshold)
+
+        def f(r):
+            return excess + np.where(angular > 0, angular * np.log(r), 0.0) - alphas * r**2
+
+        peak = np.sqrt(angular / (2.0 * alphas))  # where the bound is largest
+        peakvalue = f(peak)
+        radii = peak + np.sqrt(np.maximum(peakvalue, 0.0) / alphas) + 1e-6
+        for i in range(30):
+            radii -= f(radii) / (angular / radii - 2.0 * alphas * radii)
+    return np.where(peakvalue > 0, radii, 0.0)
+
+
+def orbital_bounds(orbital, threshold):
+    """ Box containing everywhere that any of an orbital's gaussian primitives can exceed an
+    amplitude threshold, so that localized orbitals don't need a grid around the whole molecule.
+
+    Args:
+        orbital (moldesign.orbitals.MolecularOrbital): the orbital
+        threshold (float): amplitude threshold (in the units of the orbital's values)
+
+    Returns:
+        Tuple[np.ndarray]: lower and upper corners of the box (angstroms), or None if no
+           primitive exceeds the threshold
+    """
+    weights, alphas, angular, centers = [], [], [], []
+    for aocoeff, ao in zip(orbital.coeffs, orbital.basis.orbitals):
+        for primitive in ao.primitives:
+            weights.append(aocoeff * _magnitude(primitive.coeff))
+            alphas.append(_magnitude(primitive.alpha))
+            angular.append(getattr(primitive, 'l', None) or getattr(primitive, 'shell', 0))
+            centers.append(_magnitude(primitive.center))
+    radii = support_radii(weights, alphas, angular, threshold)
+    if not (radii > 0).any():
+        return None
+    centers = np.array(centers)[radii > 0]
+    radii = radii[radii > 0, None]
+    return (centers - radii).min(axis=0), (centers + radii).max(axis=0)
+
+
+def _magnitude(quantity):
+    """ Magnitude in moldesign's default units (angstroms for lengths)
+    """
+    return getattr(u.default.convert_if_possible(quantity), 'magnitude', quantity)
@@ -0,0 +1,133 @@
+from __future__ import print_function, absolute_import, division
+from future.builtins import *
+from future import standard_library
+standard_library.install_aliases()
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import ipywidgets as ipy
+import traitlets
+
+from ..widget_utils import process_widget_kwargs
+from ..uielements.components import HBox, VBox
+from .geometry_viewer import GeometryViewer
+
+
+class _FrameSync(ipy.Widget):
+    """ Invisible widget that sends the frames for all viewers in a group as one message
+    (see ``js/src/playback_sync_model.js``)
+    """
+    _model_name = traitlets.Unicode('PlaybackSyncModel').tag(sync=True)
+    _model_module = traitlets.Unicode('nbmolviz-js').tag(sync=True)
+
+    viewers = traitlets.List(traitlets.Instance(GeometryViewer)).tag(
+            sync=True, **ipy.widget_serialization)
+
+
+class PlaybackGroup(VBox):
+    """ Plays several trajectories side by side, in step, from a single set of controls.
+
+    Member ``i`` shows frame ``offsets[i] + strides[i] * frame`` (clamped to its last frame)
+    when the group is at ``frame``. On each step, the frame numbers - plus the positions of any
+    frames that weren't preloaded with :meth:`TrajectoryViewer.preload_frames` - are sent to
+    the browser as a single message for the whole group.
+
+    Examples:
+        >>> group = PlaybackGroup([traj.draw() for traj in replicas], strides=[1, 1, 2, 2])
+
+    Args:
+        viewers (List[TrajectoryViewer]): the trajectory viewers to control (their own
+           playback controls are hidden)
+        strides (List[int]): number of frames each viewer advances per step (default: 1)
+        offsets (List[int]): frame each viewer shows at step 0 (default: 0)
+        interval (int): milliseconds between steps during playback
+        display (bool): immediately display this to the notebook (default: False)
+        **kwargs (dict): keyword arguments for :class:`ipywidgets.Box`
+    """
+    frame = traitlets.Integer(0)
+
+    def __init__(self, viewers, strides=None, offsets=None, interval=100, display=False,
+                 **kwargs):
+        from IPython.display import display as displaynow
+
+        self.members = list(viewers)
+        self.strides = list(strides) if strides is not None else [1] * len(self.members)
+        self.offsets = list(offsets) if offsets is not None else [0] * len(self.members)
+        if not len(self.members) == len(self.strides) == len(self.offsets):
+            raise ValueError('Need one stride and one offset per viewer')
+        self.num_frames = max((member.num_frames - 1 - offset) // stride + 1
+                              for member, stride, offset
+                              in zip(self.members, self.strides, self.offsets))
+
+        for member in self.members:
+            member._join_group(self)
+        self._sync = _FrameSync(viewers=[member.viewer for member in self.members])
+
+        self.playbutton = ipy.Play(value=0, min=0, max=self.num_frames - 1, interval=interval)
+        self.slider = ipy.IntSlider(value=0, description='Frame:', min=0,
+                                    max=self.num_frames - 1, readout=False)
+        self.readout = ipy.HTML()
+        self._links = [traitlets.link((self.playbutton, 'value'), (self.slider, 'value')),
+                       traitlets.link((self.slider, 'value'), (self, 'frame'))]
+        controls = HBox((self.playbutton, self.slider, self.readout))
+
+        super().__init__(children=(HBox(self.members), controls),
+                         **process_widget_kwargs(kwargs))
+        self._send_frame(self.frame)
+        if display:
+            displaynow(self)
+
+    def member_frame(self, i, frame):
+        """ int: the frame that member ``i`` shows when the group is at ``frame``
+        """
+        framenum = self.offsets[i] + self.strides[i] * frame
+        return min(max(framenum, 0), self.members[i].num_frames - 1)
+
+    def show_frame(self, frame):
+        """ Move every viewer in the group to the frames for this step
+        """
+        if frame == self.frame:
+            self._send_frame(frame)
+        else:
+            self.frame = frame
+
+    @traitlets.observe('frame')
+    def _change_frame(self, change):
+        self._send_frame(change['new'])
+
+    def _send_frame(self, frame):
+        framenums = []
+        buffer_index = []
+        buffers = []
+        for i, member in enumerate(self.members):
+            framenum = self.member_frame(i, frame)
+            positions = member._show_group_frame(framenum)
+            framenums.append(framenum)
+            if positions is None:
+                buffer_index.append(None)
+            else:
+                buffer_index.append(len(buffers))
+                buffers.append(memoryview(positions))
+
+        self._sync.send({'event': 'frames', 'frames': framenums, 'buffer_index': buffer_index},
+                        buffers=buffers)
+        self.readout.value = '%s / %s' % (frame, self.num_frames - 1)
+
+    def release(self):
+        """ Give each viewer its own playback controls back
+        """
+        for link in self._links:
+            link.unlink()
+        for member in self.members:
+            member._leave_group()
+        self.children = ()
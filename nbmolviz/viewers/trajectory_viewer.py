@@ -17,9 +17,11 @@ install_aliases()
 # limitations under the License.
 
 import ipywidgets as ipy
+import numpy as np
 import traitlets
 
 from ..viewers import ViewerContainer
+from .frames import FramePrefetcher, as_frame_provider
 from ..widget_utils import process_widget_kwargs
 from ..widgets.components import AtomInspector
 from ..uielements.components import HBox, VBox
@@ -30,32 +32,65 @@ class TrajectoryViewer(ViewerContainer):
 
     Users will typically instantiate this using ``trajectory.draw()``
 
+    Trajectories too long to keep in memory can be passed as a frame provider (see
+    :mod:`nbmolviz.viewers.frames`), such as a memory-mapped array of positions or a directory
+    of ``.npy`` chunks. Frames are then read only when they're shown, and at most
+    ``cache_size`` of them are kept in memory. While the slider moves, the next ``prefetch``
+    frames it's likely to reach are read on background threads (see
+    :class:`nbmolviz.viewers.frames.FramePrefetcher`; :meth:`prefetch_stats` reports how well
+    that works).
+
     Args:
+        trajectory (moldesign.Trajectory or FrameProvider or np.ndarray or str): the trajectory,
+           or a source of frames for ``mol`` (see
+           :func:`nbmolviz.viewers.frames.as_frame_provider`)
+        mol (moldesign.Molecule): the molecule (required unless ``trajectory`` is a
+           :class:`moldesign.Trajectory`)
+        cache_size (int): number of frames to keep in memory
+        prefetch (int): number of frames to read ahead (0 to disable)
         display (bool): immediately display this to the notebook (default: False)
+        preload (bool): upload all frames to the browser right away, so that playback doesn't
+           need the kernel (default: False; see :meth:`preload_frames`)
         **kwargs (dict): keyword arguments for :class:`ipywidgets.Box`
     """
 
     current_frame = traitlets.Integer(0).tag(sync=True)
+    MAX_UPDATE_RATE = 30.0  # frames per second sent to the browser (extra frames are skipped)
 
-    def __init__(self, trajectory, display=False, **kwargs):
+    def __init__(self, trajectory, display=False, preload=False, mol=None, cache_size=64,
+                 prefetch=8, **kwargs):
         from IPython.display import display as displaynow
 
         self.playbutton = None
+        self.browserplay = None
+        self.group = None
+        self._frame_link = None
         self.slider = None
         self.viewer = None
         self.annotation = None
 
-        self.traj = trajectory
-        trajectory._apply_frame(trajectory.frames[0])
+        self.frame_source = as_frame_provider(trajectory)
+        self.frame_cache = FramePrefetcher(self.frame_source, cache_size, window=prefetch)
+        self.num_frames = self.frame_source.num_frames
+        if mol is None:
+            self.traj = trajectory
+            trajectory._apply_frame(trajectory.frames[0])
+            self.mol = trajectory._tempmol
+        else:
+            self.traj = None
+            self.mol = mol
         self.viewcontainer = self._get_viewer_container()
+        self.viewer.max_update_rate = self.MAX_UPDATE_RATE
         self.viewer.show_unbonded()
         self.controls = self.make_controls()
         self.pane = VBox(children=(self.viewcontainer, self.controls))
 
-        super().__init__(children=(self.pane, AtomInspector(self.traj.mol)),
+        super().__init__(children=(self.pane, AtomInspector(self.mol)),
                          viewer=self.viewcontainer, **process_widget_kwargs(kwargs))
 
         self.show_frame(self.current_frame)
+        if preload:
+            self.preload_frames()
         if display:
             displaynow(self)
 
@@ -63,38 +98,119 @@ class TrajectoryViewer(ViewerContainer):
         """ This is treated differently in sublcasses, which is
         why it's factored out
         """
-        self.viewer = self.traj._tempmol.draw3d(style='licorice')
+        self.viewer = self.mol.draw3d(style='licorice')
         return self.viewer
 
     @property
     def wfn(self):
         return self.trajectory.wfn[self.current_frame]
 
+    def preload_frames(self, start=0, stop=None, precision=None):
+        """ Upload a window of frames to the browser as a single binary buffer.
+
+        Frames in the window are then shown without sending their positions again, and the
+        "play in browser" button animates them locally at the display's refresh rate.
+
+        Args:
+            start (int): first frame to upload
+            stop (int): upload frames up to (not including) this one (default: the last frame)
+            precision (Scalar[length]): quantize coordinates to this precision, to make the
+               upload smaller (see :meth:`GeometryViewer.load_frames`)
+        """
+        framenums = range(self.num_frames)[start:stop]
+        self.viewer.load_frames(np.array([self.frame_cache.get_positions(i) for i in framenums],
+                                         dtype='float32').reshape(-1, self.mol.num_atoms, 3),
+                                first_frame=framenums.start, precision=precision)
+        if self.browserplay is None:
+            self.browserplay = ipy.ToggleButton(description='Play in browser', icon='play')
+            traitlets.link((self.browserplay, 'value'), (self.viewer, 'playing'))
+            if self.group is None:  # otherwise, linked when leaving the group
+                self._link_browser_frame()
+            self.playcontrols.children += (self.browserplay,)
+
+    def _link_browser_frame(self):
+        """ Follow the frames that the browser shows during "play in browser"
+        """
+        self._frame_link = traitlets.link((self.viewer, 'current_frame'),
+                                          (self, 'current_frame'))
+
+    def prefetch_stats(self):
+        """ Cache hits and misses for the frames shown so far (see
+        :meth:`nbmolviz.viewers.frames.FramePrefetcher.stats`)
+        """
+        return self.frame_cache.stats()
+
+    def close(self):
+        """ Close this widget, and stop the threads that prefetch its frames
+        """
+        self.frame_cache.close()
+        super().close()
+
     def show_frame(self, framenum):
-        self.annotation.value = self.traj.frames[framenum].get('annotation', '')
-        self.viewer.set_positions(self.traj.positions[framenum])
-        self.readout.value = '%s / %s' % (framenum, self.traj.num_frames - 1)
+        self.annotation.value = self.frame_source.get_annotation(framenum)
+        with self.viewer.batch():  # one message per frame
+            self.viewer.current_frame = framenum  # the browser shows it itself if it was preloaded
+            if not self.viewer.has_frame(framenum):
+                self.viewer.set_positions(self.frame_cache.get_positions(framenum))
+        self.readout.value = '%s / %s' % (framenum, self.num_frames - 1)
         self.current_frame = framenum
 
     def make_controls(self):
         self.playbutton = ipy.Play(value=0,
                                    min=0,
-                                   max=self.traj.num_frames-1)
+                                   max=self.num_frames-1)
 
         self.slider = ipy.IntSlider(value_selects='framenum', value=0,
-                                    description='Frame:', min=0, max=len(self.traj)-1,
+                                    description='Frame:', min=0, max=self.num_frames-1,
                                     readout=False)
-        self.readout = ipy.HTML(value='/%d' % (self.traj.num_frames - 1))
+        self.readout = ipy.HTML(value='/%d' % (self.num_frames - 1))
         self.annotation = ipy.HTML()
 
         traitlets.link((self.playbutton, 'value'), (self.slider, 'value'))
-        traitlets.link((self.slider, 'value'), (self, 'current_frame'))
-        return VBox((self.annotation,
-                     HBox((self.playbutton, self.slider, self.readout))))
+        self._slider_link = traitlets.link((self.slider, 'value'), (self, 'current_frame'))
+        self.playcontrols = HBox((self.playbutton, self.slider, self.readout))
+        return VBox((self.annotation, self.playcontrols))
 
     @traitlets.observe('current_frame')
     def _change_frame(self, change):
-        self.show_frame(change['new'])
+        if self.group is None:  # otherwise, the group sends frames
+            self.show_frame(change['new'])
+
+    def _join_group(self, group):
+        """ Let a :class:`PlaybackGroup` control this viewer (its own controls are hidden)
+        """
+        if self.group is not None:
+            raise ValueError('This viewer is already part of a playback group')
+        self.group = group
+        self.viewer.playing = False
+        self._slider_link.unlink()
+        if self._frame_link is not None:  # the group tells the browser which frame to show
+            self._frame_link.unlink()
+            self._frame_link = None
+        self.controls.layout.display = 'none'
+
+    def _leave_group(self):
+        self.group = None
+        self.controls.layout.display = None
+        self.slider.value = self.current_frame
+        self._slider_link = traitlets.link((self.slider, 'value'), (self, 'current_frame'))
+        if self.browserplay is not None:
+            self._link_browser_frame()
+
+    def _show_group_frame(self, framenum):
+        """ Update this viewer's state for a frame that its group is sending to the browser
+
+        Returns:
+            np.ndarray[float32, shape=(*,3)]: positions that the group needs to send (None if
+               the browser already has them)
+        """
+        with self._lock_property(current_frame=framenum):  # the browser doesn't need this
+            self.current_frame = framenum
+        if self.viewer.has_frame(framenum):
+            return self.viewer._frame_sent_elsewhere(framenum)
+        else:
+            return self.viewer._frame_sent_elsewhere(framenum,
+                                                     self.frame_cache.get_positions(framenum))
 
     def __getattr__(self, item):
         """Users can run viz commands directly on the trajectory,
@@ -46,9 +46,11 @@ class GeometryBuilder(ViewerToolBase):
     HIGHLIGHTOPACITY = 0.6
     POSFMT = u'{:.1f} \u212B'
     DEGFMT = u'{:.1f}\u00B0'
+    MAX_UPDATE_RATE = 30.0  # viewer updates per second while dragging the sliders
 
     def __init__(self, mol):
         super().__init__(mol)
+        self.viewer.max_update_rate = self.MAX_UPDATE_RATE
 
         self._widgetshapes = {}
         self._atom_labels = []
@@ -135,7 +137,7 @@ class GeometryBuilder(ViewerToolBase):
                        atom=atom, p=atom.position.value_in(u.angstrom))
 
     def label_atoms(self, *args):
-        with self.viewer.hold_trait_notifications():
+        with self.viewer.batch():
             if self.label_box.value and not self._atom_labels:
                 self._atom_labels = [self.viewer.draw_label(position=atom.position, text=atom.name)
                                      for atom in self.mol.atoms]
@@ -143,7 +145,6 @@ class GeometryBuilder(ViewerToolBase):
                 for l in self._atom_labels:
                     self.viewer.remove(l)
                 self._atom_labels = []
-        self.viewer.send_state('labels')
 
 
     # Returns the first bond indicated by bondIndices
@@ -158,7 +159,7 @@ class GeometryBuilder(ViewerToolBase):
             Tuple(ipywidgets.BaseWidget): children of the tool panel
         """
         atoms = self.viewer.selected_atoms
-        with self.viewer.hold_trait_notifications():
+        with self.viewer.batch():
             for shape in self._widgetshapes.values():
                 if shape == '_axes':
                     self.viewer.draw_axes(False)
@@ -199,7 +200,7 @@ class GeometryBuilder(ViewerToolBase):
 
     def _setup_distance_tools(self, atoms):
         a1, a2 = atoms
-        self.viewer.shapes = []
+        self.viewer.remove_all_shapes()
 
         # creates a temp cylinder that will be overwritten in self.set_distance
         self._widgetshapes = {
@@ -225,13 +226,13 @@ class GeometryBuilder(ViewerToolBase):
                          self._widgetshapes['bond']['end']):
             endpoint['x'], endpoint['y'], endpoint['z'] = a1.position.value_in(u.angstrom)
 
-        with self.viewer.hold_trait_notifications():
-            self.viewer.send_state('shapes')
+        with self.viewer.batch():
+            self.viewer.update_shape(self._widgetshapes['bond'])
             self.viewer.set_positions()
 
     def _setup_angle_tools(self, atoms):
         a1, a2, a3 = atoms
-        self.viewer.shapes = []
+        self.viewer.remove_all_shapes()
 
         # creates a temp cylinder that will be overwritten in self.set_distance
         angle_normal = np.cross(a1.position-a2.position,
@@ -272,8 +273,9 @@ class GeometryBuilder(ViewerToolBase):
                                (self._widgetshapes['b2']['start'], a3)):
             endpoint['x'], endpoint['y'], endpoint['z'] = atom.position.value_in(u.angstrom)
 
-        with self.viewer.hold_trait_notifications():
-            self.viewer.send_state('shapes')
+        with self.viewer.batch():
+            self.viewer.update_shape(self._widgetshapes['b1'])
+            self.viewer.update_shape(self._widgetshapes['b2'])
             self.viewer.set_positions()
 
     def _setup_dihedral_tools(self, atoms):
@@ -311,8 +313,9 @@ class GeometryBuilder(ViewerToolBase):
                                (self._widgetshapes['b3']['end'], a4)):
             endpoint['x'], endpoint['y'], endpoint['z'] = atom.position.value_in(u.angstrom)
 
-        with self.viewer.hold_trait_notifications():
-            self.viewer.send_state('shapes')
+        with self.viewer.batch():
+            self.viewer.update_shape(self._widgetshapes['b1'])
+            self.viewer.update_shape(self._widgetshapes['b3'])
             self.viewer.set_positions()
 
     def _highlight_atoms(self, atoms, color=None):
@@ -64,7 +64,7 @@ class ParameterizationDisplay(ipy.Box):
         super().__init__(children=children, layout=ipy.Layout(display='flex',  flex_flow='column'))
 
     def switch_display(self, d):
-        with self.viewer.hold_trait_notifications():
+        with self.viewer.batch():
             old = d['old']
             old.unshow(self.viewer)
             self.errmsg.value = '-'
@@ -112,54 +112,55 @@ class Symmetrizer(ipy.Box):
             self.coords_changed()
 
     def show_symmetry(self, *args):
-        self.showing.value = ''
-        if self._current_shapes:
-            for s in self._current_shapes: self.viewer.remove(s)
-            self._current_shapes = []
-        if self.symm_selector.value is None:
-            return
-
-        elem = self.symm_selector.value
-        symbol = elem.symbol
-
-        self.showing.value = '%s visualization not implemented' % symbol
-
-        if symbol == 'C1':
-            self.showing.value = 'Identity operation'
-            return
-
-        elif symbol == 'Ci':
-            inversion = self.viewer.draw_sphere(np.zeros(3) * u.angstrom,
-                                                color='0x4AB4C4',
-                                                radius=0.5 * u.angstrom,
-                                                opacity=0.85)
-            self._current_shapes.append(inversion)
-            self.showing.value = 'Inversion center'
-
-        elif symbol == 'Cs' or (symbol[0] == 'S' and symbol[1].isdigit()):
-            axis = elem.get_axis()
-            rad = 2.5 * max(self.symmetry.orientation.max(), 3.0 * u.angstrom)
-            plane = self.viewer.draw_circle(np.zeros(3),
-                                            axis,
-                                            radius=rad,
-                                            opacity=0.6,
-                                            color='0xAB00FE')
-            self._current_shapes.append(plane)
-            self.showing.value = 'Mirror plane (normal = %s)' % axis
-
-        if symbol[0] in 'SC' and symbol[1].isdigit():
-            axis = elem.get_axis()
-            nrot = int(symbol[1])
-            projections = self.symmetry.orientation.dot(axis)
-            top = axis * max(3.25 * projections.max(), 3.0*u.angstrom)
-            bottom = axis * min(2.5 * projections.min(), -2.5*u.angstrom)
-            arrow = self.viewer.draw_arrow(start=bottom, end=top,
-                                           color='0x00FE03', opacity=0.8)
-            self._current_shapes.append(arrow)
-            if symbol[0] == 'S':
-                self.showing.value = '%d-fold improper rotation axis (%s)' % (nrot, axis)
-            else:
-                self.showing.value = '%d-fold rotation axis (%s)' % (nrot, axis)
+        with self.viewer.batch():
+            self.showing.value = ''
+            if self._current_shapes:
+                for s in self._current_shapes: self.viewer.remove(s)
+                self._current_shapes = []
+            if self.symm_selector.value is None:
+                return
+
+            elem = self.symm_selector.value
+            symbol = elem.symbol
+
+            self.showing.value = '%s visualization not implemented' % symbol
+
+            if symbol == 'C1':
+                self.showing.value = 'Identity operation'
+                return
+
+            elif symbol == 'Ci':
+                inversion = self.viewer.draw_sphere(np.zeros(3) * u.angstrom,
+                                                    color='0x4AB4C4',
+                                                    radius=0.5 * u.angstrom,
+                                                    opacity=0.85)
+                self._current_shapes.append(inversion)
+                self.showing.value = 'Inversion center'
+
+            elif symbol == 'Cs' or (symbol[0] == 'S' and symbol[1].isdigit()):
+                axis = elem.get_axis()
+                rad = 2.5 * max(self.symmetry.orientation.max(), 3.0 * u.angstrom)
+                plane = self.viewer.draw_circle(np.zeros(3),
+                                                axis,
+                                                radius=rad,
+                                                opacity=0.6,
+                                                color='0xAB00FE')
+                self._current_shapes.append(plane)
+                self.showing.value = 'Mirror plane (normal = %s)' % axis
+
+            if symbol[0] in 'SC' and symbol[1].isdigit():
+                axis = elem.get_axis()
+                nrot = int(symbol[1])
+                projections = self.symmetry.orientation.dot(axis)
+                top = axis * max(3.25 * projections.max(), 3.0*u.angstrom)
+                bottom = axis * min(2.5 * projections.min(), -2.5*u.angstrom)
+                arrow = self.viewer.draw_arrow(start=bottom, end=top,
+                                               color='0x00FE03', opacity=0.8)
+                self._current_shapes.append(arrow)
+                if symbol[0] == 'S':
+                    self.showing.value = '%d-fold improper rotation axis (%s)' % (nrot, axis)
+                else:
+                    self.showing.value = '%d-fold rotation axis (%s)' % (nrot, axis)
 
 
     def set_highest_symmetry(self, *args):
@@ -2,12 +2,30 @@
 the supporting functionality
 """
 from past.builtins import unicode
+import concurrent.futures
 import subprocess
 
+import numpy as np
 import pytest
+from moldesign import units as u
+from tornado import gen
+from tornado.ioloop import IOLoop
 
 from moldesign._tests.molecule_fixtures import *
 from nbmolviz.utils import translate_color
+from nbmolviz.base.serializers import array_to_json, array_from_json
+from nbmolviz.base.styletable import StyleTable
+from nbmolviz.base.topology import get_topology, invalidate_topology
+from nbmolviz.base.base_widget import JavascriptError, MessageWidget
+from nbmolviz.base.framecodec import encode_frames, decode_frames, encoded_size
+from nbmolviz.base.adaptive_grid import adaptive_sample
+from nbmolviz.base.isosurface import isosurface
+from nbmolviz.viewers.geometry_viewer import GeometryViewer
+from nbmolviz.viewers.frames import ChunkedFrames, FrameCache
+from nbmolviz.viewers.playback_group import PlaybackGroup
+from nbmolviz.viewers.trajectory_viewer import TrajectoryViewer
+from nbmolviz.viewers.orbital_viewer import support_radii
+from nbmolviz.cubefile import read_cube, write_cube
 
 
 def test_color_translation():
@@ -16,6 +34,421 @@ def test_color_translation():
     assert translated_color == '0xff6347'
 
 
+def test_array_serialization_roundtrip():
+    arr = np.arange(12, dtype='float32').reshape(4, 3)
+    js = array_to_json(arr)
+    assert js['dtype'] == 'float32'
+    assert js['shape'] == [4, 3]
+    assert js['buffer'].nbytes == arr.nbytes
+
+    received = dict(js, buffer=js['buffer'].tobytes())
+    np.testing.assert_array_equal(array_from_json(received), arr)
+
+
+def test_style_table_interns_records():
+    table = StyleTable(1000)
+    table.assign(slice(None), {'visualization_type': 'stick'})
+    table.assign(np.arange(10), {'visualization_type': 'sphere', 'radius': 0.5})
+    table.set_field(np.arange(5, 15), 'color', '#ff0000')
+
+    assert table[0] == {'visualization_type': 'sphere', 'radius': 0.5}
+    assert table[7] == {'visualization_type': 'sphere', 'radius': 0.5, 'color': '#ff0000'}
+    assert table[12] == {'visualization_type': 'stick', 'color': '#ff0000'}
+    assert len(np.unique(table.ids)) == 4
+
+    table.remove_field(slice(None), 'color')
+    assert table[12] == {'visualization_type': 'stick'}
+
+
+def test_topology_is_rebuilt_when_bonds_change(benzene):
+    def bond_orders(atom1, atom2):
+        topology = get_topology(benzene)
+        return topology.bond_orders[(topology.bonds == [atom1, atom2]).all(axis=1)].tolist()
+
+    topology = get_topology(benzene)
+    assert get_topology(benzene) is topology
+
+    benzene.atoms[0].bond_to(benzene.atoms[3], 2)
+    assert len(get_topology(benzene).bonds) == len(topology.bonds) + 1
+    assert bond_orders(0, 3) == [2]
+    benzene.atoms[0].bond_to(benzene.atoms[3], 1)
+    assert bond_orders(0, 3) == [1]
+    benzene.delete_bond(benzene.atoms[0], benzene.atoms[3])
+    assert bond_orders(0, 3) == []
+
+    current = get_topology(benzene)
+    assert get_topology(benzene) is current
+    invalidate_topology(benzene)
+    assert get_topology(benzene) is not current
+
+
+def _record_messages(*widgets):
+    """ Replace the widgets' comms with a list of the messages they send
+    """
+    sent = []
+    for widget in widgets:
+        widget._send = lambda msg, buffers=None, widget=widget: sent.append((widget, msg))
+    return sent
+
+
+def test_message_history_is_bounded():
+    widget = MessageWidget()
+    for i in range(MessageWidget.MESSAGE_HISTORY + 10):
+        widget._handle_js_message(widget, {'event': 'function_done', 'call_id': i}, [])
+
+    assert len(widget.messages_received) == MessageWidget.MESSAGE_HISTORY
+    stats = widget.comm_stats()
+    assert stats['messages_received'] == MessageWidget.MESSAGE_HISTORY + 10
+    assert stats['pending_calls'] == 0
+
+
+class _StyleWidget(MessageWidget):
+    IDEMPOTENT_FUNCTIONS = {'setStyle': lambda args: args[0]}
+
+
+def test_js_calls_resolve_to_results_or_errors():
+    widget = MessageWidget()
+    sent = _record_messages(widget)
+    widget._handle_js_message(widget, {'event': 'ready'}, [])
+    succeeded = widget.call('getSelection')
+    failed = widget.call('getSelection')
+    cancelled = widget.call('getSelection')
+    assert cancelled.cancel()
+    widget.send_batch()
+
+    calls = sent[0][1]['content']['arguments']
+    assert len(calls) == 2  # the cancelled call isn't sent
+    results = [{'call_id': calls[0]['call_id'], 'result': [1, 2]},
+               {'call_id': calls[1]['call_id'], 'error': 'TypeError: oops'}]
+    widget._handle_js_message(widget, {'event': 'batch_done', 'results': results}, [])
+    assert succeeded.result() == [1, 2]
+    with pytest.raises(JavascriptError):
+        failed.result()
+    assert widget.comm_stats()['pending_calls'] == 0
+
+
+def test_js_calls_time_out():
+    widget = MessageWidget()
+    futures = []
+
+    @gen.coroutine
+    def call_and_wait():
+        futures.append(widget.call('getSelection', timeout=0.01))
+        yield gen.sleep(0.05)
+
+    IOLoop().run_sync(call_and_wait)
+    assert isinstance(futures[0].exception(), concurrent.futures.TimeoutError)
+    widget._handle_function_done({'call_id': 1, 'result': 'too late'})  # ignored
+
+
+def _comm_msg(content):
+    """ A custom message from the browser, as the kernel delivers it to the widget's comm
+    """
+    return {'content': {'data': {'method': 'custom', 'content': content}}, 'buffers': []}
+
+
+def test_js_calls_can_be_awaited_in_the_background():
+    asyncio = pytest.importorskip('asyncio')
+    widget = MessageWidget()
+    sent = _record_messages(widget)
+    widget._handle_msg(_comm_msg({'event': 'ready'}))
+
+    @gen.coroutine
+    def cell():  # starts a task awaiting the call, and finishes without waiting for it
+        raise gen.Return(asyncio.ensure_future(widget.call('getSelection')))
+
+    @gen.coroutine
+    def later():  # the kernel handles the reply once the cell is done
+        call = sent[-1][1]['content']
+        assert call['function_name'] == 'getSelection'
+        widget._handle_msg(_comm_msg({'event': 'function_done', 'call_id': call['call_id'],
+                                      'result': [3, 4]}))
+        result = yield task
+        raise gen.Return(result)
+
+    loop = IOLoop()
+    task = loop.run_sync(cell)
+    assert not task.done()
+    assert loop.run_sync(later) == [3, 4]
+
+
+def test_js_calls_reject_unknown_keywords():
+    widget = MessageWidget()
+    with pytest.raises(TypeError):
+        widget.call('getSelection', timout=5)
+    assert not widget._queued_calls
+
+
+def test_rapid_updates_are_coalesced():
+    widget = MessageWidget(max_update_rate=20.0)
+    sent = _record_messages(widget)
+
+    @gen.coroutine
+    def update_and_wait():
+        yield gen.sleep(0.1)  # let the update window opened by the initial sync expire
+        for i in range(5):
+            widget.viewerId = 'view%d' % i
+        yield gen.sleep(0.1)
+
+    IOLoop().run_sync(update_and_wait)
+    updates = [msg['state'] for w, msg in sent if msg['method'] == 'update']
+    assert updates == [{'viewerId': 'view0'}, {'viewerId': 'view4'}]
+    assert widget.dropped_updates == 3
+    assert widget.comm_stats()['dropped_updates'] == 3
+
+
+def test_batched_state_changes_are_sent_together():
+    widget = MessageWidget()
+    sent = _record_messages(widget)
+    with widget.batch():
+        widget.viewerId = 'first'
+        with widget.batch():
+            widget._dom_classes = ('molviz',)
+        widget.viewerId = 'second'
+        assert not sent
+
+    assert len(sent) == 1
+    assert sent[0][1]['state'] == {'viewerId': 'second', '_dom_classes': ('molviz',)}
+
+
+def test_json_bytes_are_counted_on_request():
+    widget = MessageWidget()
+    widget.send({'event': 'test'}, buffers=[b'1234'])
+    assert widget.comm_stats()['bytes_sent'] == 4
+
+    widget.count_json_bytes = True
+    widget.send({'event': 'test'}, buffers=[b'1234'])
+    assert widget.comm_stats()['bytes_sent'] > 8
+
+
+def test_unsynced_values_are_forgotten_when_replaced():
+    widget = MessageWidget()
+    sent = _record_messages(widget)
+    widget._set_unsynced(viewerId='sent elsewhere')
+    assert sent == []
+
+    widget.viewerId = 'synced'
+    assert sent[-1][1]['state'] == {'viewerId': 'synced'}
+    assert not widget._unsynced_values
+
+
+def test_calls_are_batched_and_deduplicated():
+    widget = _StyleWidget()
+    sent = _record_messages(widget)
+    first = widget.viewer('setStyle', ['atom1', 'red'])
+    other = widget.viewer('setStyle', ['atom2', 'red'])
+    last = widget.viewer('setStyle', ['atom1', 'blue'])
+    assert sent == []  # held until the view is ready
+
+    widget._handle_js_message(widget, {'event': 'ready'}, [])
+    assert len(sent) == 1
+    message = sent[0][1]['content']
+    assert message['function_name'] == 'batchCommands'
+    assert [call['arguments'] for call in message['arguments']] == [['atom2', 'red'],
+                                                                   ['atom1', 'blue']]
+
+    results = [{'call_id': call['call_id'], 'result': i}
+               for i, call in enumerate(message['arguments'])]
+    widget._handle_js_message(widget, {'event': 'batch_done', 'results': results}, [])
+    assert (first.result(), other.result(), last.result()) == (1, 0, 1)
+    assert widget.comm_stats()['dropped_updates'] == 1
+
+
+def test_queued_calls_are_not_forgotten():
+    widget = MessageWidget()
+    sent = _record_messages(widget)
+    futures = [widget.viewer('setStyle%d' % i, [])
+               for i in range(MessageWidget.MAX_PENDING_CALLS + 1)]
+    widget._handle_js_message(widget, {'event': 'ready'}, [])
+    assert len(sent[0][1]['content']['arguments']) == len(futures)
+    assert not any(future.done() for future in futures)
+
+    widget.viewer('getSelection', [])
+    widget.send_batch()
+    assert [future.cancelled() for future in futures[:3]] == [True, True, False]
+    assert widget.comm_stats()['pending_calls'] == MessageWidget.MAX_PENDING_CALLS
+
+
+def test_chunked_frames_are_cached(tmpdir):
+    positions = np.random.rand(25, 7, 3).astype('float32')
+    for i, start in enumerate(range(0, 25, 10)):
+        np.save(str(tmpdir.join('chunk%d.npy' % i)), positions[start:start+10])
+
+    frames = ChunkedFrames(str(tmpdir))
+    assert frames.num_frames == 25
+    cache = FrameCache(frames, size=3)
+    for i in (0, 1, 2, 0, 13, 24):
+        np.testing.assert_array_equal(cache.get_positions(i), positions[i])
+    assert len(cache) == 3
+    assert 0 in cache and 1 not in cache
+
+
+@pytest.mark.parametrize('precision,ratio', [(0.001, 4.2), (0.01, 7.5)])
+def test_frame_encoding_error_is_bounded(precision, ratio):
+    steps = np.random.RandomState(0).normal(0.0, 0.03, size=(60, 100, 3))  # angstroms per frame
+    frames = np.cumsum(steps, axis=0) + np.random.RandomState(1).uniform(-40, 40, size=(100, 3))
+    encoded = encode_frames(frames, precision=precision)
+
+    assert np.abs(decode_frames(encoded) - frames).max() <= precision / 2 + 1e-5
+    assert frames.astype('float32').nbytes > ratio * encoded_size(encoded)
+
+
+def test_cube_file_roundtrip(tmpdir):
+    values = np.random.normal(size=(5, 4, 7, 2))
+    path = str(tmpdir.join('orbitals.cube'))
+    write_cube(path, [-1.0, 0.0, 1.0], [0.2, 0.3, 0.4], values, orbital_ids=[3, 4])
+
+    cube = read_cube(path)
+    assert cube.shape == (5, 4, 7)
+    assert cube.orbital_ids == [3, 4]
+    np.testing.assert_allclose(cube.spacing, [0.2, 0.3, 0.4])
+    np.testing.assert_allclose(cube.orbital(1), values[..., 1], rtol=1e-5, atol=1e-6)
+    assert not tmpdir.join('orbitals.cube.npy').check()  # nothing written unless asked
+
+    mapped = read_cube(path, mmap=True)
+    assert tmpdir.join('orbitals.cube.npy').check()
+    np.testing.assert_array_equal(mapped.values, cube.values)
+
+
+def test_bohr_cube_file_is_converted_to_angstroms(tmpdir):
+    path = tmpdir.join('density.cube')
+    path.write('\n'.join([
+        'Written in bohr (positive point counts), like most Gaussian and ORCA output',
+        'SCF density',
+        '    2   -1.000000    0.000000    2.000000',
+        '    2    0.500000    0.000000    0.000000',
+        '    3    0.000000    0.400000    0.000000',
+        '    1    0.000000    0.000000    0.300000',
+        '    8    8.000000    0.000000    0.000000    0.000000',
+        '    1    1.000000    1.000000    1.500000   -0.500000'] +
+        [' %12.5E' % v for v in range(1, 7)]) + '\n')
+
+    cube = read_cube(str(path))
+    bohr = 0.52917721067
+    assert cube.shape == (2, 3, 1)
+    np.testing.assert_allclose(cube.origin, np.array([-1.0, 0.0, 2.0]) * bohr)
+    np.testing.assert_allclose(cube.spacing, np.array([0.5, 0.4, 0.3]) * bohr)
+    np.testing.assert_allclose(cube.atoms[:, :2], [[8, 8], [1, 1]])
+    np.testing.assert_allclose(cube.atoms[:, 2:], np.array([[0.0, 0.0, 0.0],
+                                                            [1.0, 1.5, -0.5]]) * bohr)
+    np.testing.assert_array_equal(cube.values.ravel(), np.arange(1, 7))
+
+
+def test_isosurface_of_sphere_is_closed():
+    points = np.linspace(-2.0, 2.0, 41)
+    x, y, z = np.meshgrid(points, points, points, indexing='ij')
+    radius = np.sqrt(x**2 + y**2 + z**2)
+    vertices, normals, faces = isosurface(-radius, -1.0, origin=[-2.0] * 3, spacing=[0.1] * 3)
+
+    np.testing.assert_allclose(np.sqrt((vertices**2).sum(axis=1)), 1.0, atol=0.01)
+    assert ((normals * vertices).sum(axis=1) > 0.95).all()  # pointing outwards
+    edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]),
+                    axis=1)
+    assert (np.unique(edges, axis=0, return_counts=True)[1] == 2).all()
+
+
+def test_adaptive_sampling_matches_dense_isosurface():
+    nuclei = np.array([[0.0, 0.0, 0.0], [1.1, 0.3, -0.2]])
+
+    def orbital(points):
+        values = np.zeros(len(points))
+        for sign, nucleus in zip((1, -1), nuclei):
+            r2 = ((points - nucleus) ** 2).sum(axis=1)
+            values += sign * (0.3 * np.exp(-0.8 * r2) + np.exp(-12 * r2))
+        return values
+
+    shape, origin, spacing = (50, 45, 45), np.full(3, -4.0), np.full(3, 0.2)
+    indices = np.stack(np.meshgrid(*[np.arange(n) for n in shape], indexing='ij'), axis=-1)
+    dense = orbital(origin + spacing * indices.reshape(-1, 3)).reshape(shape)
+    values, evaluations = adaptive_sample(orbital, shape, origin, spacing,
+                                          band=(0.001, 0.075), refine_points=nuclei)
+
+    assert evaluations < 0.3 * dense.size
+    for isoval in (0.002, 0.02):
+        np.testing.assert_allclose(isosurface(values, isoval, origin, spacing)[0],
+                                   isosurface(dense, isoval, origin, spacing)[0], atol=1e-4)
+
+
+def _custom_messages(sent, event):
+    return [msg['content'] for w, msg in sent
+            if msg['method'] == 'custom' and msg['content']['event'] == event]
+
+
+def test_moving_a_few_atoms_sends_a_patch(benzene):
+    viewer = GeometryViewer(benzene)
+    sent = _record_messages(viewer)
+    positions = viewer.positions.copy()
+    positions[3] += 0.5
+    viewer.set_positions(positions)
+
+    assert [msg['num_atoms'] for msg in _custom_messages(sent, 'positions_patch')] == [1]
+    assert not any('positions' in msg.get('state', {}) for w, msg in sent)
+    np.testing.assert_array_equal(viewer.positions, positions)
+
+    viewer.set_positions(positions + 1.0)  # everything moved - send the whole array
+    assert len(_custom_messages(sent, 'positions_patch')) == 1
+    assert any('positions' in msg.get('state', {}) for w, msg in sent)
+
+
+def test_shapes_are_sent_as_ops(h2):
+    viewer = GeometryViewer(h2)
+    sent = _record_messages(viewer)
+    sphere = viewer.draw_sphere(h2.atoms[0].position)
+    viewer.update_shape(sphere, radius=1.0)
+    viewer.remove(sphere)
+
+    ops = [message['ops'] for message in _custom_messages(sent, 'shapes')]
+    assert [[op['op'] for op in msg] for msg in ops] == [['add'], ['update'], ['remove']]
+    assert ops[1][0]['shape']['radius'] == 1.0
+    assert not viewer.shapes
+    assert not any('shapes' in msg.get('state', {}) for w, msg in sent)  # no full resync
+
+    with viewer.batch():
+        sphere = viewer.draw_sphere(h2.atoms[0].position)
+        viewer.update_shape(sphere, radius=1.0)
+    assert [op['op'] for op in _custom_messages(sent, 'shapes')[-1]['ops']] == ['add']
+
+
+def test_trajectory_sends_one_message_per_frame(h2):
+    frames = np.random.rand(10, h2.num_atoms, 3)
+    traj = TrajectoryViewer(frames, mol=h2)
+    traj.preload_frames(stop=5)
+    traj.viewer.max_update_rate = None
+    sent = _record_messages(traj.viewer)
+
+    for framenum in (3, 7, 4, 8):  # preloaded and not
+        traj.current_frame = framenum
+        assert len(sent) == 1
+        message = sent.pop()[1]
+        assert message['method'] == 'update'
+        assert message['state']['current_frame'] == framenum
+        assert ('positions' in message['state']) == (framenum >= 5)
+
+
+def test_closing_trajectory_stops_prefetching(h2):
+    traj = TrajectoryViewer(np.random.rand(10, h2.num_atoms, 3), mol=h2)
+    assert traj.frame_cache._executor is not None
+    traj.close()
+    assert traj.frame_cache._executor is None
+
+
+def test_playback_group_sends_one_message_per_step(h2):
+    frames = np.random.rand(10, h2.num_atoms, 3)
+    members = [TrajectoryViewer(frames, mol=h2) for i in range(3)]
+    members[0].preload_frames()
+    group = PlaybackGroup(members)
+    sent = _record_messages(group._sync, *[member.viewer for member in members])
+
+    for frame in range(1, 5):
+        group.frame = frame
+        assert len(sent) == 1 and sent.pop()[0] is group._sync
+    assert [member.viewer.current_frame for member in members] == [4, 4, 4]
+
+    group.release()
+    members[0].viewer.current_frame = 7  # "play in browser" is linked again
+    assert members[0].current_frame == 7
+
+
 @pytest.fixture
 def wfn_viewer(h2_rhf_augccpvdz):
     return h2_rhf_augccpvdz.draw_orbitals()
@@ -34,5 +467,29 @@ def test_generating_cubefile_works(wfn_viewer):
     assert isinstance(cb, unicode)
 
 
+def test_orbital_grid_resolution(wfn_viewer):
+    wfn_viewer.grid_resolution = 0.25
+    grid, values = wfn_viewer._calc_orb_grid(wfn_viewer.mol.wfn.orbitals.canonical[1])
+    assert (grid.deltas <= 0.25 * u.angstrom).all()
+    assert values.shape == (np.prod(grid.points),)
+
+
+def test_isosurface_cache_is_bounded(wfn_viewer):
+    wfn_viewer.numpoints = 32
+    wfn_viewer.isosurface_engine = 'python'
+    wfn_viewer.current_orbital = wfn_viewer.mol.wfn.orbitals.canonical[0]
+    for isoval in np.linspace(0.001, 0.05, 2 * wfn_viewer.MESH_CACHE_SIZE):
+        wfn_viewer.isoval = isoval
+    assert len(wfn_viewer._cached_meshes) == wfn_viewer.MESH_CACHE_SIZE
+
+
+def test_support_radii_reach_threshold():
+    weights, alphas, angular = np.array([2.0, -0.5, 1e-6]), np.array([1.0, 0.3, 1.0]), [0, 1, 0]
+    radii = support_radii(weights, alphas, angular, 0.001)
+    assert radii[2] == 0.0
+    np.testing.assert_allclose(np.abs(weights[:2]) * radii[:2] ** angular[:2]
+                               * np.exp(-alphas[:2] * radii[:2] ** 2), 0.001)
+
+
 def test_install_checks_doesnt_crash():
     subprocess.check_call('python -m nbmolviz check'.split())